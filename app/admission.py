@@ -0,0 +1,168 @@
+import math
+from dataclasses import dataclass
+from .decoding import choose_decode_flag, read_image_header
+from .executor import ExecutorSaturatedError
+from .image_processing import WORKING_WIDTH
+
+
+# 受け付け制御（アドミッションコントロール）と段階的な品質の引き下げ
+# リクエストごとに処理コスト（画像のバイト数とヘッダーの画像サイズから見積もる）を求め、
+# 実行中のコストの合計が上限を超えないように受け付けを制御する。
+# 混み合ってきたら、いきなり503を返すのではなく、まず処理を軽くして（プレビューなし →
+# 作業用画像を小さく・K-meansの反復を少なく → 服の領域の識別もなし）受け付け、
+# それでも期限（デッドライン）に間に合わない場合だけ503とRetry-Afterを返す。
+
+# 品質の引き下げレベルごとに、パイプラインの引数を上書きする値
+DEGRADATION_LEVELS = (
+    {}, # 0: 通常
+    {"preview_format": None}, # 1: プレビュー画像を作らない
+    {"preview_format": None, "working_width": 320, "max_iter": 20}, # 2: 作業用画像を小さく、反復を少なく
+    {"preview_format": None, "working_width": 200, "max_iter": 5, "segmentation": "none"}, # 3: 最小限の処理
+)
+# 各レベルの処理コストの目安（レベル0に対する倍率）
+DEGRADATION_COST_FACTORS = (1.0, 0.9, 0.5, 0.3)
+# 受け付ける時点で実行中のコストの合計が上限のこの割合以上なら、そのレベル以上に引き下げる
+DEGRADATION_THRESHOLDS = (0.0, 0.5, 0.75, 0.9)
+
+def estimate_cost(contents: bytes) -> float:
+    """
+    画像1枚の処理コストを見積もる（1.0 ≒ 数メガピクセルのスマホ写真1枚）。
+    画像全体はデコードせず、ヘッダーから読み取った画像サイズと縮小デコードの倍率を使う。
+
+    Args:
+        contents (bytes): 画像ファイルの中身。
+
+    Returns:
+        float: 処理コストの見積もり。
+    """
+    header = read_image_header(contents)
+    if header is None:
+        # サイズが分からない形式は、バイト数から見積もる（圧縮画像は1MBあたり数メガピクセル程度）
+        return 1.0 + len(contents) / 1_000_000
+    # 縮小デコードできるJPEGは、デコードする画素数が倍率の2乗分だけ減る
+    _, strategy = choose_decode_flag(header, WORKING_WIDTH)
+    factor = int(strategy.rsplit("_", 1)[1]) if strategy.startswith("jpeg_reduced_") else 1
+    decoded_megapixels = header.width * header.height / (factor * factor) / 1_000_000
+    # 色の抽出は作業用画像（幅WORKING_WIDTH）で行うので画像サイズによらずほぼ一定。デコードと縮小が画素数に比例する
+    return 1.0 + decoded_megapixels * 0.25 + len(contents) / 4_000_000
+
+
+class AdmissionRejectedError(ExecutorSaturatedError):
+    """最も軽い処理でも期限に間に合わない、または処理コストの上限を超える場合に送出される。"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after # 再試行までに待つべき秒数（Retry-Afterヘッダーの値）
+
+
+@dataclass
+class Admission:
+    """受け付けたリクエストの情報。with文を抜けると実行中のコストから差し引かれる。"""
+    controller: "AdmissionController"
+    cost: float # 品質の引き下げを反映したコスト
+    level: int # 品質の引き下げレベル（0は通常）
+    estimated_seconds: float # 待ち時間を含めた処理時間の見積もり
+    compute_seconds: float | None = None # 実際の処理時間（待ち時間を含まない）。分かったら記録する
+
+    @property
+    def overrides(self) -> dict:
+        """パイプラインの引数を上書きする値。"""
+        return DEGRADATION_LEVELS[self.level]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    実行中の処理コストの合計を上限以下に保ち、混み具合と期限に応じて品質の引き下げレベルを決める。
+    イベントループのスレッドからだけ呼ばれる前提（ロックは使わない）。
+    """
+
+    def __init__(self, max_workers: int, max_requests: int, max_cost: float, initial_seconds_per_cost: float = 0.1):
+        """
+        Args:
+            max_workers (int): 同時に処理を実行するワーカー数。
+            max_requests (int): 同時に受け付けるリクエスト数の上限（ワーカー数 + キューの長さ）。
+            max_cost (float): 同時に受け付ける処理コストの合計の上限。
+            initial_seconds_per_cost (float): コスト1あたりの処理時間（秒）の初期値。実際の処理時間から随時更新する。
+        """
+        self.max_workers = max_workers
+        self.max_requests = max_requests
+        self.max_cost = max_cost
+        self.seconds_per_cost = initial_seconds_per_cost
+        self._inflight_cost = 0.0
+        self._inflight_requests = 0
+        self._stats = {"admitted": 0, "degraded": 0, "rejected": 0}
+
+    @property
+    def inflight_cost(self) -> float:
+        """実行中（待機中を含む）の処理コストの合計。"""
+        return self._inflight_cost
+
+    def estimate_seconds(self, cost: float, level: int = 0) -> float:
+        """先に受け付けた処理を待つ時間を含めて、処理が終わるまでの時間を見積もる。"""
+        wait = self._inflight_cost / self.max_workers * self.seconds_per_cost
+        return wait + cost * DEGRADATION_COST_FACTORS[level] * self.seconds_per_cost
+
+    def admit(self, cost: float, deadline_seconds: float) -> Admission:
+        """
+        リクエストを受け付け、品質の引き下げレベルを決める。
+
+        Args:
+            cost (float): estimate_costで見積もった処理コスト。
+            deadline_seconds (float): この秒数以内に結果を返す必要がある。
+
+        Returns:
+            Admission: with文で囲んで処理を実行する。
+
+        Raises:
+            AdmissionRejectedError: どのレベルでも上限または期限に収まらない場合。
+        """
+        load = self._inflight_cost / self.max_cost
+        if self._inflight_requests >= self.max_requests:
+            load = float("inf") # 処理を軽くしても、ワーカーとキューに空きがない
+        for level, factor in enumerate(DEGRADATION_COST_FACTORS):
+            if level + 1 < len(DEGRADATION_THRESHOLDS) and load >= DEGRADATION_THRESHOLDS[level + 1]:
+                continue # 混み合っているので、より軽いレベルを試す
+            applied_cost = cost * factor
+            if load == float("inf") or (self._inflight_cost + applied_cost > self.max_cost and self._inflight_cost > 0):
+                continue # 上限を超える（何も実行していなければ大きな画像1枚でも受け付ける）
+            estimated = self.estimate_seconds(cost, level)
+            if estimated > deadline_seconds:
+                continue # 期限に間に合わないので、より軽いレベルを試す
+            self._inflight_cost += applied_cost
+            self._inflight_requests += 1
+            self._stats["admitted"] += 1
+            if level > 0:
+                self._stats["degraded"] += 1
+            return Admission(self, applied_cost, level, estimated)
+
+        self._stats["rejected"] += 1
+        # 実行中の処理がはけるまでの時間を、再試行までの目安にする
+        drain_seconds = self._inflight_cost / self.max_workers * self.seconds_per_cost
+        raise AdmissionRejectedError(
+            "サーバーが混み合っています。しばらくしてから再度お試しください。",
+            retry_after=max(1, math.ceil(drain_seconds)),
+        )
+
+    def _release(self, admission: Admission) -> None:
+        self._inflight_cost = max(0.0, self._inflight_cost - admission.cost)
+        self._inflight_requests -= 1
+        if admission.compute_seconds is not None and admission.cost > 0:
+            # コスト1あたりの処理時間を指数移動平均で更新する（待ち時間は estimate_seconds で別に足すので含めない）
+            observed = admission.compute_seconds / admission.cost
+            self.seconds_per_cost = 0.8 * self.seconds_per_cost + 0.2 * observed
+
+    def stats(self) -> dict:
+        """受け付け・引き下げ・拒否の件数と現在の負荷を返す。"""
+        return {
+            **self._stats,
+            "inflight_requests": self._inflight_requests,
+            "inflight_cost": round(self._inflight_cost, 3),
+            "max_cost": self.max_cost,
+            "seconds_per_cost": round(self.seconds_per_cost, 4),
+        }
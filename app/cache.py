@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    画像解析結果のキャッシュ。
+    アップロードされた画像のバイト列とパイプラインのパラメータのハッシュをキーにして結果を保存する。
+
+    - メモリ上のLRU（件数上限とTTL付き）
+    - 任意でディスク上の保存先（再起動後も残る）
+    - 同じキーへの同時リクエストは1回の計算にまとめる
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600, disk_dir: str | None = None):
+        """
+        Args:
+            max_entries (int): メモリに保持する最大件数。0の場合はキャッシュしない。
+            ttl_seconds (float): 結果を有効とみなす秒数。
+            disk_dir (str | None): ディスクキャッシュの保存先ディレクトリ。Noneの場合は使わない。
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict() # キー -> (保存時刻, 結果)
+        self._inflight: dict[str, asyncio.Future] = {} # 計算中のキー -> 結果を待つFuture
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(contents: bytes, params: dict) -> str:
+        """画像のバイト列とパラメータからキャッシュキー（SHA-256の16進文字列）を作る。"""
+        digest = hashlib.sha256(contents)
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def stats(self) -> dict:
+        """ヒット・ミスなどの統計を返す。"""
+        return {**self._stats, "entries": len(self._entries), "max_entries": self.max_entries}
+
+    def get(self, key: str) -> dict | None:
+        """メモリ上のキャッシュから結果を取り出す。期限切れや未登録の場合はNone。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.time() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key) # 最近使ったものを末尾へ（LRU）
+        return value
+
+    def put(self, key: str, value: dict, stored_at: float | None = None) -> None:
+        """メモリ上のキャッシュに結果を保存し、上限を超えたら古いものから削除する。"""
+        self._entries[key] = (stored_at if stored_at is not None else time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        # 1つのディレクトリにファイルが集中しないよう先頭2文字で分ける
+        return os.path.join(self.disk_dir, key[:2], f"{key}.pkl")
+
+    def _disk_get(self, key: str) -> tuple[float, dict] | None:
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if time.time() - stored_at > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return stored_at, pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _disk_put(self, key: str, value: dict) -> None:
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def get_or_compute(self, key: str, compute) -> dict:
+        """
+        キャッシュに結果があればそれを返し、なければ compute() を実行して保存する。
+        同じキーの計算がすでに実行中なら、その結果を待つ。
+
+        Args:
+            key (str): make_keyで作ったキャッシュキー。
+            compute: 結果の辞書を返すコルーチンを作る引数なしの関数。
+
+        Returns:
+            dict: 解析結果。
+        """
+        if not self.enabled:
+            return await compute()
+
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self._stats["hits"] += 1
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                return await self._compute_and_store(key, compute)
+            self._stats["coalesced"] += 1
+            value = await asyncio.shield(inflight)
+            if value is not None:
+                return value
+            # 計算していたリクエストが取り消された（クライアントの切断など）。待っていた側がやり直す
+
+    async def _compute_and_store(self, key: str, compute) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self.disk_dir:
+                entry = await asyncio.to_thread(self._disk_get, key)
+                if entry is not None:
+                    self._stats["disk_hits"] += 1
+                    stored_at, value = entry
+                    self.put(key, value, stored_at=stored_at)
+                    future.set_result(value)
+                    return value
+
+            self._stats["misses"] += 1
+            value = await compute()
+            # エラー結果（読み込めない画像など）や、混雑のため品質を下げた結果はキャッシュしない
+            if "error" not in value and not value.get("degradation_level"):
+                self.put(key, value)
+                if self.disk_dir:
+                    await asyncio.to_thread(self._disk_put, key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # 共有のFutureを取り消すと、同じキーを待っている他のリクエストまで失敗する。
+            # Noneを渡して「結果なし」と知らせ、待っている側に計算し直してもらう
+            future.set_result(None)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # 待っている人がいなくても「取得されなかった例外」の警告を出さない
+            raise
+        finally:
+            del self._inflight[key]
@@ -1,63 +1,104 @@
+import functools
+import hashlib
+import os
 import cv2
 import numpy as np
+import yaml # 色名のパレット（YAML）を読み込むため
+from . import config
 
 
 # from .image_processing import ExtractedColor # <-- 将来的に必要になるかも
 
-def rgb_to_hsv(rgb_tuple: tuple[int, int, int]) -> tuple[int, int, int]:
-    """
-    RGBタプルをHSVタプルに変換します。
-    HSV値はOpenCVの範囲（H:0-179, S:0-255, V:0-255）に変換されます。
-    """
-    # NumPy配列に変換してOpenCVに渡す
-    color_bgr = np.uint8([[list(rgb_tuple)[::-1]]]) # RGBをBGRに、タプルをリスト、さらに二次元配列に変換
-    color_hsv = cv2.cvtColor(color_bgr, cv2.COLOR_BGR2HSV)[0][0] #与えられたBGRカラー値をHSV空間に変換（色相、彩度、明度）の配列を取り出し格納
-    return tuple(color_hsv)
+# 色名の系統（大まかな色名）の一覧。色の組み合わせ提案のルールや色名の分布はこの系統名を使う
+# （ベクトル化した分類では、このリストの添字で系統を表す）
+COLOR_NAMES = ("黒", "白", "グレー", "赤", "ピンク", "オレンジ", "茶", "ベージュ", "黄", "黄緑", "緑", "カーキ", "青緑", "青", "ネイビー", "紫", "その他")
+
+# 色名のパレット
+# 抽出した色を、データファイル（app/color_palette.yaml）にCIELABで定義した数百の色名のうち、
+# Lab空間の距離（色差ΔE）が最も近いものに分類する。起動時にKD木（scipyのcKDTree）を作っておくので、
+# 色名を増やしても分類の時間はほとんど変わらず、クラスターの中心やピクセルをまとめて1回で分類できる。
+DEFAULT_PALETTE_PATH = os.path.join(os.path.dirname(__file__), "color_palette.yaml")
+
+class ColorPalette:
+    """色名のパレットと、Lab空間での最近傍探索の木。"""
+
+    def __init__(self, names: tuple[str, ...], families: np.ndarray, lab: np.ndarray, version: str):
+        """
+        Args:
+            names (tuple[str, ...]): 色名（例: "ボルドー"）。
+            families (np.ndarray): 各色名の系統（COLOR_NAMESの添字、uint8）。
+            lab (np.ndarray): 各色名のCIELABの値 (色名の数, 3)。
+            version (str): パレットの版（ファイルの中身のハッシュ。変換表やキャッシュを作り直すかの判定に使う）。
+        """
+        from scipy.spatial import cKDTree # 起動を速くするため、最初に使うときに読み込む
+        self.names = names
+        self.families = families
+        self.lab = lab
+        self.version = version
+        self._tree = cKDTree(lab)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def match(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        RGBの色をまとめて、最も近い色名に分類する。
+
+        Args:
+            rgb (np.ndarray): 最後の次元が (R, G, B) の配列（0-255）。
 
-def classify_hsv_color(hsv_tuple: tuple[int, int, int]) -> str: #どの色のカテゴリに分類されるかを文字列で返す
+        Returns:
+            np.ndarray: 各色の最も近い色名の添字（names, familiesの添字）。形はrgbの最後の次元を除いたもの。
+        """
+        rgb = np.asarray(rgb, np.float32)
+        lab = cv2.cvtColor(rgb.reshape(-1, 1, 3) / 255, cv2.COLOR_RGB2Lab).reshape(-1, 3)
+        _, index = self._tree.query(lab)
+        return index.reshape(rgb.shape[:-1])
+
+def load_palette(path: str) -> ColorPalette:
     """
-    HSV値に基づいて一般的な色名に分類します。
+    色名のパレットのファイルを読み込む。
 
     Args:
-        hsv_tuple (tuple): HSV値 (H:0-179, S:0-255, V:0-255)。
+        path (str): パレットのファイル（YAML）のパス。
 
     Returns:
-        str: 分類された色名。
+        ColorPalette: 色名のパレット。
+
+    Raises:
+        ValueError: パレットの書き方が正しくない場合。
     """
-    h, s, v = hsv_tuple #h 色相　s 彩度　V　明度
-
-    # 明度と彩度の閾値（調整必須）
-    # 明度が低い（暗い）場合は黒
-    if v < 40: # 暗さの閾値。例: 0-255
-        return "黒"
-    # 明度が高い（明るい）場合は白
-    if v > 200 and s < 50: # 明るさの閾値、彩度が低い
-        return "白"
-    # 彩度が低い場合はグレー
-    if s < 30: # 彩度の閾値
-        return "グレー"
-
-    # ここから色相（Hue）に基づく分類 (H: 0-179)
-    if (h >= 0 and h <= 10) or (h >= 160 and h <= 179):
-        return "赤"
-    elif h >= 11 and h <= 25:
-        return "オレンジ"
-    elif h >= 26 and h <= 35:
-        return "茶" # オレンジと黄色の中間だが、ファッションでは茶色も重要
-    elif h >= 36 and h <= 75:
-        return "黄"
-    elif h >= 76 and h <= 85:
-        return "黄緑"
-    elif h >= 86 and h <= 100:
-        return "緑"
-    elif h >= 101 and h <= 120:
-        return "青緑"
-    elif h >= 121 and h <= 140:
-        return "青"
-    elif h >= 141 and h <= 159:
-        return "紫"
-    else:
-        return "その他" # 上記の範囲にない場合
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = yaml.safe_load(raw.decode("utf-8")) or {}
+
+    names, families, lab = [], [], []
+    for family, entries in (data.get("colors") or {}).items():
+        if family not in COLOR_NAMES[:-1]:
+            raise ValueError(f"パレットの系統は {', '.join(COLOR_NAMES[:-1])} のいずれかにしてください: {family}")
+        for entry in entries or []:
+            if not isinstance(entry, dict) or "name" not in entry or len(entry.get("lab") or ()) != 3:
+                raise ValueError(f"パレットの色には name と lab（[L*, a*, b*]）を書いてください: {family} {entry}")
+            names.append(str(entry["name"]))
+            families.append(COLOR_NAMES.index(family))
+            lab.append([float(value) for value in entry["lab"]])
+    if not names:
+        raise ValueError("パレットに色がありません。")
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"パレットに同じ色名が複数あります: {', '.join(duplicates)}")
+    # 系統の一覧が変わった場合も変換表を作り直すよう、版にはCOLOR_NAMESも含める
+    version = hashlib.sha256(raw + "|".join(COLOR_NAMES).encode("utf-8")).hexdigest()[:16]
+    return ColorPalette(tuple(names), np.array(families, np.uint8), np.array(lab, np.float32), version)
+
+@functools.lru_cache(maxsize=1)
+def get_palette() -> ColorPalette:
+    """プロセス内で共有する色名のパレットを返す（最初の呼び出し時に読み込む）。"""
+    return load_palette(config.COLOR_PALETTE_PATH or DEFAULT_PALETTE_PATH)
+
+def palette_version() -> str:
+    """現在のパレットの版。解析結果のキャッシュキーに含める。"""
+    return get_palette().version
 
 def classify_extracted_colors(extracted_colors: list) -> list[dict]: # 抽出された色のリストを受け取り、それぞれを色名に分類辞書のリストで返す
     """
@@ -67,21 +108,26 @@ def classify_extracted_colors(extracted_colors: list) -> list[dict]: # 抽出さ
         extracted_colors (list): image_processing.pyから返されたExtractedColorオブジェクトのリスト。
 
     Returns:
-        list[dict]: 色名と割合を含む辞書のリスト。
+        list[dict]: 系統名（name, 例: "赤"）、パレットの色名（detailed_name, 例: "ボルドー"）と割合を含む辞書のリスト。
     """
+    if not extracted_colors:
+        return []
+
+    # 1色ずつ探すのではなく、全色をまとめて1回でパレットの最も近い色名を探す
+    palette = get_palette()
+    entries = palette.match(np.array([color_data.rgb for color_data in extracted_colors], np.uint8))
+
     classified_results = [] #からのリストを初期化
-    for color_data in extracted_colors: #抽出されたメインの色に対して色名を分類、結果を返す
-        rgb_tuple = color_data.rgb
-        percentage = color_data.percentage
-
-        hsv_tuple = rgb_to_hsv(rgb_tuple)
-        color_name = classify_hsv_color(hsv_tuple)
-
-        classified_results.append({
-            "rgb": rgb_tuple,
-            "name": color_name,
-            "percentage": percentage
-        })
+    for color_data, entry in zip(extracted_colors, entries): #抽出されたメインの色に対して色名を分類、結果を返す
+        result = {
+            "rgb": color_data.rgb,
+            "name": COLOR_NAMES[palette.families[entry]], # 組み合わせ提案のルールで使う系統名
+            "detailed_name": palette.names[entry],
+            "percentage": color_data.percentage
+        }
+        if getattr(color_data, "percentage_error", None) is not None: # 近似モードの場合は割合の誤差も返す
+            result["percentage_error"] = color_data.percentage_error
+        classified_results.append(result)
     return classified_results
 
 # (テスト用)
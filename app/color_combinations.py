@@ -1,22 +1,208 @@
+import itertools
+import logging
+import os
+import string
+import threading
+import time
+from dataclasses import dataclass, field
+import yaml # ルールファイル（YAML）を読み込むため
+from . import config
+from .color_classifier import COLOR_NAMES
+
+logger = logging.getLogger(__name__)
+
+
+# 色の組み合わせ提案
+# 提案のルールはコードではなくデータファイル（app/color_rules.yaml）に書く。
+# 起動時にルールを「(メインの色, 2番目の色) → 提案文のリスト」の表に変換しておくので、
+# 提案は表を引くだけになり、順番も毎回同じになる。ファイルが更新されたら自動で読み込み直す。
+# 領域ごとの色（トップス・ボトムスなど）がある場合は、領域のメインの色どうしの組み合わせも
+# 同じように「(1つ目の領域の色, 2つ目の領域の色) → 当てはまるルール」の表を引いて提案する。
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "color_rules.yaml")
+RULES_RELOAD_INTERVAL = 2.0 # ルールファイルの更新を確認する間隔（秒）
+
+_CONDITION_KEYS = (
+    "main", "main_not", "main_category", "main_category_not",
+    "secondary", "secondary_not", "secondary_category", "secondary_category_not",
+)
+# 領域の組み合わせのルール（pair_rules）の条件。色名・カテゴリのリストで指定するものと、true/falseで指定するもの
+_PAIR_CONDITION_KEYS = (
+    "first", "first_not", "first_category", "first_category_not",
+    "second", "second_not", "second_category", "second_category_not",
+)
+_PAIR_FLAG_KEYS = ("same_color", "same_category", "complementary")
+
+@dataclass
+class CompiledRules:
+    """ルールファイルを変換した提案の表。"""
+    categories: dict[str, str] # 色名 -> カテゴリ
+    complementary: dict[str, str] # 色名 -> 補色
+    rules: list[tuple[dict, str]] # (条件, 提案文) のリスト（ファイルに書かれた順）
+    fallback: str
+    no_colors: str
+    version: str # ルールファイルの更新日時（キャッシュキーに含めて、古い提案を返さないようにする）
+    table: dict[tuple[str, str | None], tuple[str, ...]] = field(default_factory=dict)
+    region_names: dict[str, str] = field(default_factory=dict) # 領域名 -> 提案文での呼び方（top -> トップス など）
+    pair_rules: list[tuple[dict, dict, str]] = field(default_factory=list) # (色の条件, true/falseの条件, 提案文) のリスト
+    pair_fallback: str = ""
+    pair_table: dict[tuple[str, str], tuple[str, ...]] = field(default_factory=dict) # (1つ目の色, 2つ目の色) -> 当てはまる提案文（領域名は未記入）
+
+def load_rules(path: str) -> CompiledRules:
+    """
+    ルールファイルを読み込み、既知の色名のすべての組み合わせについて提案文を前もって計算する。
+
+    Args:
+        path (str): ルールファイル（YAML）のパス。
+
+    Returns:
+        CompiledRules: 提案の表。
+
+    Raises:
+        ValueError: ルールファイルの書き方が正しくない場合。
+    """
+    with open(path, encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+
+    categories = {}
+    for category, names in (data.get("categories") or {}).items():
+        for name in names:
+            categories.setdefault(str(name), str(category)) # 先に書いたカテゴリを優先する
+
+    rules = []
+    for i, rule in enumerate(data.get("rules") or []):
+        if not isinstance(rule, dict) or "say" not in rule:
+            raise ValueError(f"ルール{i + 1}に say がありません。")
+        when = rule.get("when") or {}
+        unknown = set(when) - set(_CONDITION_KEYS)
+        if unknown:
+            raise ValueError(f"ルール{i + 1}に不明な条件があります: {', '.join(sorted(unknown))}")
+        fields = {name for _, name, _, _ in string.Formatter().parse(rule["say"]) if name}
+        if fields - {"main", "secondary", "complementary"}:
+            raise ValueError(f"ルール{i + 1}の提案文に使えない変数があります: {', '.join(sorted(fields))}")
+        rules.append(({key: frozenset(str(v) for v in values) for key, values in when.items()}, str(rule["say"])))
+
+    pair_rules = []
+    for i, rule in enumerate(data.get("pair_rules") or []):
+        if not isinstance(rule, dict) or "say" not in rule:
+            raise ValueError(f"領域の組み合わせのルール{i + 1}に say がありません。")
+        when = rule.get("when") or {}
+        unknown = set(when) - set(_PAIR_CONDITION_KEYS) - set(_PAIR_FLAG_KEYS)
+        if unknown:
+            raise ValueError(f"領域の組み合わせのルール{i + 1}に不明な条件があります: {', '.join(sorted(unknown))}")
+        fields = {name for _, name, _, _ in string.Formatter().parse(rule["say"]) if name}
+        if fields - {"first", "second", "first_region", "second_region"}:
+            raise ValueError(f"領域の組み合わせのルール{i + 1}の提案文に使えない変数があります: {', '.join(sorted(fields))}")
+        pair_rules.append((
+            {key: frozenset(str(v) for v in values) for key, values in when.items() if key in _PAIR_CONDITION_KEYS},
+            {key: bool(value) for key, value in when.items() if key in _PAIR_FLAG_KEYS},
+            str(rule["say"]),
+        ))
+
+    compiled = CompiledRules(
+        categories=categories,
+        complementary={str(k): str(v) for k, v in (data.get("complementary") or {}).items()},
+        rules=rules,
+        fallback=str(data.get("fallback", "この色の組み合わせについては、特別な提案はありません。")),
+        no_colors=str(data.get("no_colors", "画像から色を検出できませんでした。")),
+        version=str(os.stat(path).st_mtime_ns),
+        region_names={str(k): str(v) for k, v in (data.get("regions") or {}).items()},
+        pair_rules=pair_rules,
+        pair_fallback=str(data.get("pair_fallback", "{first_region}と{second_region}の組み合わせについては、特別な提案はありません。")),
+    )
+    # 分類器が返す色名とルールに出てくる色名のすべての組み合わせを前もって計算する
+    names = set(COLOR_NAMES) | set(categories) | set(compiled.complementary)
+    for conditions, _ in rules:
+        for key in ("main", "main_not", "secondary", "secondary_not"):
+            names |= conditions.get(key, frozenset())
+    for conditions, _, _ in pair_rules:
+        for key in ("first", "first_not", "second", "second_not"):
+            names |= conditions.get(key, frozenset())
+    for main in sorted(names):
+        for secondary in [None, *sorted(names)]:
+            compiled.table[(main, secondary)] = _evaluate(compiled, main, secondary)
+        for second in sorted(names):
+            compiled.pair_table[(main, second)] = _evaluate_pair(compiled, main, second)
+    return compiled
+
+def _evaluate(compiled: CompiledRules, main: str, secondary: str | None) -> tuple[str, ...]:
+    """(メインの色, 2番目の色) に当てはまるルールの提案文を、重複を除いてルールの順に並べる。"""
+    main_category = compiled.categories.get(main, "その他")
+    secondary_category = compiled.categories.get(secondary, "その他") if secondary is not None else None
+    values = {"main": main, "secondary": secondary, "complementary": compiled.complementary.get(main)}
+    subjects = {"main": main, "main_category": main_category, "secondary": secondary, "secondary_category": secondary_category}
+
+    suggestions = {} # 順番を保ったまま重複を除くため、dictのキーとして使う
+    for conditions, template in compiled.rules:
+        if not _matches(conditions, subjects):
+            continue
+        fields = {name for _, name, _, _ in string.Formatter().parse(template) if name}
+        if any(values[name] is None for name in fields):
+            continue # 補色がない色や、2番目の色がない場合はこのルールを使わない
+        suggestions[template.format(**values)] = None
+    return tuple(suggestions) or (compiled.fallback,)
+
+def _evaluate_pair(compiled: CompiledRules, first: str, second: str) -> tuple[str, ...]:
+    """(1つ目の領域の色, 2つ目の領域の色) に当てはまる領域の組み合わせのルールの提案文を、ルールの順に並べる（領域名は未記入）。"""
+    first_category = compiled.categories.get(first, "その他")
+    second_category = compiled.categories.get(second, "その他")
+    subjects = {"first": first, "first_category": first_category, "second": second, "second_category": second_category}
+    flags = {
+        "same_color": first == second,
+        "same_category": first_category == second_category,
+        "complementary": compiled.complementary.get(first) == second or compiled.complementary.get(second) == first,
+    }
+    templates = {}
+    for conditions, flag_conditions, template in compiled.pair_rules:
+        if _matches(conditions, subjects) and all(flags[key] == value for key, value in flag_conditions.items()):
+            templates[template] = None
+    return tuple(templates) or (compiled.pair_fallback,)
+
+def _matches(conditions: dict, subjects: dict) -> bool:
+    for key, allowed in conditions.items():
+        negate = key.endswith("_not")
+        subject = subjects[key.removesuffix("_not")]
+        if subject is None:
+            return False # 2番目の色についての条件は、2番目の色がなければ満たさない
+        if (subject in allowed) == negate:
+            return False
+    return True
+
+
+_rules: CompiledRules | None = None
+_rules_lock = threading.Lock()
+_rules_checked_at = 0.0
+
+def get_rules() -> CompiledRules:
+    """
+    現在の提案の表を返す。ルールファイルが更新されていたら読み込み直す（確認はRULES_RELOAD_INTERVAL秒に1回）。
+    読み込みに失敗した場合は、前回の表をそのまま使う。
+    """
+    global _rules, _rules_checked_at
+    now = time.monotonic()
+    if _rules is not None and now - _rules_checked_at < RULES_RELOAD_INTERVAL:
+        return _rules
+    with _rules_lock:
+        if _rules is not None and now - _rules_checked_at < RULES_RELOAD_INTERVAL:
+            return _rules
+        _rules_checked_at = now
+        path = config.COLOR_RULES_PATH or DEFAULT_RULES_PATH
+        try:
+            if _rules is None or str(os.stat(path).st_mtime_ns) != _rules.version:
+                _rules = load_rules(path)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            if _rules is None:
+                raise
+            logger.warning("色の組み合わせルールを読み込めませんでした（前回のルールを使います）: %s", e)
+    return _rules
 
 def get_color_category(color_name: str) -> str: #->はこの型で返すという意味
     """
     色名をより広いカテゴリに分類します。
     色の組み合わせルールを作るために使用します。
     """
-    neutral_colors = ["黒", "白", "グレー", "ベージュ", "茶"]
-    warm_colors = ["赤", "オレンジ", "黄", "茶", "ピンク"] # ピンクは赤系として含める
-    cool_colors = ["青", "緑", "紫", "青緑", "黄緑"] # 黄緑は寒色寄りとして
-
-    if color_name in neutral_colors:
-        return "ニュートラル"
-    elif color_name in warm_colors:
-        return "暖色"
-    elif color_name in cool_colors:
-        return "寒色"
-    else:
-        return "その他"
-    
+    return get_rules().categories.get(color_name, "その他")
+
 def suggest_color_combinations(classified_colors: list[dict]) -> list[str]:
     """
     分類された色名に基づいて、ファッションにおける色の組み合わせを提案します。
@@ -26,79 +212,61 @@ def suggest_color_combinations(classified_colors: list[dict]) -> list[str]:
                                        例: [{"rgb": (R,G,B), "name": "赤", "percentage": 70.0}]
 
     Returns:
-        list[str]: 提案される色の組み合わせのヒント。
+        list[str]: 提案される色の組み合わせのヒント（ルールファイルに書かれた順）。
     """
+    rules = get_rules()
     if not classified_colors:
-        return ["画像から色を検出できませんでした。"]
-
-    # 主となる色（最も割合が高い色）を取得
-    main_color_data = classified_colors[0] #分類された色のリストから一番メインの色を取り出し代入する
-    main_color_name = main_color_data["name"] #色名だけ取り出して代入
-    main_color_rgb = main_color_data["rgb"] # RGB値も参考にできる
-    main_color_category = get_color_category(main_color_name) #メインの色名からさらに抽象度の高いカテゴリを取得代入
-
-    suggestions = [] #提案用の空のリストを生成
-
-    # 1. ニュートラルカラーとの組み合わせ
-    if main_color_name not in ["黒", "白", "グレー"]:
-        suggestions.append(f"{main_color_name}には、白、黒、グレーなどのニュートラルカラーがよく合います。")
-    
-    # 2. 類似色との組み合わせ (例: 青には青緑、緑には黄緑など)
-    if main_color_name == "赤":
-        suggestions.append("赤には、ピンクやオレンジなどの類似色でグラデーションを作るのもおすすめです。")
-    elif main_color_name == "青":
-        suggestions.append("青には、青緑や紫などの類似色で統一感を出すと良いでしょう。")
-    elif main_color_name == "黄":
-        suggestions.append("黄には、オレンジや黄緑などの類似色で明るい印象に。")
-    elif main_color_name == "緑":
-        suggestions.append("緑には、黄緑や青緑などの類似色で自然な印象に。")
-
-    # 3. 補色（コントラスト）との組み合わせ
-    # HSVの色相環で反対側に位置する色　特定の色をキーとして補色を結び付け
-    complementary_colors = {
-        "赤": "緑", "緑": "赤",
-        "青": "オレンジ", "オレンジ": "青",
-        "黄": "紫", "紫": "黄",
-        "茶": "青緑", # ファッションにおける茶色の補色は青〜青緑系
-        "ピンク": "緑" # ピンクの補色は緑系
-    }
-    if main_color_name in complementary_colors: #メインの色に対する補色が設定せれていれば
-        comp_color = complementary_colors[main_color_name] #辞書から対応する色を取り出す
-        suggestions.append(f"{main_color_name}には、{comp_color}を差し色にしてコントラストを楽しむこともできます。")# リストに追加
-
-    # 4.メインの色のカテゴリに応じて提案
-    if main_color_category == "暖色": 
-        suggestions.append("暖色系の色は、暖かみがあり親しみやすい印象を与えます。")
-    elif main_color_category == "寒色":
-        suggestions.append("寒色系の色は、クールで落ち着いた印象を与えます。")
-
-    # 5. 特定の色のヒント
-    if main_color_name == "黒":
-        suggestions.append("黒はどんな色とも合わせやすい万能カラーです。")
-    elif main_color_name == "白":
-        suggestions.append("白は清潔感があり、他の色を引き立てます。")
-    elif main_color_name == "グレー":
-        suggestions.append("グレーは上品で洗練された印象を与え、どんな色とも相性が良いです。")
-    elif main_color_name == "ベージュ":
-        suggestions.append("ベージュはナチュラルで優しい印象を与え、オフィススタイルにも最適です。")
-
-    # 検出された複数の色を考慮した提案（簡易版　今後改良）
-    if len(classified_colors) > 1:
-        # 2番目に割合が高い色を取得
-        secondary_color_data = classified_colors[1]
-        secondary_color_name = secondary_color_data["name"]
-        secondary_color_category = get_color_category(secondary_color_name) 
-        # ニュートラル + 色物 の組み合わせ
-        if main_color_category == "ニュートラル" and secondary_color_category != "ニュートラル":
-             suggestions.append(f"{main_color_name}と{secondary_color_name}の組み合わせは、モダンでバランスが良いでしょう。")
-        elif main_color_category != "ニュートラル" and secondary_color_category == "ニュートラル":
-             suggestions.append(f"{main_color_name}に{secondary_color_name}を合わせると、メインの色が引き立ちます。")
-
-    if not suggestions:
-        suggestions.append("この色の組み合わせについては、特別な提案はありません。")
-
-    # 重複する提案を排除し、ユニークなリストにする
-    return list(set(suggestions))
+        return [rules.no_colors]
+
+    # 主となる色（最も割合が高い色）と、2番目に割合が高い色で表を引く
+    main_color_name = classified_colors[0]["name"]
+    secondary_color_name = classified_colors[1]["name"] if len(classified_colors) > 1 else None
+    key = (main_color_name, secondary_color_name)
+    suggestions = rules.table.get(key)
+    if suggestions is None:
+        # 表にない色名（ルールファイルにも分類器にもない色）はその場で計算して表に加える
+        suggestions = rules.table[key] = _evaluate(rules, main_color_name, secondary_color_name)
+    return list(suggestions)
+
+def suggest_region_pairs(regions: list[dict]) -> list[dict]:
+    """
+    領域（トップス・ボトムス・小物など）のメインの色どうしの組み合わせについて提案します。
+    同じ服の濃淡どうしではなく、トップスとボトムスのように別の服の色の相性を見るためのものです。
+
+    Args:
+        regions (list[dict]): 上から順の領域のリスト。
+                              例: [{"name": "top", "classified_colors": [...]}, {"name": "bottom", "classified_colors": [...]}]
+
+    Returns:
+        list[dict]: 領域の組み合わせごとの {"regions": [領域名, 領域名], "colors": [色名, 色名], "suggestions": [提案文]}。
+                    色を検出できなかった領域は組み合わせに含めない。
+    """
+    rules = get_rules()
+    results = []
+    colored = [region for region in regions if region["classified_colors"]]
+    for first, second in itertools.combinations(colored, 2):
+        first_color = first["classified_colors"][0]["name"]
+        second_color = second["classified_colors"][0]["name"]
+        key = (first_color, second_color)
+        templates = rules.pair_table.get(key)
+        if templates is None:
+            templates = rules.pair_table[key] = _evaluate_pair(rules, first_color, second_color)
+        values = {
+            "first": first_color,
+            "second": second_color,
+            "first_region": rules.region_names.get(first["name"], first["name"]),
+            "second_region": rules.region_names.get(second["name"], second["name"]),
+        }
+        results.append({
+            "regions": [first["name"], second["name"]],
+            "colors": [first_color, second_color],
+            "suggestions": [template.format(**values) for template in templates],
+        })
+    return results
+
+def rules_version() -> str:
+    """現在のルールの版（ルールファイルの更新日時）。解析結果のキャッシュキーに含める。"""
+    return get_rules().version
 
 # (テスト用)
 if __name__ == "__main__":
@@ -108,7 +276,4 @@ if __name__ == "__main__":
         {"rgb": (240, 240, 240), "name": "白", "percentage": 15.10},
         {"rgb": (100, 100, 100), "name": "グレー", "percentage": 9.67},
     ]
-    # suggestions = suggest_color_combinations(test_classified_colors)
-    # for s in suggestions:
-    #     print(s)
     pass
\ No newline at end of file
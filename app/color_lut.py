@@ -0,0 +1,105 @@
+import functools
+import os
+import numpy as np
+from . import config
+from .color_classifier import COLOR_NAMES, get_palette
+
+
+# RGB→色名の変換表（ルックアップテーブル）
+# RGBの各チャンネルを64段階に量子化した 64×64×64 = 262144 通りすべてについて、
+# パレットの最も近い色名の系統（COLOR_NAMESの添字）を事前に計算しておく。
+# ピクセルごとの分類が「配列の添字参照」だけになるので、画像全体を一度に分類できる。
+
+LUT_LEVELS = 64 # 1チャンネルあたりの段階数
+_LUT_SHIFT = 8 - int(np.log2(LUT_LEVELS)) # 256段階をLUT_LEVELS段階に落とすためのビットシフト量
+_LUT_BITS = 8 - _LUT_SHIFT
+
+def build_color_lut() -> np.ndarray:
+    """
+    量子化したRGBの全組み合わせを色名に分類し、変換表を作る。
+
+    Returns:
+        np.ndarray: 長さ LUT_LEVELS**3 のuint8配列。添字は (R << 12) | (G << 6) | B（量子化後の値）。
+    """
+    step = 256 // LUT_LEVELS
+    levels = np.arange(LUT_LEVELS, dtype=np.uint8) * step + step // 2 # 各段階の中央の値を代表値にする
+    r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+    cube_rgb = np.stack([r, g, b], axis=-1).reshape(-1, 3)
+    palette = get_palette()
+    return palette.families[palette.match(cube_rgb)] # 全組み合わせを1回の最近傍探索で分類
+
+def load_color_lut(path: str | None = None) -> np.ndarray:
+    """
+    変換表を読み込む。pathのファイルがあればメモリマップで開き（複数のワーカーでメモリを共有できる）、
+    なければ計算して保存する。
+
+    Args:
+        path (str | None): 変換表を保存する.npyファイルのパス。Noneの場合は毎回計算する。
+                           パレットの版を「パス.version」に保存し、パレットが変わっていたら作り直す。
+
+    Returns:
+        np.ndarray: 色名の変換表。
+    """
+    version = get_palette().version
+    version_path = f"{path}.version"
+    if path and os.path.exists(path) and _read_text(version_path) == version:
+        lut = np.load(path, mmap_mode="r")
+        if lut.shape == (LUT_LEVELS ** 3,) and lut.dtype == np.uint8:
+            return lut
+    lut = build_color_lut()
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, lut)
+        os.replace(tmp_path, path)
+        with open(f"{version_path}.{os.getpid()}.tmp", "w") as f:
+            f.write(version)
+        os.replace(f"{version_path}.{os.getpid()}.tmp", version_path)
+        lut = np.load(path, mmap_mode="r")
+    return lut
+
+def _read_text(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+@functools.lru_cache(maxsize=1)
+def get_color_lut() -> np.ndarray:
+    """プロセス内で共有する変換表を返す（最初の呼び出し時に読み込む）。"""
+    return load_color_lut(config.COLOR_LUT_PATH or None)
+
+def classify_pixels(pixels_rgb: np.ndarray) -> np.ndarray:
+    """
+    ピクセルの配列をまとめて色名の添字に分類する。
+
+    Args:
+        pixels_rgb (np.ndarray): (N, 3) のRGBピクセル配列（uint8）。
+
+    Returns:
+        np.ndarray: 各ピクセルのCOLOR_NAMESの添字（uint8）。
+    """
+    quantized = (pixels_rgb >> _LUT_SHIFT).astype(np.int32)
+    index = (quantized[:, 0] << (2 * _LUT_BITS)) | (quantized[:, 1] << _LUT_BITS) | quantized[:, 2]
+    return get_color_lut()[index]
+
+def color_name_distribution(pixels_rgb: np.ndarray) -> list[dict]:
+    """
+    全ピクセルを色名に分類し、色名ごとの割合を求める。
+
+    Args:
+        pixels_rgb (np.ndarray): (N, 3) のRGBピクセル配列（uint8）。
+
+    Returns:
+        list[dict]: {"name": 色名, "percentage": 割合} のリスト（割合が高い順、0%の色名は含まない）。
+    """
+    if len(pixels_rgb) == 0:
+        return []
+    counts = np.bincount(classify_pixels(pixels_rgb), minlength=len(COLOR_NAMES))
+    distribution = [
+        {"name": COLOR_NAMES[i], "percentage": round(float(counts[i] / len(pixels_rgb) * 100), 2)}
+        for i in np.flatnonzero(counts)
+    ]
+    distribution.sort(key=lambda x: x["percentage"], reverse=True)
+    return distribution
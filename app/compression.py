@@ -0,0 +1,269 @@
+import hashlib
+import time
+import zlib
+from dataclasses import dataclass, field
+from fastapi.responses import Response
+from . import metrics
+
+# brotliはインストールされていなければgzipだけを使う
+try:
+    import brotli
+except ImportError: # pragma: no cover - requirements.txtに含まれているので通常は入っている
+    brotli = None
+
+
+# レスポンスの圧縮
+# クライアントのAccept-Encodingに応じて、JSONやHTMLなどのレスポンスをbrotliまたはgzipで圧縮する。
+# リクエストごとの圧縮はCPUを使うので、圧縮率がほぼ頭打ちになる軽めのレベル（gzip 5, brotli 4）にし、
+# 小さなレスポンス（1パケットに収まる程度）は圧縮しない。
+# トップページのように内容が変わらないものは、起動時に最高レベルで1回だけ圧縮しておき、そのまま返す。
+
+ENCODINGS = ("br", "gzip") # 対応している圧縮方式（同じ優先度なら前にあるものを使う）
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/x-ndjson", "application/msgpack", "application/javascript", "image/svg+xml",
+)
+DEFAULT_MINIMUM_SIZE = 1024 # これより小さいレスポンスは圧縮しない（バイト）
+DEFAULT_GZIP_LEVEL = 5 # 1（速い）〜9（小さい）。JSONでは6以上にしても数%しか小さくならない
+DEFAULT_BROTLI_QUALITY = 4 # 0（速い）〜11（小さい）。4でgzip 6より速く、より小さくなる
+STATIC_GZIP_LEVEL = 9 # 起動時に1回だけ圧縮するものは最高レベルで
+STATIC_BROTLI_QUALITY = 11
+
+COMPRESSION_SECONDS = metrics.registry.histogram(
+    "fashion_compression_seconds", "レスポンスの圧縮にかかった時間（秒）", ("encoding",),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+)
+COMPRESSION_RATIO = metrics.registry.histogram(
+    "fashion_compression_ratio", "レスポンスの圧縮率（圧縮前のバイト数 / 圧縮後のバイト数）", ("encoding",),
+    buckets=(1, 1.5, 2, 3, 4, 6, 8, 12, 16, 32),
+)
+COMPRESSION_BYTES_IN = metrics.registry.counter("fashion_compression_input_bytes_total", "圧縮したレスポンスの圧縮前の合計バイト数", ("encoding",))
+COMPRESSION_BYTES_OUT = metrics.registry.counter("fashion_compression_output_bytes_total", "圧縮したレスポンスの圧縮後の合計バイト数", ("encoding",))
+
+def choose_encoding(accept_encoding: str | None, encodings: tuple[str, ...] = ENCODINGS) -> str | None:
+    """
+    Accept-Encodingヘッダーから、使う圧縮方式を選ぶ（q値が最も高いもの。q=0は使わない）。
+
+    Args:
+        accept_encoding (str | None): リクエストのAccept-Encodingヘッダー。
+        encodings (tuple[str, ...]): サーバーが使える圧縮方式（優先する順）。
+
+    Returns:
+        str | None: "br" または "gzip"。圧縮しない場合はNone。
+    """
+    if not accept_encoding:
+        return None
+    available = [encoding for encoding in encodings if encoding != "br" or brotli is not None]
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, *parameters = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.lower()] = q
+    best = None
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best is not None else None
+
+
+class _StreamCompressor:
+    """少しずつ届くレスポンス（NDJSONなど）を、届いた分だけ圧縮して送れるようにするための圧縮器。"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31) # 31: gzip形式のヘッダーを付ける
+
+    def compress(self, data: bytes, finish: bool = False) -> bytes:
+        """dataを圧縮し、受け取った側がすぐに展開できるところまで出力する（finish=Trueで終わりにする）。"""
+        if self.encoding == "br":
+            output = self._compressor.process(data)
+            return output + (self._compressor.finish() if finish else self._compressor.flush())
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+def compress_bytes(data: bytes, encoding: str, gzip_level: int = DEFAULT_GZIP_LEVEL, brotli_quality: int = DEFAULT_BROTLI_QUALITY) -> bytes:
+    """バイト列をまとめて圧縮する。"""
+    return _StreamCompressor(encoding, gzip_level, brotli_quality).compress(data, finish=True)
+
+
+@dataclass
+class StaticAsset:
+    """起動時に圧縮しておいた、内容が変わらないレスポンス（トップページなど）。"""
+    media_type: str
+    variants: dict[str, bytes] = field(default_factory=dict) # 圧縮方式（"identity", "gzip", "br"）-> 中身
+    etags: dict[str, str] = field(default_factory=dict) # 圧縮方式 -> 強いETag（圧縮方式ごとに別の値）
+
+def precompress(data: bytes, media_type: str) -> StaticAsset:
+    """
+    内容が変わらないレスポンスを、対応しているすべての圧縮方式で最高レベルで圧縮しておく。
+
+    Args:
+        data (bytes): レスポンスの中身。
+        media_type (str): Content-Type。
+
+    Returns:
+        StaticAsset: 圧縮方式ごとの中身とETag。
+    """
+    asset = StaticAsset(media_type)
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    asset.variants["identity"] = data
+    asset.etags["identity"] = f'"{digest}"'
+    for encoding in ENCODINGS:
+        if encoding == "br" and brotli is None:
+            continue
+        asset.variants[encoding] = compress_bytes(data, encoding, STATIC_GZIP_LEVEL, STATIC_BROTLI_QUALITY)
+        asset.etags[encoding] = f'"{digest}-{encoding}"'
+    return asset
+
+def asset_response(asset: StaticAsset, accept_encoding: str | None, if_none_match: str | None) -> Response:
+    """
+    StaticAssetをAccept-Encodingに合った圧縮方式で返す。If-None-MatchのETagが一致すれば本体なしの304を返す。
+    Cache-Control: no-cache なので、ブラウザは毎回ETagで確認し、変わっていなければ304で済む。
+    """
+    encoding = choose_encoding(accept_encoding, tuple(name for name in ENCODINGS if name in asset.variants)) or "identity"
+    etag = asset.etags[encoding]
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    # プロキシが弱いETag（W/"..."）に書き換えることがあるので、W/を除いて比べる
+    if if_none_match is not None and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=asset.variants[encoding], media_type=asset.media_type, headers=headers)
+
+
+class CompressionMiddleware:
+    """
+    レスポンスをAccept-Encodingに応じてbrotliまたはgzipで圧縮するASGIミドルウェア。
+    - 本体が1回で送られるレスポンス: minimum_size以上なら圧縮し、かかった時間と圧縮率をServer-Timingヘッダーに追加する
+    - 少しずつ送られるレスポンス（StreamingResponse）: 届いた分ごとに圧縮してすぐに送る（NDJSONの各行が遅れないように）
+    - すでにContent-Encodingがあるもの（起動時に圧縮したトップページ）や、画像などの圧縮しても小さくならない形式はそのまま
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = DEFAULT_MINIMUM_SIZE,
+        gzip_level: int = DEFAULT_GZIP_LEVEL,
+        brotli_quality: int = DEFAULT_BROTLI_QUALITY,
+        encodings: tuple[str, ...] = ENCODINGS,
+    ):
+        """
+        Args:
+            app: 次に呼び出すASGIアプリ。
+            minimum_size (int): これより小さいレスポンスは圧縮しない（バイト）。
+            gzip_level (int): gzipの圧縮レベル（1〜9）。
+            brotli_quality (int): brotliの圧縮レベル（0〜11）。
+            encodings (tuple[str, ...]): 使う圧縮方式（優先する順。空の場合は圧縮しない）。
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = encodings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None # 少しずつ送られるレスポンスを圧縮中の場合の圧縮器
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                response_headers = {key.lower(): value for key, value in message.get("headers", [])}
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1").lower()
+                passthrough = (
+                    b"content-encoding" in response_headers
+                    or message["status"] < 200 or message["status"] in (204, 304)
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message # 本体を見て、圧縮するか決めてから送る
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None and not more_body:
+                # 本体が1回で届いた（通常のレスポンス）: 小さければそのまま、大きければまとめて圧縮する
+                if len(body) < self.minimum_size:
+                    await send(start_message)
+                    await send(message)
+                    return
+                started = time.perf_counter()
+                compressed = compress_bytes(body, encoding, self.gzip_level, self.brotli_quality)
+                seconds = time.perf_counter() - started
+                self._record(encoding, len(body), len(compressed), seconds)
+                ratio = len(body) / max(1, len(compressed))
+                server_timing = f'compress;dur={seconds * 1000:.2f};desc="{encoding} {ratio:.1f}x"'
+                await send(self._compressed_start(start_message, encoding, len(compressed), server_timing))
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            if compressor is None:
+                # 少しずつ届くレスポンス: 長さが分からないのでContent-Lengthを外し、届いた分ごとに圧縮して送る
+                compressor = _StreamCompressor(encoding, self.gzip_level, self.brotli_quality)
+                await send(self._compressed_start(start_message, encoding, None))
+            started = time.perf_counter()
+            compressed = compressor.compress(body, finish=not more_body)
+            self._record(encoding, len(body), len(compressed), time.perf_counter() - started, ratio=False)
+            await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+        await self.app(scope, receive, compressing_send)
+
+    @staticmethod
+    def _compressed_start(message: dict, encoding: str, content_length: int | None, server_timing: str | None = None) -> dict:
+        """レスポンスヘッダーを圧縮後のものに書き換える。"""
+        headers = []
+        vary = None
+        existing_timing = None
+        for key, value in message.get("headers", []):
+            name = key.lower()
+            if name == b"content-length":
+                continue
+            if name == b"vary":
+                vary = value
+                continue
+            if name == b"server-timing" and server_timing is not None:
+                existing_timing = value
+                continue
+            headers.append((key, value))
+        headers.append((b"content-encoding", encoding.encode("latin-1")))
+        # 同じURLでもAccept-Encodingによって中身が変わることをキャッシュに伝える
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        if server_timing is not None:
+            timing = server_timing.encode("latin-1")
+            headers.append((b"server-timing", existing_timing + b", " + timing if existing_timing else timing))
+        return {**message, "headers": headers}
+
+    @staticmethod
+    def _record(encoding: str, input_bytes: int, output_bytes: int, seconds: float, ratio: bool = True) -> None:
+        COMPRESSION_SECONDS.observe(seconds, encoding=encoding)
+        COMPRESSION_BYTES_IN.inc(input_bytes, encoding=encoding)
+        COMPRESSION_BYTES_OUT.inc(output_bytes, encoding=encoding)
+        if ratio: # 少しずつ送る場合は1回ごとの圧縮率にあまり意味がないので、合計バイト数だけを記録する
+            COMPRESSION_RATIO.observe(input_bytes / max(1, output_bytes), encoding=encoding)
@@ -0,0 +1,129 @@
+import os # 環境変数から設定値を読み込むため
+
+
+# アプリケーション全体の設定値をまとめたモジュール
+# すべての値は環境変数で上書きできる（Dockerの -e オプションなどで指定）
+
+def _env_str(name: str, default: str) -> str:
+    """環境変数を文字列として読み込む。未設定の場合はデフォルト値を返す。"""
+    value = os.environ.get(name)
+    return value if value not in (None, "") else default
+
+def _env_int(name: str, default: int) -> int:
+    """環境変数を整数として読み込む。未設定または不正な値の場合はデフォルト値を返す。"""
+    value = os.environ.get(name)
+    try:
+        return int(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    """環境変数を小数として読み込む。未設定または不正な値の場合はデフォルト値を返す。"""
+    value = os.environ.get(name)
+    try:
+        return float(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+
+# --- 画像処理の実行バックエンド ---
+# "process": プロセスプール（CPUコア数に応じてスケールする）
+# "thread": スレッドプール（OpenCVはGILを解放するので、メモリを節約したい場合に）
+EXECUTOR_BACKEND = _env_str("EXECUTOR_BACKEND", "process")
+# ワーカー数（0の場合はCPUコア数）
+EXECUTOR_WORKERS = _env_int("EXECUTOR_WORKERS", 0) or (os.cpu_count() or 1)
+# ワーカーが埋まっているときに待たせておけるリクエスト数（これを超えると503を返す）
+EXECUTOR_MAX_QUEUE = _env_int("EXECUTOR_MAX_QUEUE", 16)
+# ワーカー1つあたりのネイティブライブラリのスレッド数（0の場合はライブラリの既定値で、多くはCPUコア数）
+# BLAS_THREADS: numpyやscikit-learnのk-means（BLAS/OpenMP）、OPENCV_THREADS: OpenCVの並列処理
+BLAS_THREADS = _env_int("BLAS_THREADS", 0)
+OPENCV_THREADS = _env_int("OPENCV_THREADS", 0)
+
+# --- 受け付け制御 ---
+# 同時に受け付ける処理コストの合計の上限（0の場合は (ワーカー数 + キューの長さ)×2。コスト1 ≒ 数メガピクセルの写真1枚）
+ADMISSION_MAX_COST = _env_int("ADMISSION_MAX_COST", 0)
+# クライアントが期限を指定しない場合の期限（ミリ秒）。間に合わない見込みなら処理を軽くし、それでも無理なら503を返す
+DEFAULT_DEADLINE_MS = _env_int("DEFAULT_DEADLINE_MS", 10000)
+
+# --- アップロードの制限 ---
+# 1回のリクエストで受け付ける本体の最大バイト数（超えた時点で読み込みを打ち切って413を返す。0で無制限）
+MAX_UPLOAD_BYTES = _env_int("MAX_UPLOAD_BYTES", 20 * 1024 * 1024)
+# 画像の画素数の上限（メガピクセル）。ヘッダーから読み取り、デコードする前に413を返す（0で無制限）
+MAX_IMAGE_MEGAPIXELS = _env_int("MAX_IMAGE_MEGAPIXELS", 64)
+# メモリの使い方（"normal" または "low"）。"low" はデコードした画像をすぐに手放し、作業用の配列を使い回す
+PIPELINE_MEMORY_MODE = _env_str("PIPELINE_MEMORY_MODE", "normal")
+
+# --- レスポンスの圧縮 ---
+# 使う圧縮方式（優先する順にカンマ区切り。"br", "gzip"。空の場合は圧縮しない）
+COMPRESSION_ENCODINGS = _env_str("COMPRESSION_ENCODINGS", "br,gzip")
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESSION_MIN_BYTES = _env_int("COMPRESSION_MIN_BYTES", 1024)
+# gzipの圧縮レベル（1〜9）。上げてもJSONはほとんど小さくならず、CPUの使用量だけが増える
+COMPRESSION_GZIP_LEVEL = _env_int("COMPRESSION_GZIP_LEVEL", 5)
+# brotliの圧縮レベル（0〜11）
+COMPRESSION_BROTLI_QUALITY = _env_int("COMPRESSION_BROTLI_QUALITY", 4)
+
+# --- 解析結果のキャッシュ ---
+# メモリに保持する最大件数（0でキャッシュ無効）
+CACHE_MAX_ENTRIES = _env_int("CACHE_MAX_ENTRIES", 256)
+# 結果を有効とみなす秒数
+CACHE_TTL_SECONDS = _env_int("CACHE_TTL_SECONDS", 3600)
+# ディスクキャッシュの保存先（空の場合はディスクに保存しない）
+CACHE_DIR = _env_str("CACHE_DIR", "")
+
+# --- 色抽出 ---
+# デフォルトの色抽出エンジン（"kmeans" または "histogram"）。リクエストごとに ?engine= で変更できる
+COLOR_ENGINE = _env_str("COLOR_ENGINE", "kmeans")
+# 抽出する色の数（1〜8の整数、または画像ごとに選ぶ "auto"）。リクエストごとに ?num_colors= で変更できる
+NUM_COLORS = _env_str("NUM_COLORS", "3")
+# 近似モード（?approximate=true）で目標にする割合の誤差（95%信頼区間の半幅、パーセントポイント）。?error_margin= で変更できる
+APPROX_ERROR_MARGIN = _env_float("APPROX_ERROR_MARGIN", 1.0)
+# 近似モードで色の抽出にかけてよい時間（ミリ秒）。?time_budget_ms= で変更できる
+APPROX_TIME_BUDGET_MS = _env_int("APPROX_TIME_BUDGET_MS", 50)
+# 色名のパレットのファイル（空の場合は app/color_palette.yaml）。変更したらサーバーを再起動する
+COLOR_PALETTE_PATH = _env_str("COLOR_PALETTE_PATH", "")
+# RGB→色名の変換表を保存するファイル（指定するとメモリマップで読み込み、ワーカー間で共有される）
+COLOR_LUT_PATH = _env_str("COLOR_LUT_PATH", "")
+# 服の領域の識別方法（"grabcut": 背景と肌を除いた服のピクセルだけを使う, "none": 画像全体を使う）
+SEGMENTATION = _env_str("SEGMENTATION", "grabcut")
+# 領域（トップス・ボトムスなど）ごとの色の分け方（"none": 分けない, "grid": 上下の帯, "components": 服の領域のつながった部分）
+# リクエストごとに ?regions= で変更できる
+REGIONS = _env_str("REGIONS", "none")
+# "grid" の帯の分け方。"領域名:帯の下端の位置（画像の高さに対する割合）" を上から順にカンマ区切りで
+REGION_GRID = _env_str("REGION_GRID", "top:0.5,bottom:1.0")
+# 色の組み合わせ提案のルールファイル（空の場合は app/color_rules.yaml）。更新すると自動で読み込み直す
+COLOR_RULES_PATH = _env_str("COLOR_RULES_PATH", "")
+
+# --- プレビュー画像 ---
+# サムネイルの長辺の最大ピクセル数
+PREVIEW_MAX_SIDE = _env_int("PREVIEW_MAX_SIDE", 320)
+# サムネイルをメモリに保持する合計バイト数の上限
+PREVIEW_STORE_MAX_BYTES = _env_int("PREVIEW_STORE_MAX_BYTES", 64 * 1024 * 1024)
+
+# --- 複数画像の一括処理 ---
+# /uploadfiles/ で一度に受け付ける画像の最大数（zip内のファイルも含む）
+BATCH_MAX_FILES = _env_int("BATCH_MAX_FILES", 500)
+# /uploadfiles/ で受け付ける本体の最大バイト数（MAX_UPLOAD_BYTESの代わりに使う。0で無制限）
+BATCH_MAX_UPLOAD_BYTES = _env_int("BATCH_MAX_UPLOAD_BYTES", 512 * 1024 * 1024)
+
+# --- 非同期ジョブ（POST /jobs → GET /jobs/{id}） ---
+# 同時に処理するジョブの数（0の場合はワーカー数の半分。残りは /uploadfile/ などの同期リクエストのために空けておく）
+JOB_WORKERS = _env_int("JOB_WORKERS", 0)
+# 待機中・実行中のジョブ数の上限（超えると503を返す）
+JOB_MAX_PENDING = _env_int("JOB_MAX_PENDING", 100)
+# 終わったジョブの結果を保持する秒数（過ぎると GET /jobs/{id} は404になる）
+JOB_RETENTION_SECONDS = _env_int("JOB_RETENTION_SECONDS", 3600)
+# ジョブ1件の期限（ミリ秒）。同期リクエストより長く待てるので、混雑していても品質を下げにくい
+JOB_DEADLINE_MS = _env_int("JOB_DEADLINE_MS", 600000)
+# POST /jobs で受け付ける本体の最大バイト数（MAX_UPLOAD_BYTESの代わりに使う。0で無制限）
+JOB_MAX_UPLOAD_BYTES = _env_int("JOB_MAX_UPLOAD_BYTES", 64 * 1024 * 1024)
+# アップロードを保存する一時ディレクトリを作る場所（空の場合はOSの一時ディレクトリ）
+JOB_DIR = _env_str("JOB_DIR", "")
+
+# --- カメラ映像のストリーミング解析（WebSocket /ws/stream） ---
+# 同時に接続できるクライアント数（超えた場合は接続を閉じる）
+STREAM_MAX_CONNECTIONS = _env_int("STREAM_MAX_CONNECTIONS", 8)
+
+# --- 色の検索インデックス ---
+# 商品の色を保存するディレクトリ（/search/items で追加、/search/similar で検索）
+SEARCH_INDEX_DIR = _env_str("SEARCH_INDEX_DIR", "search_index")
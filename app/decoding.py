@@ -0,0 +1,149 @@
+import struct
+from dataclasses import dataclass
+import cv2
+import numpy as np
+
+
+# 画像のデコード
+# JPEG/PNGのヘッダーから先に画像サイズを読み取り、処理に必要な解像度に近いサイズで直接デコードする。
+# 12〜48MPのスマホ写真をフル解像度でデコードしてからすぐ縮小するのは、時間もメモリも無駄になるため。
+
+@dataclass
+class ImageHeader:
+    format: str # "jpeg" または "png"
+    width: int
+    height: int
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEGのSOF（Start Of Frame）マーカー。この中に画像の高さと幅が入っている（C4, C8, CCは別用途）
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEGの縮小デコードで使える倍率（大きい順）
+_JPEG_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+def read_image_header(contents: bytes) -> ImageHeader | None:
+    """
+    画像全体をデコードせずに、ヘッダーから形式と画像サイズを読み取る。
+
+    Args:
+        contents (bytes): 画像ファイルの中身。
+
+    Returns:
+        ImageHeader | None: 形式とサイズ。JPEG/PNG以外や壊れたヘッダーの場合はNone。
+    """
+    if contents.startswith(_PNG_SIGNATURE) and len(contents) >= 24:
+        # PNGは先頭のIHDRチャンクに幅と高さが入っている（シグネチャ8バイト + 長さ4 + "IHDR"4 の後）
+        width, height = struct.unpack(">II", contents[16:24])
+        return ImageHeader("png", width, height)
+
+    if contents.startswith(b"\xff\xd8"):
+        # JPEGはマーカーを順にたどってSOFを探す
+        pos = 2
+        while pos + 4 <= len(contents):
+            if contents[pos] != 0xFF:
+                return None
+            marker = contents[pos + 1]
+            if marker == 0xFF: # 埋め草の0xFF
+                pos += 1
+                continue
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7: # 長さを持たないマーカー
+                pos += 2
+                continue
+            (segment_length,) = struct.unpack(">H", contents[pos + 2:pos + 4])
+            if marker in _JPEG_SOF_MARKERS:
+                if pos + 9 > len(contents):
+                    return None
+                height, width = struct.unpack(">HH", contents[pos + 5:pos + 9])
+                return ImageHeader("jpeg", width, height)
+            if marker == 0xDA: # 画像データの開始（SOFより後に来るはずなので、ここまでに見つからなければ諦める）
+                return None
+            pos += 2 + segment_length
+    return None
+
+class ImageTooLargeError(ValueError):
+    """画像の画素数が上限を超えている場合に送出される。"""
+
+
+def check_image_size(contents: bytes, max_megapixels: float) -> None:
+    """
+    デコードする前に、ヘッダーの画像サイズが上限を超えていないか確認する。
+    数KBの圧縮ファイルでも、デコードすると数GBになる画像（解凍爆弾）を受け付けないため。
+
+    Args:
+        contents (bytes): 画像ファイルの中身。
+        max_megapixels (float): 画素数の上限（メガピクセル）。0以下の場合は確認しない。
+
+    Raises:
+        ImageTooLargeError: 画素数が上限を超えている場合。
+    """
+    if max_megapixels <= 0:
+        return
+    header = read_image_header(contents) # JPEG/PNG以外はヘッダーを読めないので、OpenCVのデコード時の上限に任せる
+    if header is not None and header.width * header.height > max_megapixels * 1_000_000:
+        raise ImageTooLargeError(
+            f"画像が大きすぎます（{header.width}x{header.height}）。{max_megapixels:g}メガピクセル以下の画像をアップロードしてください。"
+        )
+
+def choose_decode_flag(header: ImageHeader | None, target_width: int) -> tuple[int, str]:
+    """
+    ヘッダーの情報から、目標の解像度を下回らない範囲でもっとも小さくデコードできる方法を選ぶ。
+
+    Args:
+        header (ImageHeader | None): read_image_headerの結果。
+        target_width (int): 処理に使う画像の幅。
+
+    Returns:
+        tuple[int, str]: (cv2.imdecodeに渡すフラグ, 診断用の方式名)
+    """
+    if header is None or header.format != "jpeg":
+        # PNGには縮小デコードの仕組みがない（フル解像度でデコードしてから縮小される）ので通常のデコード
+        return cv2.IMREAD_COLOR, "full"
+    # EXIFの回転で幅と高さが入れ替わっても目標の幅を下回らないよう、短い辺で判定する
+    short_side = min(header.width, header.height)
+    for factor, flag in _JPEG_REDUCED_FLAGS.items():
+        if short_side // factor >= target_width:
+            return flag, f"jpeg_reduced_{factor}"
+    return cv2.IMREAD_COLOR, "full"
+
+def decode_image(contents: bytes, target_width: int) -> tuple[np.ndarray | None, dict]:
+    """
+    画像をデコードする。JPEGの場合は目標の解像度に近いサイズで直接デコードする。
+
+    Args:
+        contents (bytes): 画像ファイルの中身。
+        target_width (int): 処理に使う画像の幅。
+
+    Returns:
+        tuple: (デコードした画像（失敗した場合はNone）,
+                診断情報の辞書（デコード方式、元画像のサイズ、デコード後のサイズ）)
+    """
+    header = read_image_header(contents)
+    flag, strategy = choose_decode_flag(header, target_width)
+    img = cv2.imdecode(np.frombuffer(contents, np.uint8), flag)
+    diagnostics = {"decode_strategy": strategy}
+    if img is not None:
+        diagnostics["source_size"] = _source_dimensions(header, img)
+        diagnostics["decoded_size"] = {"width": img.shape[1], "height": img.shape[0]}
+    return img, diagnostics
+
+def _source_dimensions(header: ImageHeader | None, img: np.ndarray) -> dict:
+    """
+    元画像の幅と高さを返す。縮小デコードした場合でも元のサイズを返す。
+
+    Args:
+        header (ImageHeader | None): read_image_headerの結果。
+        img (np.ndarray): デコードした画像。
+
+    Returns:
+        dict: {"width": 幅, "height": 高さ}
+    """
+    height, width = img.shape[:2]
+    if header is None:
+        return {"width": width, "height": height}
+    # EXIFの回転が適用されて縦横が入れ替わっている場合はヘッダーの値も入れ替える
+    if (header.width > header.height) != (width > height) and header.width != header.height:
+        return {"width": header.height, "height": header.width}
+    return {"width": header.width, "height": header.height}
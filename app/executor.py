@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class ExecutorSaturatedError(Exception):
+    """ワーカーもキューも埋まっていて、これ以上リクエストを受け付けられないときに送出される。"""
+
+
+class PipelineExecutor:
+    """
+    画像処理をイベントループの外（プロセスプールまたはスレッドプール）で実行するためのクラス。
+    同時に受け付ける処理数を「ワーカー数 + キューの長さ」までに制限する。
+    """
+
+    def __init__(self, backend: str = "process", max_workers: int = 1, max_queue: int = 0, initializer=None):
+        """
+        Args:
+            backend (str): "process"（プロセスプール）または "thread"（スレッドプール）。
+            max_workers (int): 同時に処理を実行するワーカー数。
+            max_queue (int): ワーカーが空くのを待てるリクエスト数。
+            initializer: 各ワーカーの起動時に1回だけ呼ばれる関数（変換表の読み込みなど）。
+        """
+        if backend not in ("process", "thread"):
+            raise ValueError(f"不明な実行バックエンドです: {backend}")
+        self.backend = backend
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.initializer = initializer
+        self._pending = 0 # 実行中＋待機中のリクエスト数
+        self._pool: Executor | None = None
+
+    def start(self) -> None:
+        """ワーカープールを起動する。"""
+        if self._pool is not None:
+            return
+        if self.backend == "process":
+            # forkはOpenCVやBLASのスレッドを引き継いでデッドロックすることがあるのでspawnを使う
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+            )
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="pipeline",
+                initializer=self.initializer,
+            )
+
+    def shutdown(self) -> None:
+        """ワーカープールを停止する。"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def pending(self) -> int:
+        """実行中または待機中のリクエスト数。"""
+        return self._pending
+
+    @property
+    def capacity(self) -> int:
+        """同時に受け付けられるリクエスト数の上限。"""
+        return self.max_workers + self.max_queue
+
+    async def run(self, func, *args, **kwargs):
+        """
+        関数をワーカープールで実行し、結果を待つ。
+
+        Raises:
+            ExecutorSaturatedError: ワーカーもキューも埋まっている場合。
+        """
+        if self._pending >= self.capacity:
+            raise ExecutorSaturatedError("サーバーが混み合っています。しばらくしてから再度お試しください。")
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = self._pool.submit(functools.partial(func, *args, **kwargs))
+        self._pending += 1
+        # 待っている側が取り消されても（クライアントの切断など）ワーカーでは処理が続くので、
+        # 待っている側ではなく、実際に処理が終わったときに数を減らす
+        future.add_done_callback(lambda _: self._release(loop))
+        return await asyncio.wrap_future(future)
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> None:
+        """処理が終わった（または始まる前に取り消された）ときに、ワーカーのスレッドから呼ばれる。"""
+        try:
+            loop.call_soon_threadsafe(self._decrement_pending)
+        except RuntimeError:
+            pass # イベントループがすでに閉じている（停止中）
+
+    def _decrement_pending(self) -> None:
+        self._pending -= 1
@@ -1,57 +1,313 @@
+import threading # 低メモリモードの作業用バッファをスレッドごとに持つため
+import time # 近似モードの時間の予算
 import cv2 #画像認識などを使えるようにする
 import numpy as np #numpyは数値計算を効率よく行う。as npでnumpyをnpとする
-from sklearn.cluster import MiniBatchKMeans #KMeansよりも大規模データに効率的
 
 # 色情報を保存するデータクラス
 from dataclasses import dataclass
+from .metrics import stage # 処理時間の計測
 
 @dataclass
 class ExtractedColor:
     rgb: tuple[int, int, int]  # RGB値 (0-255, 0-255, 0-255)
     percentage: float          # 全体に対する色の割合 (0-100%)
+    percentage_error: float | None = None # 近似モードの場合、割合の95%信頼区間の半幅（±パーセントポイント）
 
-def extract_dominant_colors(image_np: np.ndarray, num_colors: int = 3) -> list[ExtractedColor]:
+# 色抽出エンジンの一覧
+# "kmeans": 全ピクセルに対してMiniBatchKMeansを実行（従来の方式）
+# "histogram": 粗いRGBヒストグラムを作り、ビンを出現数で重み付けしてK-means（高速）
+COLOR_ENGINES = ("kmeans", "histogram")
+
+# 色の抽出に使う画像の幅（これより大きい画像は縮小してから処理する）
+WORKING_WIDTH = 500
+
+# ヒストグラムの1チャンネルあたりのビン数（32なら32×32×32=32768ビン）
+HISTOGRAM_BINS = 32
+
+# 色の数の自動選択（num_colors="auto"）の設定
+# ヒストグラムのビンを1つのグループから2つずつに分けていき、分ける意味がなくなったところで止める
+AUTO_NUM_COLORS = "auto"
+AUTO_MAX_COLORS = 8 # 選ぶ色の数の上限
+AUTO_MIN_GAIN = 0.03 # 分割で減る二乗誤差が、1色で表したときの誤差のこの割合未満なら分けない
+AUTO_MIN_DELTA_E = 18.0 # 分けた2色の色差（_color_differenceの値）がこれ未満なら、同じ色の濃淡とみなして分けない・まとめる
+AUTO_MIN_SHARE = 0.02 # 分けた片方の割合がこれ未満なら分けない（小さな柄や影を別の色にしない）
+
+# 近似モード（approximate=true）の設定
+# 全ピクセルではなく層化抽出したサンプルで色を求め、割合の信頼区間が目標の幅に収まるか時間の予算を使い切るまでサンプルを2倍ずつ増やす
+APPROX_INITIAL_SAMPLE = 1024 # 最初のサンプル数
+APPROX_CONFIDENCE = 0.95 # 割合の誤差を信頼区間で表すときの信頼度
+APPROX_Z = 1.96 # 信頼度95%に対応する正規分布の値
+DEFAULT_ERROR_MARGIN = 1.0 # 割合の誤差（信頼区間の半幅、パーセントポイント）の目標
+DEFAULT_TIME_BUDGET = 0.05 # 色の抽出にかけてよい秒数の目安
+
+# 領域ごとの色の抽出（トップス・ボトムス・小物など）の設定
+# "grid": 画像を上下の帯に分ける, "components": 服の領域のつながった部分ごとに分ける
+REGION_METHODS = ("none", "grid", "components")
+DEFAULT_REGION_GRID = (("top", 0.5), ("bottom", 1.0)) # (領域名, 帯の下端の位置（画像の高さに対する割合）) を上から順に
+REGION_MAX_COLORS = 3 # 1つの領域から抽出する色の数の上限（色の数はAUTO_*の基準で領域ごとに選ぶ）
+REGION_MIN_SHARE = 0.02 # 服の領域のこの割合未満の小さな部分は、どの領域にも入れない（ノイズ）
+REGION_MAJOR_SHARE = 0.15 # 服の領域のこの割合以上の部分を服（トップス・ボトムス）、それより小さい部分を小物とみなす
+REGION_ACCESSORIES = "accessories" # 小物の領域名
+
+# 服の領域の識別（GrabCut）の設定
+SEGMENTATION_METHODS = ("grabcut", "none")
+SEGMENTATION_MAX_SIDE = 128 # GrabCutはこの長辺まで縮小した画像で実行する（処理時間を抑えるため）
+GRABCUT_ITERATIONS = 2
+MIN_CLOTHING_RATIO = 0.05 # 服の領域が画像のこの割合より小さい場合は識別に失敗したとみなす
+
+# 低メモリモードで作業用画像に使い回す配列（ワーカーのスレッドごとに1つ）
+_working_buffers = threading.local()
+
+def working_buffer(shape: tuple[int, int, int]) -> np.ndarray:
+    """
+    低メモリモード用に、作業用画像を書き込む配列を返す。リクエストごとに新しく確保せず、同じメモリを使い回す。
+    足りなければ大きく確保し直す（作業用画像の幅は最大でもWORKING_WIDTHなので、すぐに一定の大きさで落ち着く）。
+
+    Args:
+        shape (tuple[int, int, int]): (高さ, 幅, 3)
+
+    Returns:
+        np.ndarray: 指定した形のuint8配列（中身は前のリクエストの値が残っている）。
+    """
+    size = shape[0] * shape[1] * shape[2]
+    buffer = getattr(_working_buffers, "data", None)
+    if buffer is None or len(buffer) < size:
+        buffer = np.empty(size, np.uint8)
+        _working_buffers.data = buffer
+    return buffer[:size].reshape(shape) # 先頭から切り出すので、連続したメモリのまま（OpenCVの出力先に使える）
+
+def extract_dominant_colors(
+    image_np: np.ndarray,
+    num_colors: int = 3,
+    engine: str = "kmeans",
+    mask: np.ndarray | None = None,
+) -> list[ExtractedColor]:
     """
     OpenCV画像（NumPy配列）からメインの色を抽出する。
 
     Args: #引数
         image_np (np.ndarray): OpenCV形式の画像（NumPy配列）。
         num_colors (int): 抽出する色の数。
+        engine (str): 色抽出エンジン（COLOR_ENGINESのいずれか）。
+        mask (np.ndarray | None): identify_clothing_areaで求めた服の領域（bool配列）。指定するとその領域のピクセルだけを使う。
 
     Returns: #返り値
         list[ExtractedColor]: 抽出された主要な色のリスト（RGB値と割合）。
     """
+    return cluster_pixels(prepare_pixels(image_np, mask=mask), num_colors=num_colors, engine=engine)
+
+def resize_to_working(image_np: np.ndarray, width: int = WORKING_WIDTH, reuse_buffer: bool = False) -> np.ndarray:
+    """
+    画像を処理用の解像度（幅WORKING_WIDTHピクセル）に縮小する。すでに小さい画像はそのまま返す。
 
+    Args:
+        image_np (np.ndarray): OpenCV形式の画像（NumPy配列）。
+        width (int): 作業用画像の幅（混み合っているときは小さくして処理を軽くする）。
+        reuse_buffer (bool): Trueの場合は新しい配列を確保せず、working_bufferに書き込む（低メモリモード）。
+                             返り値は次のリクエストで上書きされるので、処理が終わったら参照を残さないこと。
+
+    Returns:
+        np.ndarray: 縮小した画像。
+    """
     # 画像のサイズを変更して処理を高速化（任意）
-    # 500ピクセル幅にリサイズ
+    # WORKING_WIDTH（500ピクセル）幅にリサイズ
     h, w = image_np.shape[:2] #hには画像の高さ、wには画像の幅が代入される
-    if w > 500:
-         image_np = cv2.resize(image_np, (500, int(500 * h / w)), interpolation=cv2.INTER_AREA)
+    if w > width:
+        size = (width, int(width * h / w))
+        with stage("resize"):
+            dst = working_buffer((size[1], size[0], 3)) if reuse_buffer else None
+            image_np = cv2.resize(image_np, size, dst=dst, interpolation=cv2.INTER_AREA)
+    return image_np
+
+def prepare_pixels(image_np: np.ndarray, mask: np.ndarray | None = None, in_place: bool = False) -> np.ndarray:
+    """
+    OpenCV画像を処理用の解像度に縮小し、RGBピクセルの配列に変換する。
+
+    Args:
+        image_np (np.ndarray): OpenCV形式の画像（NumPy配列、BGR）。
+        mask (np.ndarray | None): 服の領域（bool配列）。指定するとその領域のピクセルだけを取り出す。
+        in_place (bool): Trueの場合はRGBへの変換を新しい配列を作らずに image_np に上書きする（低メモリモード）。
+                         呼び出し後の image_np はRGBになる。
+
+    Returns:
+        np.ndarray: (ピクセル数, 3) のRGB配列（uint8）。
+    """
+    image_np = resize_to_working(image_np)
+    if mask is not None and mask.shape != image_np.shape[:2]:
+        mask = cv2.resize(mask.astype(np.uint8), (image_np.shape[1], image_np.shape[0]), interpolation=cv2.INTER_NEAREST).astype(bool)
 
     # 画像をBGRからRGBに変換　理由OpenCVはBGR、K-meansはRGBを想定されているから
-    image_rgb = cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)
+    with stage("cvt_color"):
+        image_rgb = cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB, dst=image_np if in_place else None)
 
     # ピクセルをリストに平坦化
-    pixels = image_rgb.reshape(-1, 3) # (高さ*幅, 3) の配列に変換
+    if mask is not None:
+        # 背景を黒く塗った画像ではなく、服の領域のピクセルだけを詰めた配列にする（背景の色が混ざらず、処理するピクセルも減る）
+        return image_rgb[mask] # (服の領域のピクセル数, 3) の配列
+    return image_rgb.reshape(-1, 3) # (高さ*幅, 3) の配列に変換
 
-    # K-meansクラスタリングで支配的な色を抽出
-    # MiniBatchKMeans は大規模なデータセットに対してKMeansよりも高速
-    kmeans = MiniBatchKMeans(n_clusters=num_colors, random_state=0, n_init='auto', verbose=0)
-    kmeans.fit(pixels) #学習を実行
+def cluster_pixels(pixels: np.ndarray, num_colors: int | str = 3, engine: str = "kmeans", max_iter: int | None = None) -> list[ExtractedColor]:
+    """
+    RGBピクセルの配列をクラスタリングして、メインの色と割合を求める。
 
-    # 各クラスター（色）のピクセル数をカウント
-    # np.bincount は非負の整数配列の出現回数をカウント
-    labels = kmeans.labels_
-    counts = np.bincount(labels)
+    Args:
+        pixels (np.ndarray): prepare_pixelsで作った (ピクセル数, 3) のRGB配列。
+        num_colors (int | str): 抽出する色の数。"auto" の場合は画像ごとに選ぶ（最大AUTO_MAX_COLORS色）。
+        engine (str): 色抽出エンジン（COLOR_ENGINESのいずれか）。
+        max_iter (int | None): K-meansの最大反復回数。Noneの場合はscikit-learnのデフォルト（混み合っているときは少なくして処理を軽くする）。
 
+    Returns:
+        list[ExtractedColor]: 抽出された主要な色のリスト（割合が高い順）。
+    """
+    if engine not in COLOR_ENGINES:
+        raise ValueError(f"不明な色抽出エンジンです: {engine}")
+    centers, counts = _fit_colors(pixels, num_colors, engine, max_iter)
+    return _to_extracted_colors(centers, counts, len(pixels))
+
+def _fit_colors(
+    pixels: np.ndarray,
+    num_colors: int | str,
+    engine: str,
+    max_iter: int | None = None,
+    init: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    cluster_pixelsの本体。initを指定した場合は、その色を初期値にして色の数 len(init) で1回だけ実行する
+    （近似モードでサンプルを増やしたときに、前の結果から続けるため）。
+
+    Returns:
+        tuple: (クラスター中心のRGB配列, 各クラスターのピクセル数)
+    """
+    if init is not None:
+        with stage(f"cluster_{engine}"):
+            if engine == "histogram":
+                return _cluster_histogram(pixels, len(init), max_iter, init=init)
+            return _cluster_kmeans(pixels, len(init), max_iter, init=init)
+
+    # 色の数を自動で選ぶ場合は、ヒストグラムから作った分割の木で色の数とK-meansの初期値を決める
+    # （色の数ごとにK-meansをやり直さないので、色の数を固定した場合とほぼ同じ時間で済む）
+    auto = num_colors == AUTO_NUM_COLORS
+    histogram = init = None
+    if auto:
+        with stage("choose_num_colors"):
+            histogram = _color_histogram(pixels)
+            init, _ = _split_hierarchy(*histogram, max_colors=AUTO_MAX_COLORS)
+        num_colors = len(init)
+
+    with stage(f"cluster_{engine}"):
+        if engine == "histogram":
+            centers, counts = _cluster_histogram(pixels, num_colors, max_iter, init=init, histogram=histogram)
+        else:
+            centers, counts = _cluster_kmeans(pixels, num_colors, max_iter, init=init)
+    if auto:
+        centers, counts = _merge_similar_colors(centers, counts) # K-meansで近づいた色をまとめる
+    return centers, counts
+
+def cluster_pixels_approx(
+    pixels: np.ndarray,
+    num_colors: int | str = 3,
+    engine: str = "kmeans",
+    max_iter: int | None = None,
+    error_margin: float = DEFAULT_ERROR_MARGIN,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+) -> tuple[list[ExtractedColor], dict]:
+    """
+    ピクセルの一部（層化抽出したサンプル）だけで色を求める近似モード。
+    APPROX_INITIAL_SAMPLE 個から始めて、すべての色の割合の信頼区間の半幅が error_margin 以下になるか、
+    次の回が time_budget 秒に収まらない見込みになるまで、サンプルを2倍ずつ増やしてクラスタリングし直す
+    （2回目以降は前の回の色を初期値にするので、反復はほとんど増えない）。
+
+    サンプルはピクセルの並び（画像の上から順）を同じ幅の区間に分け、各区間から1つずつ選ぶ（層化抽出）。
+    画像の一部に偏らず、同じ数の単純な無作為抽出より割合のばらつきが小さい。
+    割合の誤差は単純な無作為抽出の式（層化抽出ではこれより小さくなるので、安全側の見積もり）で求める。
+    誤差はサンプリングによるものだけで、クラスターの中心の違いによる差は含まない。
+
+    Args:
+        pixels (np.ndarray): prepare_pixelsで作った (ピクセル数, 3) のRGB配列。
+        num_colors (int | str): 抽出する色の数（"auto" も使える。色の数は最初の回で決める）。
+        engine (str): 色抽出エンジン（COLOR_ENGINESのいずれか）。
+        max_iter (int | None): K-meansの最大反復回数。
+        error_margin (float): 割合の誤差（信頼度95%の信頼区間の半幅、パーセントポイント）の目標。
+        time_budget (float): 色の抽出にかけてよい秒数の目安（最初の回は予算に関係なく実行する）。
+
+    Returns:
+        tuple: (抽出された主要な色のリスト（percentage_errorつき、割合が高い順）,
+                サンプリングの情報 {"sample_size", "population", "rounds", "confidence", "max_percentage_error", "stopped"})
+                stoppedは "converged"（目標の誤差に達した）, "time_budget"（時間切れ）, "exhausted"（全ピクセルを使った）。
+    """
+    if engine not in COLOR_ENGINES:
+        raise ValueError(f"不明な色抽出エンジンです: {engine}")
+    started = time.perf_counter()
+    population = len(pixels)
+    rng = np.random.default_rng(0) # 同じ画像なら同じサンプルになるよう、乱数の種は固定
+    positions = None
+    centers = None
+    rounds = 0
+    while True:
+        round_started = time.perf_counter()
+        with stage("sample"):
+            if positions is None:
+                positions = _stratified_positions(rng, min(APPROX_INITIAL_SAMPLE, population))
+            else:
+                positions = _refine_positions(rng, positions)
+            # サンプルが全体の半分を超えたら、残りも含めて全ピクセルを使う（誤差は0）
+            sample = pixels if len(positions) * 2 > population else pixels[(positions * population).astype(np.intp)]
+        centers, counts = _fit_colors(sample, num_colors, engine, max_iter, init=centers)
+        rounds += 1
+        errors = _percentage_errors(counts, len(sample), population)
+        round_seconds = time.perf_counter() - round_started
+        if len(sample) == population:
+            stopped = "exhausted"
+        elif errors.max(initial=0.0) <= error_margin:
+            stopped = "converged"
+        elif time.perf_counter() - started + round_seconds * 2 > time_budget:
+            stopped = "time_budget" # 次の回はサンプルが2倍なので、時間もおおよそ2倍かかる
+        else:
+            continue
+        break
+
+    colors = _to_extracted_colors(centers, counts, len(sample), errors)
+    return colors, {
+        "sample_size": len(sample),
+        "population": population,
+        "rounds": rounds,
+        "confidence": APPROX_CONFIDENCE,
+        "max_percentage_error": round(float(errors.max(initial=0.0)), 2),
+        "stopped": stopped,
+    }
+
+def _stratified_positions(rng: np.random.Generator, n: int) -> np.ndarray:
+    """[0, 1) をn個の同じ幅の区間に分け、各区間から1つずつ一様に選んだ位置。"""
+    return (np.arange(n) + rng.random(n)) / n
+
+def _refine_positions(rng: np.random.Generator, positions: np.ndarray) -> np.ndarray:
+    """
+    層化抽出のサンプルを2倍に増やす。各区間を半分に分け、前のサンプルが入っていない方の半分から1つずつ選び足す。
+    前のサンプルをそのまま使えるうえ、増やした後も「区間ごとに1つずつ」の層化抽出になっている。
+    """
+    n = len(positions)
+    halves = np.floor(positions * 2 * n).astype(np.int64)
+    added = ((halves ^ 1) + rng.random(n)) / (2 * n) # 隣の半分（偶数なら+1、奇数なら-1）
+    return np.concatenate([positions, added])
+
+def _percentage_errors(counts: np.ndarray, sample_size: int, population: int) -> np.ndarray:
+    """サンプルから求めた各色の割合の、信頼区間の半幅（パーセントポイント）。"""
+    p = np.asarray(counts, np.float64) / sample_size
+    # 有限母集団修正: サンプルが全体に近づくほど誤差は0に近づく
+    correction = (population - sample_size) / (population - 1) if population > 1 else 0.0
+    return APPROX_Z * np.sqrt(p * (1 - p) / sample_size * correction) * 100
+
+def _to_extracted_colors(centers: np.ndarray, counts: np.ndarray, total: int, errors: np.ndarray | None = None) -> list[ExtractedColor]:
+    """クラスターの中心とピクセル数を、割合が高い順のExtractedColorのリストにする（errorsは近似モードの割合の誤差）。"""
     # クラスターの中心（メインの色）とそれぞれの割合を取得
     dominant_colors = []
-    for i, color_rgb in enumerate(kmeans.cluster_centers_):
-        percentage = (counts[i] / len(pixels)) * 100
+    for i, (color_rgb, count) in enumerate(zip(centers, counts)):
+        percentage = (count / total) * 100
         dominant_colors.append(
             ExtractedColor(
                 rgb=tuple(int(c) for c in color_rgb.astype(int)),
-                percentage=round(percentage, 2)
+                percentage=round(float(percentage), 2),
+                percentage_error=round(float(errors[i]), 2) if errors is not None else None,
             )
         )
     # 割合が高い順にソート
@@ -59,21 +315,350 @@ def extract_dominant_colors(image_np: np.ndarray, num_colors: int = 3) -> list[E
 
     return dominant_colors
 
-def identify_clothing_area(image_np: np.ndarray) -> np.ndarray:
+def _cluster_kmeans(pixels: np.ndarray, num_colors: int, max_iter: int | None = None, init: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    全ピクセルに対してMiniBatchKMeansを実行する。
+    initを指定した場合は、その色を初期値にして1回だけ実行する（色の数の自動選択で使う）。
+
+    Returns:
+        tuple: (クラスター中心のRGB配列, 各クラスターのピクセル数)
+    """
+    # K-meansクラスタリングで支配的な色を抽出
+    # MiniBatchKMeans は大規模なデータセットに対してKMeansよりも高速
+    # scikit-learnは読み込みに時間がかかる（起動が遅くなる）ので、最初に使うときに読み込む
+    from sklearn.cluster import MiniBatchKMeans
+    kmeans = MiniBatchKMeans(
+        n_clusters=num_colors, random_state=0, verbose=0,
+        **({"init": init, "n_init": 1} if init is not None else {"n_init": 'auto'}),
+        **({"max_iter": max_iter} if max_iter else {}),
+    )
+    kmeans.fit(pixels) #学習を実行
+
+    # 各クラスター（色）のピクセル数をカウント
+    # np.bincount は非負の整数配列の出現回数をカウント
+    counts = np.bincount(kmeans.labels_, minlength=num_colors)
+    return kmeans.cluster_centers_, counts
+
+def _cluster_histogram(
+    pixels: np.ndarray,
+    num_colors: int,
+    max_iter: int | None = None,
+    init: np.ndarray | None = None,
+    histogram: tuple[np.ndarray, np.ndarray] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    RGBヒストグラムを1回のNumPy演算で作り、使われているビンだけを出現数で重み付けしてK-meansにかける。
+    クラスタリングする点の数が最大でもビン数（32768）になるので、全ピクセルを使うより大幅に速い。
+    各ビンはピクセル数ごとクラスターに割り当てるので、割合は全ピクセル数に対して正確。
+    init（K-meansの初期値）とhistogram（_color_histogramの結果）は、色の数の自動選択で作ったものを使い回すときに指定する。
+
+    Returns:
+        tuple: (クラスター中心のRGB配列, 各クラスターのピクセル数)
+    """
+    bin_colors, weights = histogram if histogram is not None else _color_histogram(pixels)
+
+    # 使われているビンが色数以下なら、ビンをそのまま色とする
+    if len(weights) <= num_colors:
+        return bin_colors, weights
+
+    from sklearn.cluster import KMeans # 最初に使うときに読み込む（_cluster_kmeansと同じ理由）
+    kmeans = KMeans(
+        n_clusters=num_colors, random_state=0,
+        **({"init": init, "n_init": 1} if init is not None else {"n_init": 'auto'}),
+        **({"max_iter": max_iter} if max_iter else {}),
+    )
+    kmeans.fit(bin_colors, sample_weight=weights)
+    counts = np.bincount(kmeans.labels_, weights=weights, minlength=num_colors)
+    return kmeans.cluster_centers_, counts
+
+def _color_histogram(pixels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    RGBヒストグラムを作り、使われているビンの平均色と出現数を返す。
+
+    Returns:
+        tuple: (ビンの平均色の配列 (ビン数, 3), 各ビンのピクセル数)
+    """
+    bin_index = _histogram_bin_index(pixels)
+    num_bins = HISTOGRAM_BINS ** 3
+    bin_counts = np.bincount(bin_index, minlength=num_bins)
+    occupied = np.flatnonzero(bin_counts)
+    weights = bin_counts[occupied]
+
+    # ビンの中心ではなく、ビンに入ったピクセルの平均色を代表色にする（重み付き平均が正確な平均色になる）
+    bin_colors = np.stack([
+        np.bincount(bin_index, weights=pixels[:, c], minlength=num_bins)[occupied]
+        for c in range(3)
+    ], axis=1) / weights[:, None]
+    return bin_colors, weights
+
+def _histogram_bin_index(pixels: np.ndarray) -> np.ndarray:
+    """各ピクセルが入るRGBヒストグラムのビンの番号（0〜HISTOGRAM_BINS**3 - 1）。"""
+    shift = 8 - int(np.log2(HISTOGRAM_BINS)) # 256段階をHISTOGRAM_BINS段階に落とすためのビットシフト量
+    bits = 8 - shift
+    quantized = (pixels >> shift).astype(np.int32)
+    return (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+
+def _to_lab(rgb: np.ndarray) -> np.ndarray:
+    """RGBの配列 (N, 3) をCIELABに変換する（L*は0-100。2色の距離がおおよそ人の見た目の差になる）。"""
+    return cv2.cvtColor(np.asarray(rgb, np.float32).reshape(1, -1, 3) / 255, cv2.COLOR_RGB2Lab)[0]
+
+def _color_difference(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
     """
-    画像から服の領域を識別する（簡易版）。
-    この関数は非常に基本的なもので、背景と前景を単純に区別するのに役立ちます。
+    CIELABの2色の色差。服のしわや照明による濃淡を別の色と数えないよう、
+    CIE94の繊維向けの式と同じく明度（L*）の差を半分にしてから距離をとる。
+    """
+    difference = lab1 - lab2
+    return np.sqrt((difference[..., 0] / 2) ** 2 + difference[..., 1] ** 2 + difference[..., 2] ** 2)
+
+def _best_split(colors: np.ndarray, weights: np.ndarray, index: np.ndarray, total_weight: float) -> tuple[float, np.ndarray, np.ndarray] | None:
+    """
+    ビンのグループを、色のばらつきが最も大きい方向（主成分）に沿って2つに分ける。
+    その方向に並べたすべての区切り位置の二乗誤差を累積和でまとめて計算し、最も誤差が減る位置で分ける。
+
+    Args:
+        colors (np.ndarray): ビンの平均色 (ビン数, 3)。
+        weights (np.ndarray): 各ビンのピクセル数。
+        index (np.ndarray): 分けるグループに含まれるビンの番号。
+        total_weight (float): 全ピクセル数（割合の判定に使う）。
+
+    Returns:
+        tuple | None: (減る二乗誤差, 片方のビンの番号, もう片方のビンの番号)。分ける意味がない場合はNone。
+    """
+    if len(index) < 2:
+        return None
+    c = colors[index]
+    w = weights[index].astype(np.float64)
+    mean = w @ c / w.sum()
+    d = c - mean
+    axis = np.linalg.eigh((d * w[:, None]).T @ d)[1][:, -1] # 重み付き共分散の最大固有ベクトル
+    order = np.argsort(d @ axis, kind="stable")
+    d, w = d[order], w[order] # 平均からの差で計算する（桁落ちを防ぐため）
+
+    # 先頭からj番目までを片方、残りをもう片方にしたときの二乗誤差（Σw|x|^2 - |Σwx|^2 / Σw）
+    left_w = np.cumsum(w)[:-1]
+    left_s = np.cumsum(d * w[:, None], axis=0)[:-1]
+    left_q = np.cumsum(w * (d ** 2).sum(axis=1))[:-1]
+    total_w, total_s, total_q = w.sum(), (d * w[:, None]).sum(axis=0), (w * (d ** 2).sum(axis=1)).sum()
+    right_w = total_w - left_w
+    sse = (left_q - (left_s ** 2).sum(axis=1) / left_w) + ((total_q - left_q) - ((total_s - left_s) ** 2).sum(axis=1) / right_w)
+    gain = (total_q - (total_s ** 2).sum() / total_w) - sse
+    min_weight = AUTO_MIN_SHARE * total_weight
+    gain[(left_w < min_weight) | (right_w < min_weight)] = -np.inf # 小さすぎる側ができる区切りは使わない
+    j = int(np.argmax(gain))
+    if not gain[j] > 0:
+        return None
+
+    # 分けた2色が同じ色の濃淡にすぎない場合は分けない
+    left_mean = mean + left_s[j] / left_w[j]
+    right_mean = mean + (total_s - left_s[j]) / right_w[j]
+    lab = _to_lab(np.stack([left_mean, right_mean]))
+    if _color_difference(lab[0], lab[1]) < AUTO_MIN_DELTA_E:
+        return None
+    return float(gain[j]), index[order[:j + 1]], index[order[j + 1:]]
+
+def _split_hierarchy(colors: np.ndarray, weights: np.ndarray, max_colors: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    ヒストグラムのビンを1つのグループから始め、二乗誤差が最も減るグループを2つに分けることを繰り返す。
+    分けても誤差がほとんど減らない（AUTO_MIN_GAIN）、分けた2色がほぼ同じ色（AUTO_MIN_DELTA_E）、
+    片方が小さすぎる（AUTO_MIN_SHARE）グループしか残らなくなったら止め、そのときのグループ数を色の数にする。
+
+    Args:
+        colors (np.ndarray): _color_histogramで求めたビンの平均色。
+        weights (np.ndarray): 各ビンのピクセル数。
+        max_colors (int): 色の数の上限。
+
+    Returns:
+        tuple: (各グループの平均色 (色の数, 3), 各グループのピクセル数)。平均色はK-meansの初期値にも使える。
+    """
+    total_weight = float(weights.sum())
+    groups = [np.arange(len(colors))]
+    d = colors - weights @ colors / total_weight
+    root_sse = float((weights * (d ** 2).sum(axis=1)).sum()) # 1色で表したときの二乗誤差
+    splits = [_best_split(colors, weights, groups[0], total_weight)]
+    while len(groups) < max_colors:
+        candidates = [(split[0], i) for i, split in enumerate(splits) if split is not None]
+        if not candidates:
+            break
+        gain, i = max(candidates)
+        if gain < AUTO_MIN_GAIN * root_sse:
+            break
+        _, left, right = splits[i]
+        groups[i:i + 1] = [left, right]
+        splits[i:i + 1] = [_best_split(colors, weights, left, total_weight), _best_split(colors, weights, right, total_weight)]
+    counts = np.array([weights[group].sum() for group in groups], np.float64)
+    return np.stack([weights[group] @ colors[group] / count for group, count in zip(groups, counts)]), counts
+
+def _merge_similar_colors(centers: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    色差がAUTO_MIN_DELTA_E未満の色を、ピクセル数で重み付けした平均色にまとめる。ピクセル数が0の色は除く。
+
+    Returns:
+        tuple: (まとめた後の色の配列, 各色のピクセル数)
+    """
+    keep = counts > 0
+    centers, counts = np.asarray(centers, np.float64)[keep], np.asarray(counts, np.float64)[keep]
+    while len(centers) > 1:
+        lab = _to_lab(centers)
+        distances = _color_difference(lab[:, None], lab[None, :])
+        np.fill_diagonal(distances, np.inf)
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        if distances[i, j] >= AUTO_MIN_DELTA_E:
+            break
+        merged = (centers[i] * counts[i] + centers[j] * counts[j]) / (counts[i] + counts[j])
+        centers[i], counts[i] = merged, counts[i] + counts[j]
+        centers, counts = np.delete(centers, j, axis=0), np.delete(counts, j)
+    return centers, counts
+
+def cluster_regions(pixels: np.ndarray, region_index: np.ndarray, num_regions: int, max_colors: int = REGION_MAX_COLORS) -> list[tuple[list[ExtractedColor], int]]:
+    """
+    領域ごとにメインの色と割合を求める。領域ごとに画像を切り出してK-meansを繰り返すのではなく、
+    (領域, ヒストグラムのビン) の組み合わせで1回だけbincountし、全領域のヒストグラムを同時に作る。
+    各領域の色は、そのヒストグラムから作った分割の木（色の数の自動選択と同じ方法）で求める。
+
+    Args:
+        pixels (np.ndarray): prepare_pixelsで作った (ピクセル数, 3) のRGB配列。
+        region_index (np.ndarray): 各ピクセルの領域の番号（region_labelsの結果をpixelsと同じ順に並べたもの。-1はどの領域にも入れない）。
+        num_regions (int): 領域の数。
+        max_colors (int): 1つの領域から抽出する色の数の上限。
+
+    Returns:
+        list[tuple[list[ExtractedColor], int]]: 領域ごとの (抽出された色（割合は領域内のピクセル数に対する%）, 領域のピクセル数)。
+    """
+    num_bins = HISTOGRAM_BINS ** 3
+    valid = region_index >= 0
+    joint_index = region_index[valid].astype(np.int64) * num_bins + _histogram_bin_index(pixels[valid])
+    size = num_regions * num_bins
+    bin_counts = np.bincount(joint_index, minlength=size).reshape(num_regions, num_bins)
+    channel_sums = np.stack([
+        np.bincount(joint_index, weights=pixels[valid, c], minlength=size).reshape(num_regions, num_bins)
+        for c in range(3)
+    ], axis=2)
+
+    results = []
+    for region in range(num_regions):
+        occupied = np.flatnonzero(bin_counts[region])
+        total = int(bin_counts[region, occupied].sum())
+        if total == 0:
+            results.append(([], 0))
+            continue
+        weights = bin_counts[region, occupied]
+        bin_colors = channel_sums[region, occupied] / weights[:, None]
+        centers, counts = _merge_similar_colors(*_split_hierarchy(bin_colors, weights, max_colors))
+        results.append((_to_extracted_colors(centers, counts, total), total))
+    return results
+
+def region_labels(
+    mask: np.ndarray | None,
+    shape: tuple[int, int],
+    method: str = "grid",
+    grid: tuple[tuple[str, float], ...] = DEFAULT_REGION_GRID,
+) -> tuple[np.ndarray, list[str]]:
+    """
+    作業用画像の各ピクセルがどの領域（トップス・ボトムス・小物など）に入るかを求める。
+
+    - "grid": 画像を grid で指定した上下の帯に分ける（服の領域があればその中だけ）。
+    - "components": 服の領域をつながった部分に分け、大きな部分を上から順に top, bottom、
+      小さな部分をまとめて accessories とする。大きな部分が1つしかない（上下の服がつながっている）場合は、
+      その部分を grid の帯で分ける。服の領域がない場合は "grid" と同じ。
+
+    Args:
+        mask (np.ndarray | None): identify_clothing_areaで求めた服の領域（Noneの場合は画像全体）。
+        shape (tuple[int, int]): 作業用画像の (高さ, 幅)。
+        method (str): "grid" または "components"。
+        grid (tuple[tuple[str, float], ...]): (領域名, 帯の下端の位置（0〜1）) を上から順に並べたもの。
+
+    Returns:
+        tuple: (領域の番号の配列（高さ×幅のint32。-1はどの領域にも入れない）, 領域名のリスト)
+    """
+    if method not in REGION_METHODS or method == "none":
+        raise ValueError(f"不明な領域の分け方です: {method}")
+    h, w = shape
+    # 各行がどの帯に入るか（帯の下端の位置と行の中心を比べる）
+    edges = np.array([edge for _, edge in grid], np.float64) * h
+    band_of_row = np.minimum(np.searchsorted(edges, np.arange(h) + 0.5), len(grid) - 1).astype(np.int32)
+    band_labels = np.broadcast_to(band_of_row[:, None], (h, w))
+    grid_names = [name for name, _ in grid]
+
+    if method == "grid" or mask is None:
+        labels = band_labels.copy()
+        if mask is not None:
+            labels[~mask] = -1
+        return labels, grid_names
+
+    count, components, stats, centroids = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA] # 0番は背景
+    total = areas.sum()
+    major = [i + 1 for i in np.flatnonzero(areas >= total * REGION_MAJOR_SHARE)]
+    minor = [i + 1 for i in np.flatnonzero((areas >= total * REGION_MIN_SHARE) & (areas < total * REGION_MAJOR_SHARE))]
+    major.sort(key=lambda i: centroids[i][1]) # 上にあるものから
+
+    labels = np.full((h, w), -1, np.int32)
+    if len(major) == 1:
+        # 上下の服がつながっている場合は、帯で分ける
+        names = list(grid_names)
+        inside = components == major[0]
+        labels[inside] = band_labels[inside]
+    else:
+        names = ["top", "bottom"][:len(major)]
+        for i, component in enumerate(major[:2]):
+            labels[components == component] = i
+        minor += major[2:] # 3つ目以降の大きな部分は小物とまとめる
+    if minor:
+        names.append(REGION_ACCESSORIES)
+        labels[np.isin(components, minor)] = len(names) - 1
+    return labels, names
+
+def identify_clothing_area(image_np: np.ndarray, method: str = "grabcut") -> np.ndarray | None:
+    """
+    画像から服の領域を識別する（CPUで動く簡易版）。
+    縮小した画像に対してGrabCutで前景（人物と服）を求め、肌の色のピクセルを除いてから元のサイズに拡大する。
     より高度な服のセグメンテーションには、深層学習モデル（例: Mask R-CNN, U-Net）が必要です。
 
     Args:
         image_np (np.ndarray): OpenCV形式の画像（NumPy配列）。
+        method (str): "grabcut" または "none"（識別せず画像全体を使う）。
 
     Returns:
-        np.ndarray: 服の領域のみを含む画像（背景は黒または透明）。
+        np.ndarray | None: 服の領域を表すbool配列（画像と同じ高さ・幅）。
+                           識別しない場合や、領域が小さすぎて識別に失敗した場合はNone（画像全体を使う）。
     """
-    # ここでは簡易的に、画像全体を服の領域と見なします。
-    # 今後、モデルを使って人物や服のセグメンテーションを行う必要（例: 背景除去 (GrabCut, Deep Learning based Background Removal)）
+    if method not in SEGMENTATION_METHODS:
+        raise ValueError(f"不明な服の領域の識別方法です: {method}")
+    if method == "none":
+        return None
 
-    # 現状は、画像全体を返す。
-    return image_np
+    # GrabCutは画素数に比例して遅くなるので、長辺SEGMENTATION_MAX_SIDEまで縮小してから実行する
+    h, w = image_np.shape[:2]
+    scale = min(1.0, SEGMENTATION_MAX_SIDE / max(h, w))
+    small = image_np
+    if scale < 1:
+        small = cv2.resize(image_np, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    sh, sw = small.shape[:2]
+    if sh < 16 or sw < 16:
+        return None
+
+    # 服を着た人物は画像の中央付近に写っていると仮定し、外周を背景として初期化する
+    rect = (int(sw * 0.1), int(sh * 0.05), int(sw * 0.8), int(sh * 0.9))
+    grabcut_mask = np.zeros((sh, sw), np.uint8)
+    background_model = np.zeros((1, 65), np.float64)
+    foreground_model = np.zeros((1, 65), np.float64)
+    try:
+        cv2.grabCut(small, grabcut_mask, rect, background_model, foreground_model, GRABCUT_ITERATIONS, cv2.GC_INIT_WITH_RECT)
+    except cv2.error:
+        return None
+    foreground = (grabcut_mask == cv2.GC_FGD) | (grabcut_mask == cv2.GC_PR_FGD)
+
+    # 肌の色（YCrCb空間の一般的な範囲）を除く。ただし服自体が肌色に近く、大半が消える場合は除かない
+    ycrcb = cv2.cvtColor(small, cv2.COLOR_BGR2YCrCb)
+    cr, cb = ycrcb[..., 1], ycrcb[..., 2]
+    skin = (cr >= 133) & (cr <= 173) & (cb >= 77) & (cb <= 127)
+    clothing = foreground & ~skin
+    if clothing.sum() >= foreground.sum() * 0.5:
+        foreground = clothing
+
+    if foreground.mean() < MIN_CLOTHING_RATIO:
+        return None
 
+    if scale < 1:
+        foreground = cv2.resize(foreground.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST).astype(bool)
+    return foreground
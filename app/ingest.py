@@ -0,0 +1,272 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from . import config
+from .decoding import decode_image
+from .image_processing import AUTO_MAX_COLORS, AUTO_NUM_COLORS, COLOR_ENGINES, SEGMENTATION_METHODS, WORKING_WIDTH, identify_clothing_area, resize_to_working, prepare_pixels, cluster_pixels
+from .color_classifier import classify_extracted_colors
+from .pipeline import init_worker
+from .metrics import collect_timings, stage
+from .palette_index import PaletteIndex
+
+
+# 画像ディレクトリを一括で解析するコマンドラインツール
+# HTTP APIを経由せず、プロセスプールで並列に処理して結果をJSONLに1行ずつ書き出す。
+# 出力ファイルに書き込み済みの画像は再実行時に飛ばすので、中断しても続きから再開できる。
+#
+# 使い方:
+#   python -m app.ingest /data/catalog --output colors.jsonl
+#   python -m app.ingest --file-list paths.txt --output colors.jsonl --workers 8
+#   python -m app.ingest /data/catalog --output colors.jsonl --index search_index  # 色の検索インデックスにも追加
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+def iter_image_paths(inputs: list[str], file_list: str | None = None):
+    """ディレクトリ（再帰的に探索）、画像ファイル、ファイルリストから画像のパスを順に返す。"""
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort() # 実行するたびに同じ順番で処理する
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield os.path.join(root, name)
+        else:
+            yield path
+    if file_list:
+        with open(file_list, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+def load_done_paths(output_path: str) -> set[str]:
+    """出力ファイルに書き込み済みの画像のパスを読み込む（再開用）。"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["path"])
+            except (json.JSONDecodeError, KeyError):
+                continue # 中断時に書きかけになった行は無視する
+    return done
+
+def process_path(path: str, num_colors: int | str, engine: str, segmentation: str = "grabcut") -> dict:
+    """
+    1枚の画像を解析する（ワーカープロセスで実行される）。
+
+    Returns:
+        dict: パス、画像サイズ、抽出・分類された色、各段階の処理時間（秒）。失敗した場合は "error" を含む。
+    """
+    with collect_timings() as timings:
+        try:
+            with stage("read"):
+                with open(path, "rb") as f:
+                    contents = f.read()
+        except OSError as e:
+            return {"path": path, "error": f"ファイルを読み込めませんでした: {e}", "timings": timings}
+
+        with stage("decode"):
+            img, diagnostics = decode_image(contents, target_width=WORKING_WIDTH)
+        if img is None:
+            return {"path": path, "error": "画像の読み込みに失敗しました。", "timings": timings}
+
+        # resize, cvt_color, cluster_* の時間は image_processing の中で記録される
+        working_img = resize_to_working(img)
+        with stage("identify_clothing_area"):
+            clothing_mask = identify_clothing_area(working_img, method=segmentation)
+        dominant_colors = cluster_pixels(prepare_pixels(working_img, mask=clothing_mask), num_colors=num_colors, engine=engine)
+        with stage("classify"):
+            classified_colors = classify_extracted_colors(dominant_colors)
+
+    return {
+        "path": path,
+        "image_dimensions": diagnostics["source_size"],
+        "classified_colors": classified_colors,
+        "timings": timings,
+    }
+
+def run_ingest(
+    paths,
+    output_path: str,
+    workers: int,
+    num_colors: int | str = 3,
+    engine: str | None = None,
+    segmentation: str | None = None,
+    progress_every: int = 1000,
+    index_dir: str | None = None,
+) -> dict:
+    """
+    画像を並列に解析して結果をJSONLに追記し、処理の統計を返す。
+
+    Args:
+        paths: 画像パスのイテラブル。
+        output_path (str): 結果を書き出すJSONLファイル（再開時のチェックポイントも兼ねる）。
+        workers (int): ワーカープロセス数。
+        num_colors (int | str): 抽出する色の数（"auto" の場合は画像ごとに選ぶ）。
+        engine (str | None): 色抽出エンジン。Noneの場合はAPIと同じ設定値（COLOR_ENGINE）。
+        segmentation (str | None): 服の領域の識別方法。Noneの場合はAPIと同じ設定値（SEGMENTATION）。
+        progress_every (int): 何枚ごとに進捗を表示するか。
+        index_dir (str | None): 指定すると、解析した画像の色を検索インデックスにも追加する（商品IDは画像のパス）。
+
+    Returns:
+        dict: 処理枚数、エラー数、スキップ数、次回の実行で再試行する数、経過時間、1秒あたりの枚数、段階ごとの処理時間の合計。
+    """
+    # APIと同じ設定で解析しないと、同じ画像でも /uploadfile/ と違う色が検索インデックスに入ってしまう
+    engine = engine or config.COLOR_ENGINE
+    segmentation = segmentation or config.SEGMENTATION
+    done = load_done_paths(output_path)
+    stats = {"processed": 0, "errors": 0, "skipped": 0, "retry": 0}
+    stage_totals = {} # 段階名 -> 全画像の合計処理時間（秒）
+    palette_index = PaletteIndex(index_dir) if index_dir else None
+    started = time.perf_counter()
+
+    # 前回が書きかけの行で終わっていたら改行を足してから追記する
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    def make_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+
+    pool = make_pool()
+    pool_broken = False
+    with open(output_path, "a", encoding="utf-8") as out:
+        if needs_newline:
+            out.write("\n")
+
+        def write_result(result: dict) -> None:
+            for stage_name, seconds in result["timings"].items():
+                stage_totals[stage_name] = stage_totals.get(stage_name, 0.0) + seconds
+            stats["errors" if "error" in result else "processed"] += 1
+            # JSONLより先にインデックスへ追加する（JSONLに書いた画像は再開時に飛ばされるため）
+            if palette_index is not None and "error" not in result:
+                try:
+                    palette_index.add(result["path"], result["classified_colors"])
+                except ValueError as e:
+                    print(f"検索インデックスに追加できませんでした: {e}", file=sys.stderr)
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush() # 中断されても書き込み済みの分は再開時に飛ばせるように
+            total = stats["processed"] + stats["errors"]
+            if progress_every and total % progress_every == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{total}枚処理済み ({total / elapsed:.1f}枚/秒)", file=sys.stderr)
+
+        def collect(future, path: str) -> None:
+            nonlocal pool_broken
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # ワーカーが落ちた（メモリ不足など）。画像のせいとは限らないので処理済みにはせず、次回の実行で再試行する
+                pool_broken = True
+                stats["retry"] += 1
+                return
+            except Exception as e:
+                # デコードや色の抽出で失敗した画像はエラーとして記録し、残りの処理を続ける
+                result = {"path": path, "error": f"{type(e).__name__}: {e}", "timings": {}}
+            write_result(result)
+
+        # 全パスを一度に投入するとメモリを使いすぎるので、実行中の件数をワーカー数の数倍に抑える
+        max_inflight = workers * 4
+        inflight = {} # Future -> 画像のパス
+        try:
+            for path in paths:
+                if path in done:
+                    stats["skipped"] += 1
+                    continue
+                done.add(path) # 同じパスが入力に重複していても1回だけ処理する
+                try:
+                    if pool_broken:
+                        raise BrokenProcessPool
+                    future = pool.submit(process_path, path, num_colors, engine, segmentation)
+                except BrokenProcessPool:
+                    # 壊れたプールには投入できないので作り直す（実行中だった分は collect で再試行扱いになる）
+                    print("ワーカープロセスが異常終了したため、プールを作り直します。", file=sys.stderr)
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = make_pool()
+                    pool_broken = False
+                    future = pool.submit(process_path, path, num_colors, engine, segmentation)
+                inflight[future] = path
+                if len(inflight) >= max_inflight:
+                    finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        collect(future, inflight.pop(future))
+            for future in wait(inflight).done:
+                collect(future, inflight[future])
+            pool.shutdown()
+        except KeyboardInterrupt:
+            # 書き込み済みの分はそのまま残し、次回の実行で続きから再開する
+            print("中断しました。同じコマンドを再実行すると続きから再開します。", file=sys.stderr)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    total = stats["processed"] + stats["errors"]
+    return {
+        **stats,
+        "elapsed_seconds": round(elapsed, 3),
+        "images_per_second": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        "stage_seconds": {stage_name: round(seconds, 3) for stage_name, seconds in stage_totals.items()},
+    }
+
+def _num_colors_arg(value: str) -> int | str:
+    """--num-colors の値（1〜AUTO_MAX_COLORSの整数または "auto"）を確認する。"""
+    if value == AUTO_NUM_COLORS:
+        return value
+    if value.isdigit() and 1 <= int(value) <= AUTO_MAX_COLORS:
+        return int(value)
+    raise argparse.ArgumentTypeError(f"1〜{AUTO_MAX_COLORS}の整数または {AUTO_NUM_COLORS} を指定してください: {value}")
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.ingest", description="画像ディレクトリの色を一括で解析し、JSONLに書き出します。")
+    parser.add_argument("inputs", nargs="*", help="画像ファイルまたはディレクトリ（再帰的に探索）")
+    parser.add_argument("--file-list", help="1行に1つ画像のパスを書いたファイル")
+    parser.add_argument("--output", "-o", required=True, help="結果を書き出すJSONLファイル（既存の場合は続きから再開）")
+    parser.add_argument("--workers", "-w", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数")
+    parser.add_argument("--num-colors", type=_num_colors_arg, default=config.NUM_COLORS, help="抽出する色の数（auto で画像ごとに選ぶ。省略時はAPIと同じ NUM_COLORS）")
+    parser.add_argument("--engine", choices=COLOR_ENGINES, default=config.COLOR_ENGINE, help="色抽出エンジン（省略時はAPIと同じ COLOR_ENGINE）")
+    parser.add_argument("--segmentation", choices=SEGMENTATION_METHODS, default=config.SEGMENTATION, help="服の領域の識別方法（省略時はAPIと同じ SEGMENTATION）")
+    parser.add_argument("--index", help="解析した画像の色を追加する検索インデックスのディレクトリ（/search/similar で検索できる）")
+    parser.add_argument("--progress-every", type=int, default=1000, help="何枚ごとに進捗を表示するか（0で表示しない）")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.file_list:
+        parser.error("画像ファイル・ディレクトリ、または --file-list を指定してください。")
+
+    summary = run_ingest(
+        iter_image_paths(args.inputs, args.file_list),
+        output_path=args.output,
+        workers=args.workers,
+        num_colors=args.num_colors,
+        engine=args.engine,
+        segmentation=args.segmentation,
+        progress_every=args.progress_every,
+        index_dir=args.index,
+    )
+
+    total = summary["processed"] + summary["errors"]
+    print(f"処理: {summary['processed']}枚, エラー: {summary['errors']}枚, スキップ（処理済み）: {summary['skipped']}枚")
+    if summary["retry"]:
+        print(f"ワーカーの異常終了で処理できなかった画像: {summary['retry']}枚（同じコマンドを再実行すると再試行します）")
+    print(f"経過時間: {summary['elapsed_seconds']}秒, {summary['images_per_second']}枚/秒")
+    print("段階ごとの処理時間（全ワーカーの合計 / 1枚あたり平均）:")
+    for stage_name, seconds in summary["stage_seconds"].items():
+        average_ms = seconds / total * 1000 if total else 0.0
+        print(f"  {stage_name:<24} {seconds:>10.3f}秒 {average_ms:>9.2f}ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
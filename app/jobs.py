@@ -0,0 +1,264 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+
+# 非同期ジョブ（POST /jobs → GET /jobs/{id}）
+# 大きな画像や時間のかかる設定（num_colors=auto, regions=components など）は、HTTPの接続を開いたまま
+# 待たせるとタイムアウトやプロキシの制限に引っかかりやすい。アップロードを一時ファイルに保存してすぐにジョブIDを返し、
+# プロセス内のキューから少数のワーカー（asyncioのタスク）が順番に取り出して処理する。
+# - 結果は /uploadfile/ と同じ形の辞書で、終わってから一定時間（保持期間）だけ取り出せる
+# - キューとジョブの状態はこのプロセスのメモリにあるので、/jobs を使う場合はuvicornのワーカーを1つにする
+#   （ワーカーが複数あると、GET /jobs/{id} がジョブを受け付けたのとは別のプロセスに届いて404になる）
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+class JobQueueFullError(Exception):
+    """待機中・実行中のジョブが上限に達していて、新しいジョブを受け付けられないときに送出される。"""
+
+
+class JobFailedError(Exception):
+    """ジョブの処理が失敗したことを、HTTPステータスコードとともに伝える。"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _isoformat(timestamp: float | None) -> str | None:
+    """UNIX時刻をISO 8601形式（UTC）の文字列にする。"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+@dataclass
+class Job:
+    """1件のジョブの状態。アップロードは path の一時ファイルに保存し、処理が終わったら削除する。"""
+    id: str
+    path: str # アップロードされた画像の一時ファイル
+    filename: str | None
+    content_type: str | None
+    params: dict # 画像解析パイプラインに渡す引数（_pipeline_params の結果）
+    fields: tuple[str, ...] | None = None # 結果に含める項目（?fields=）
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    attempts: int = 0 # 混雑で実行できず、待ってからやり直した回数を含む実行回数
+    result: dict | None = None # /uploadfile/ と同じ形のレスポンス（status が "done" の場合）
+    error: dict | None = None # {"status_code", "detail"}（status が "failed" の場合）
+
+    def to_dict(self, retention_seconds: float, queue_position: int | None = None) -> dict:
+        """GET /jobs/{id} のレスポンスにする。"""
+        body = {
+            "id": self.id,
+            "status": self.status,
+            "created_at": _isoformat(self.created_at),
+            "started_at": _isoformat(self.started_at),
+            "finished_at": _isoformat(self.finished_at),
+            # 終わったジョブは、この時刻を過ぎると削除されて404になる
+            "expires_at": _isoformat(self.finished_at + retention_seconds) if self.finished_at is not None else None,
+            "result": self.result,
+            "error": self.error,
+        }
+        if queue_position is not None:
+            body["queue_position"] = queue_position # 先に待っているジョブの数
+        return body
+
+
+class JobManager:
+    """
+    ジョブの受け付け・キュー・ワーカー・保持期間を過ぎたジョブの削除をまとめたクラス。
+    イベントループのスレッドからだけ呼ばれる前提（ロックは使わない）。
+    """
+
+    def __init__(self, workers: int = 1, max_pending: int = 100, retention_seconds: float = 3600, directory: str | None = None):
+        """
+        Args:
+            workers (int): 同時に処理するジョブの数。
+            max_pending (int): 待機中・実行中のジョブ数の上限（超えるとJobQueueFullError）。
+            retention_seconds (float): 終わったジョブの結果を保持する秒数。
+            directory (str | None): アップロードを保存する一時ディレクトリを作る場所（Noneの場合はOSの一時ディレクトリ）。
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.directory = directory
+        self._jobs: dict[str, Job] = {} # 作られた順に並ぶ
+        self._queue: asyncio.Queue[str] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._spool_dir: str | None = None
+        self._pending = 0 # 待機中＋実行中のジョブ数
+        self._stats = {"submitted": 0, "done": 0, "failed": 0, "expired": 0, "rejected": 0}
+
+    def start(self, handler) -> None:
+        """
+        ワーカーと、保持期間を過ぎたジョブの削除を起動する。
+
+        Args:
+            handler: ジョブを処理するコルーチン関数 handler(job, contents) -> dict。
+                     /uploadfile/ と同じ形のレスポンスを返し、失敗した場合は例外を送出する。
+        """
+        if self._tasks:
+            return
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        # プロセスごとに別のディレクトリを作り、終了時にまとめて消す（前回の残りと混ざらないように）
+        self._spool_dir = tempfile.mkdtemp(prefix="fashion-jobs-", dir=self.directory or None)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work(handler)) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._expire_loop()))
+
+    async def stop(self) -> None:
+        """ワーカーを止め、保存したアップロードを削除する（処理中・待機中のジョブは失われる）。"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._spool_dir is not None:
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+            self._spool_dir = None
+
+    @property
+    def pending(self) -> int:
+        """待機中または実行中のジョブ数。"""
+        return self._pending
+
+    async def submit(self, source, filename: str | None, content_type: str | None, params: dict, fields: tuple[str, ...] | None = None) -> Job:
+        """
+        アップロードを一時ファイルに保存し、ジョブをキューに入れる。
+
+        Args:
+            source: アップロードされたファイルのファイルオブジェクト（UploadFile.file）。
+            filename (str | None): ファイル名。
+            content_type (str | None): MIMEタイプ。
+            params (dict): 画像解析パイプラインに渡す引数。
+            fields (tuple[str, ...] | None): 結果に含める項目。
+
+        Returns:
+            Job: 作成したジョブ（status は "queued"）。
+
+        Raises:
+            JobQueueFullError: 待機中・実行中のジョブが上限に達している場合。
+        """
+        if self._queue is None:
+            raise RuntimeError("JobManager.start() を呼んでからジョブを追加してください。")
+        if self._pending >= self.max_pending:
+            self._stats["rejected"] += 1
+            raise JobQueueFullError("処理待ちのジョブが多すぎます。しばらくしてから再度お試しください。")
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self._spool_dir, job_id)
+        self._pending += 1 # 保存している間に上限を超えて受け付けないよう、先に数える
+        try:
+            # UploadFileは大きな本体をすでにディスクに書き出しているので、メモリに読み込まずにコピーする
+            await asyncio.to_thread(_copy_to_file, source, path)
+        except BaseException:
+            self._pending -= 1
+            raise
+        job = Job(id=job_id, path=path, filename=filename, content_type=content_type, params=params, fields=fields)
+        self._jobs[job_id] = job
+        self._stats["submitted"] += 1
+        self._queue.put_nowait(job_id)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """ジョブを取り出す。見つからない（または保持期間を過ぎて削除された）場合はNone。"""
+        return self._jobs.get(job_id)
+
+    def queue_position(self, job: Job) -> int | None:
+        """待機中のジョブの前に待っているジョブの数（待機中でなければNone）。"""
+        if job.status != "queued":
+            return None
+        # _jobs は作られた順に並ぶので、このジョブより前の待機中のジョブを数える
+        position = 0
+        for other in self._jobs.values():
+            if other is job:
+                return position
+            if other.status == "queued":
+                position += 1
+        return None
+
+    def to_dict(self, job: Job) -> dict:
+        """GET /jobs/{id} のレスポンスにする。"""
+        return job.to_dict(self.retention_seconds, self.queue_position(job))
+
+    async def _work(self, handler) -> None:
+        """キューからジョブを1件ずつ取り出して処理するワーカー。"""
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                contents = await asyncio.to_thread(_read_file, job.path)
+                job.result = await handler(job, contents)
+                job.status = "done"
+            except asyncio.CancelledError:
+                raise
+            except JobFailedError as e:
+                job.status = "failed"
+                job.error = {"status_code": e.status_code, "detail": str(e)}
+            except Exception as e:
+                job.status = "failed"
+                job.error = {"status_code": 500, "detail": f"ジョブの処理中にエラーが発生しました: {type(e).__name__}"}
+            finally:
+                job.finished_at = time.time()
+                self._pending -= 1
+                if job.status in ("done", "failed"):
+                    self._stats[job.status] += 1
+                await asyncio.to_thread(_remove_file, job.path)
+
+    async def _expire_loop(self) -> None:
+        """保持期間を過ぎた終了済みのジョブを定期的に削除する。"""
+        interval = min(60.0, max(1.0, self.retention_seconds / 4))
+        while True:
+            await asyncio.sleep(interval)
+            self.expire()
+
+    def expire(self, now: float | None = None) -> int:
+        """
+        保持期間を過ぎた終了済みのジョブを削除する。
+
+        Returns:
+            int: 削除したジョブの数。
+        """
+        now = time.time() if now is None else now
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at >= self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self._stats["expired"] += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        """ジョブの件数を返す。"""
+        counts = {status: 0 for status in JOB_STATUSES}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {**self._stats, **{f"{status}_jobs": count for status, count in counts.items()}}
+
+
+def _copy_to_file(source, path: str) -> None:
+    source.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(source, f, 1024 * 1024)
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
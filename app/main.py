@@ -1,21 +1,208 @@
-from fastapi import FastAPI, File, UploadFile  #FastAPI は、PythonでAPI（Webサービス）を構築するためのフレームワーク。UploadFile は、一時ファイルとしてメモリやディスクに保存しながら大きなファイルを効率的に扱うためのもの。
-from fastapi.responses import HTMLResponse  #HTMLコンテンツを直接返すことができる。簡単なWebページを表示したり、フォームを作成したりする際に使用
+import asyncio # 重い処理をスレッドに逃がすため
+import io # zipアーカイブをメモリ上で開くため
+import logging # 起動時間などをuvicornのログに出すため
+import mimetypes # zip内のファイル名からMIMEタイプを推測するため
+import os
+import time # 処理時間の計測
+import zipfile # 複数画像をまとめたzipアーカイブを受け取るため
+from contextlib import asynccontextmanager # アプリの起動・終了時の処理（lifespan）を定義するため
+from typing import Literal # 受け付ける値を限定したパラメータのため
+from fastapi import FastAPI, File, Form, Header, HTTPException, Query, UploadFile, WebSocket, WebSocketDisconnect  #FastAPI は、PythonでAPI（Webサービス）を構築するためのフレームワーク。UploadFile は、一時ファイルとしてメモリやディスクに保存しながら大きなファイルを効率的に扱うためのもの。
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse  #HTMLコンテンツを直接返すことができる。簡単なWebページを表示したり、フォームを作成したりする際に使用
 import uvicorn   #uvicorn (ユービコーン) は、Pythonの非同期Webサーバー（ASGIサーバー）です。
-import io  #Pythonで入出力（I/O）操作を行うためのツールを提供
-import cv2  #OpenCVという非コンピュータビジョンライブラリのPythonバインディングです。
-import numpy as np #Pythonで数値計算を効率的に行うためのライブラリです。
-import base64 # 画像をBase64エンコードするために追加
-from .image_processing import identify_clothing_area, extract_dominant_colors #image_processing.pyからidentify_clothing_areaとextract_dominant_colorsを使えるように
-from .color_classifier import classify_extracted_colors #分類された色情報をAPIに含める
-from .color_combinations import suggest_color_combinations
+from . import config # 環境変数から読み込んだ設定値
+from .admission import AdmissionController, estimate_cost # 処理コストに応じた受け付け制御と品質の引き下げ
+from .cache import ResultCache # 同じ画像の解析結果を再利用する
+from . import compression # レスポンスのbrotli/gzip圧縮と、起動時に圧縮しておくトップページ
+from .color_combinations import rules_version # 組み合わせ提案のルールの版（キャッシュキーに含める）
+from .color_classifier import palette_version # 色名のパレットの版（キャッシュキーに含める）
+from .decoding import ImageTooLargeError, check_image_size # デコードする前に画素数の上限を確認する
+from .executor import ExecutorSaturatedError, PipelineExecutor # 画像処理をイベントループの外で実行する
+from .jobs import Job, JobFailedError, JobManager, JobQueueFullError # 大きな画像などを後から受け取る非同期ジョブ
+from .image_processing import AUTO_MAX_COLORS, AUTO_NUM_COLORS, REGION_METHODS # 抽出する色の数の上限と自動選択、領域の分け方
+from . import metrics # 段階ごとの処理時間などのメトリクス
+from . import serialization # レスポンスをorjsonまたはMessagePackで返す
+from .pipeline import PIPELINE_OUTPUTS, analyze_image, init_worker, make_warm_up_image, warm_up # デコード→色抽出→分類→提案→エンコードをまとめた処理
+from .palette_index import PaletteIndex # 色の組み合わせが似ている商品の検索
+from .preview import PreviewStore # プレビュー用サムネイルの保存先
+from .streaming import StreamSession # カメラ映像の色を接続ごとに少しずつ更新する
+from .upload_limits import UploadSizeLimitMiddleware # 大きすぎるアップロードを受信中に打ち切る
 
 
-app = FastAPI() #今からwebアプリを作りますという合図
+# 画像処理はCPUを長時間使うので、イベントループをブロックしないようワーカープールで実行する
+executor = PipelineExecutor(
+    backend=config.EXECUTOR_BACKEND,
+    max_workers=config.EXECUTOR_WORKERS,
+    max_queue=config.EXECUTOR_MAX_QUEUE,
+    initializer=init_worker, # 各ワーカーの起動時にRGB→色名の変換表を読み込む
+)
 
-# ルートエンドポイント（HTMLページを表示）
-@app.get("/", response_class=HTMLResponse) #fastapiでwebページを返す時に使う。@app.get("/"):WebサイトのルートURLにGETリクエストが来たときに、この下で定義されている関数を実行
-async def read_root(): #非同期関数を定義　
-    return """
+# 混み合ったときは処理を軽くして受け付け、期限に間に合わない場合だけ503を返す
+admission = AdmissionController(
+    max_workers=executor.max_workers,
+    max_requests=executor.capacity,
+    max_cost=config.ADMISSION_MAX_COST or executor.capacity * 2,
+)
+
+# 同じ商品写真が何度もアップロードされるので、画像のハッシュをキーに結果をキャッシュする
+result_cache = ResultCache(
+    max_entries=config.CACHE_MAX_ENTRIES,
+    ttl_seconds=config.CACHE_TTL_SECONDS,
+    disk_dir=config.CACHE_DIR or None,
+)
+
+# プレビュー画像はレスポンスに埋め込まず、GET /preview/{id} で別に配信する
+preview_store = PreviewStore(max_bytes=config.PREVIEW_STORE_MAX_BYTES)
+
+# 商品の色の検索インデックス（ファイルをメモリマップで開くので、複数のワーカープロセスで共有される）
+palette_index = PaletteIndex(config.SEARCH_INDEX_DIR)
+
+# POST /jobs で受け付けたジョブ。同期リクエストのためにワーカーの半分は空けておく
+job_manager = JobManager(
+    workers=config.JOB_WORKERS or max(1, executor.max_workers // 2),
+    max_pending=config.JOB_MAX_PENDING,
+    retention_seconds=config.JOB_RETENTION_SECONDS,
+    directory=config.JOB_DIR or None,
+)
+
+# 接続中のWebSocketストリームの数
+active_streams = 0
+
+logger = logging.getLogger("uvicorn.error") # uvicornのログと同じ形式で出力する
+
+# 起動にかかった時間（秒）。オートスケールで増えたサーバーが使えるようになるまでの時間を確認するため
+startup = {
+    "ready": False, # ウォームアップが終わり、リクエストを受けられる状態か
+    "import_seconds": metrics.process_uptime(), # プロセスの起動からこのモジュールの読み込みが終わるまで
+    "warmup_seconds": None,
+    "first_request_seconds": None, # プロセスの起動から最初のリクエスト（ヘルスチェックを除く）が終わるまで
+}
+
+async def _warm_up() -> None:
+    """
+    合成画像でパイプライン全体を実行して、各ワーカーでscikit-learnの読み込みなどを済ませてから ready にする。
+    サーバーは先に起動しておき、ウォームアップ中は /readyz が503を返す（その間はトラフィックが来ない）。
+    """
+    started = time.perf_counter()
+    try:
+        # ワーカーの数だけ同時に投入すると、プロセスプールは各ワーカーを起動してそれぞれで実行する
+        await asyncio.gather(*[executor.run(warm_up) for _ in range(executor.max_workers)])
+        # WebSocketのストリーミング解析はこのプロセスのスレッドで実行するので、こちらも温めておく
+        await asyncio.to_thread(StreamSession().process_frame, make_warm_up_image())
+        await asyncio.to_thread(rules_version) # 組み合わせ提案のルールファイルの読み込み
+    except Exception:
+        logger.exception("ウォームアップに失敗しました。/readyz は503のままになります。")
+        return
+    startup["warmup_seconds"] = time.perf_counter() - started
+    startup["ready"] = True
+    uptime = metrics.process_uptime()
+    logger.info(
+        "ウォームアップが完了しました（ワーカー%d個, %.2f秒）。プロセスの起動から%s",
+        executor.max_workers,
+        startup["warmup_seconds"],
+        f"{uptime:.2f}秒でリクエストを受け付けられます。" if uptime is not None else "リクエストを受け付けられます。",
+    )
+
+def _record_first_request(path: str) -> None:
+    """最初のリクエストが終わった時点で、プロセスの起動からの時間をログに出す（ヘルスチェックは数えない）。"""
+    if startup["first_request_seconds"] is not None or path in ("/healthz", "/readyz"):
+        return
+    startup["first_request_seconds"] = metrics.process_uptime()
+    if startup["first_request_seconds"] is not None:
+        logger.info("最初のリクエスト（%s）までの時間: %.2f秒", path, startup["first_request_seconds"])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executor.start() # 起動時にワーカープールを用意
+    job_manager.start(_run_job) # ジョブのワーカーを起動
+    if startup["import_seconds"] is not None:
+        logger.info("モジュールの読み込みが完了しました（プロセスの起動から%.2f秒）。", startup["import_seconds"])
+    warm_up_task = asyncio.create_task(_warm_up()) # 待たずに起動を続け、/healthz にはすぐ応答する
+    yield
+    warm_up_task.cancel()
+    await job_manager.stop() # 処理中のジョブを止めてから
+    executor.shutdown() # 終了時にワーカーを停止
+
+
+# 使う圧縮方式（起動時に確認しておく）
+COMPRESSION_ENCODINGS = tuple(name.strip() for name in config.COMPRESSION_ENCODINGS.split(",") if name.strip())
+if any(name not in compression.ENCODINGS for name in COMPRESSION_ENCODINGS):
+    raise ValueError(f"COMPRESSION_ENCODINGSには {', '.join(compression.ENCODINGS)} をカンマ区切りで指定してください: {config.COMPRESSION_ENCODINGS}")
+
+app = FastAPI(lifespan=lifespan) #今からwebアプリを作りますという合図
+# 大きすぎるアップロードは本体を受け取りきる前に413を返す（メトリクスのミドルウェアの内側に置き、413も記録されるようにする）
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=config.MAX_UPLOAD_BYTES,
+    path_limits={
+        "/uploadfiles/": config.BATCH_MAX_UPLOAD_BYTES, # zipや複数ファイルの一括処理は別の上限
+        "/jobs": config.JOB_MAX_UPLOAD_BYTES, # 非同期ジョブは大きな画像のためのものなので別の上限
+    },
+)
+# JSONやHTMLはAccept-Encodingに応じて圧縮する（メトリクスの内側に置き、送信バイト数は圧縮後の値を記録する）
+app.add_middleware(
+    compression.CompressionMiddleware,
+    minimum_size=config.COMPRESSION_MIN_BYTES,
+    gzip_level=config.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=config.COMPRESSION_BROTLI_QUALITY,
+    encodings=COMPRESSION_ENCODINGS,
+)
+app.add_middleware(metrics.MetricsMiddleware, on_request=_record_first_request) # 全リクエストの件数・処理時間・送受信バイト数を記録
+
+# キャッシュの統計も /metrics に含める
+def _cache_metrics() -> list[tuple]:
+    stats = result_cache.stats()
+    return [
+        ("fashion_cache_hits_total", "メモリキャッシュのヒット数", "counter", stats["hits"]),
+        ("fashion_cache_disk_hits_total", "ディスクキャッシュのヒット数", "counter", stats["disk_hits"]),
+        ("fashion_cache_misses_total", "キャッシュのミス数", "counter", stats["misses"]),
+        ("fashion_cache_coalesced_total", "実行中の同じ計算にまとめられたリクエスト数", "counter", stats["coalesced"]),
+        ("fashion_cache_entries", "メモリキャッシュの件数", "gauge", stats["entries"]),
+        ("fashion_executor_pending", "ワーカーで実行中または待機中のリクエスト数", "gauge", executor.pending),
+    ]
+metrics.registry.add_collector(_cache_metrics)
+
+# 受け付け制御の統計も /metrics に含める
+def _admission_metrics() -> list[tuple]:
+    stats = admission.stats()
+    return [
+        ("fashion_admission_admitted_total", "受け付けたリクエスト数", "counter", stats["admitted"]),
+        ("fashion_admission_degraded_total", "品質を下げて受け付けたリクエスト数", "counter", stats["degraded"]),
+        ("fashion_admission_rejected_total", "混雑のため503を返したリクエスト数", "counter", stats["rejected"]),
+        ("fashion_admission_inflight_cost", "実行中の処理コストの合計", "gauge", stats["inflight_cost"]),
+        ("fashion_admission_seconds_per_cost", "処理コスト1あたりの処理時間（秒）の推定値", "gauge", stats["seconds_per_cost"]),
+    ]
+metrics.registry.add_collector(_admission_metrics)
+
+# 非同期ジョブの統計も /metrics に含める
+def _job_metrics() -> list[tuple]:
+    stats = job_manager.stats()
+    return [
+        ("fashion_jobs_submitted_total", "受け付けたジョブ数", "counter", stats["submitted"]),
+        ("fashion_jobs_done_total", "正常に終わったジョブ数", "counter", stats["done"]),
+        ("fashion_jobs_failed_total", "失敗したジョブ数", "counter", stats["failed"]),
+        ("fashion_jobs_rejected_total", "待ちのジョブが多すぎて503を返した数", "counter", stats["rejected"]),
+        ("fashion_jobs_expired_total", "保持期間を過ぎて削除したジョブ数", "counter", stats["expired"]),
+        ("fashion_jobs_queued", "待機中のジョブ数", "gauge", stats["queued_jobs"]),
+        ("fashion_jobs_running", "実行中のジョブ数", "gauge", stats["running_jobs"]),
+    ]
+metrics.registry.add_collector(_job_metrics)
+
+# 起動時間も /metrics に含める
+def _startup_metrics() -> list[tuple]:
+    values = [("fashion_ready", "ウォームアップが終わってリクエストを受け付けられるか（1: はい）", "gauge", int(startup["ready"]))]
+    for key, name, documentation in (
+        ("import_seconds", "fashion_startup_import_seconds", "プロセスの起動からモジュールの読み込みが終わるまでの秒数"),
+        ("warmup_seconds", "fashion_startup_warmup_seconds", "ウォームアップにかかった秒数"),
+        ("first_request_seconds", "fashion_startup_first_request_seconds", "プロセスの起動から最初のリクエストが終わるまでの秒数"),
+    ):
+        if startup[key] is not None:
+            values.append((name, documentation, "gauge", startup[key]))
+    return values
+metrics.registry.add_collector(_startup_metrics)
+
+# トップページのHTML
+INDEX_HTML = """
     <!DOCTYPE html>  <!--文書型宣言-->
     <html lang="ja"> <!--主要言語が日本語-->
     <head>
@@ -148,7 +335,7 @@ async def read_root(): #非同期関数を定義　
                 <h2>分析結果</h2>
                 <div id="imagePreviewContainer"> <!--UPした画像と関連するのをまとめて表示-->
                     <h3>アップロードされた画像</h3>
-                    <img id="uploadedImage" src="#" alt="アップロードされた画像">
+                    <img id="uploadedImage" src="#" alt="アップロードされた画像" loading="lazy">
                 </div>
 
                 <div id="extractedColorsContainer"> <!--抽出した色の表示-->
@@ -161,6 +348,11 @@ async def read_root(): #非同期関数を定義　
                     <ul id="classifiedColorsList"></ul>
                 </div>
 
+                <div id="colorDistributionContainer"> <!--全ピクセルの色名の割合の表示-->
+                    <h3>ピクセル単位の色の分布</h3>
+                    <p id="colorDistribution"></p>
+                </div>
+
                 <div id="suggestionsContainer"> <!--色の組み合わせ提案の表示-->
                     <h3>色の組み合わせ提案</h3>
                     <ul class="suggestions" id="suggestionsList"></ul>
@@ -185,6 +377,7 @@ async def read_root(): #非同期関数を定義　
             const colorPalette = document.getElementById('colorPalette');
             const classifiedColorsList = document.getElementById('classifiedColorsList');
             const suggestionsList = document.getElementById('suggestionsList');
+            const colorDistribution = document.getElementById('colorDistribution');
 
             uploadButton.addEventListener('click', async () => { //アップロードボタンがクリックされたときに実行されるもの
                 const file = fileInput.files[0];
@@ -201,12 +394,13 @@ async def read_root(): #非同期関数を定義　
                 colorPalette.innerHTML = '';
                 classifiedColorsList.innerHTML = '';
                 suggestionsList.innerHTML = '';
+                colorDistribution.textContent = '';
 
                 const formData = new FormData(); //ウェブフォームのフィールドと値を表現するためのオブジェクト
                 formData.append('file', file); //データ追加
 
                 try { //エラーしてもアプリケーションがクラッシュするのを防ぐ
-                    const response = await fetch('/uploadfile/', { //サーバーとでーたやり取り
+                    const response = await fetch('/uploadfile/?preview=true', { //サーバーとでーたやり取り（プレビュー画像のURLも受け取る）
                         method: 'POST', //HTTPのリクエストメソッド
                         body: formData, //画像ファイルがサーバーに送信
                     });
@@ -222,12 +416,12 @@ async def read_root(): #非同期関数を定義　
 
                     const data = await response.json(); //成功応答のデータを解析
 
-                    // 画像プレビューの表示 (Base64エンコードされた画像を受け取る場合)
-                    if (data.image_base64) {
-                        uploadedImage.src = `data:${data.content_type};base64,${data.image_base64}`;
+                    // 画像プレビューの表示 (サーバーが作ったサムネイルを別リクエストで遅延読み込みする)
+                    if (data.preview_url) {
+                        uploadedImage.src = data.preview_url;
                         uploadedImage.style.display = 'block';
                     } else {
-                        // もしBase64画像を受け取らない場合、ファイルリーダーでローカルプレビュー
+                        // もしプレビューのURLを受け取らない場合、ファイルリーダーでローカルプレビュー
                         const reader = new FileReader();
                         reader.onload = function(e) {
                             uploadedImage.src = e.target.result;
@@ -261,13 +455,22 @@ async def read_root(): #非同期関数を定義　
                     if (data.classified_colors && data.classified_colors.length > 0) {
                         data.classified_colors.forEach(color => {
                             const li = document.createElement('li');
-                            li.textContent = `${color.name} (RGB: ${color.rgb[0]},${color.rgb[1]},${color.rgb[2]}, ${color.percentage}%)`;
+                            li.textContent = `${color.detailed_name ? `${color.name}（${color.detailed_name}）` : color.name} (RGB: ${color.rgb[0]},${color.rgb[1]},${color.rgb[2]}, ${color.percentage}%)`;
                             classifiedColorsList.appendChild(li);
                         });
                     } else {
                         classifiedColorsList.innerHTML = '<p>分類された色はありませんでした。</p>';
                     }
 
+                    // 色名の分布の表示（例: 赤 62%, 白 30%）
+                    if (data.color_distribution && data.color_distribution.length > 0) {
+                        colorDistribution.textContent = data.color_distribution
+                            .map(item => `${item.name} ${item.percentage}%`)
+                            .join(', ');
+                    } else {
+                        colorDistribution.textContent = '色の分布はありませんでした。';
+                    }
+
                     // 組み合わせ提案の表示
                     if (data.color_suggestions && data.color_suggestions.length > 0) {
                         data.color_suggestions.forEach(suggestion => {
@@ -292,51 +495,555 @@ async def read_root(): #非同期関数を定義　
     </html>
     """
 
+# トップページの内容は変わらないので、起動時にbrotli/gzipの最高レベルで1回だけ圧縮し、強いETagを付けておく
+landing_page = compression.precompress(INDEX_HTML.encode("utf-8"), "text/html; charset=utf-8")
+
+# ルートエンドポイント（HTMLページを表示）
+# 2回目以降の訪問では、ブラウザがETagで確認し、変わっていなければ304（本体なし）で済む
+@app.get("/", response_class=HTMLResponse) #fastapiでwebページを返す時に使う。@app.get("/"):WebサイトのルートURLにGETリクエストが来たときに、この下で定義されている関数を実行
+async def read_root( #非同期関数を定義
+    accept_encoding: str | None = Header(default=None),
+    if_none_match: str | None = Header(default=None),
+):
+    return compression.asset_response(landing_page, accept_encoding, if_none_match)
+
+# /uploadfile/ のレスポンスに含められる項目（?fields= で選べる）
+RESPONSE_FIELDS = (
+    "filename", "content_type", "image_dimensions", "extracted_colors", "classified_colors",
+    "color_distribution", "color_suggestions", "regions", "region_suggestions",
+    "preview_url", "message", "degradation_level", "diagnostics",
+)
+
+def _parse_region_grid(value: str) -> tuple[tuple[str, float], ...]:
+    """REGION_GRID（"top:0.5,bottom:1.0" の形式）を (領域名, 帯の下端の位置) のタプルにする。"""
+    grid = []
+    for item in value.split(","):
+        name, _, edge = item.strip().partition(":")
+        grid.append((name.strip(), float(edge)))
+    edges = [edge for _, edge in grid]
+    if not grid or any(not name for name, _ in grid) or edges != sorted(edges) or not 0 < edges[0] or edges[-1] != 1.0:
+        raise ValueError(f"REGION_GRIDの形式が正しくありません（例: top:0.5,bottom:1.0）: {value}")
+    return tuple(grid)
+
+REGION_GRID = _parse_region_grid(config.REGION_GRID) # 起動時に確認しておく
+if config.REGIONS not in REGION_METHODS:
+    raise ValueError(f"REGIONSには {', '.join(REGION_METHODS)} のいずれかを指定してください: {config.REGIONS}")
+
+def _parse_fields(fields: str | None) -> tuple[str, ...] | None:
+    """?fields=classified_colors,color_suggestions のようなカンマ区切りの指定を、項目名のタプルにする（省略時はNone）。"""
+    if fields is None:
+        return None
+    selected = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip())) # 重複を除き、順番は保つ
+    unknown = [name for name in selected if name not in RESPONSE_FIELDS]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"fieldsには次の項目をカンマ区切りで指定してください: {', '.join(RESPONSE_FIELDS)}")
+    return selected
+
+def _parse_num_colors(num_colors: str | None) -> int | str:
+    """?num_colors= の値（1〜AUTO_MAX_COLORSの整数、または "auto"）を確認する。省略時は設定値を使う。"""
+    value = num_colors if num_colors is not None else config.NUM_COLORS
+    if value == AUTO_NUM_COLORS:
+        return value
+    if value.isdigit() and 1 <= int(value) <= AUTO_MAX_COLORS:
+        return int(value)
+    raise HTTPException(status_code=400, detail=f"num_colorsには1〜{AUTO_MAX_COLORS}の整数、または {AUTO_NUM_COLORS} を指定してください。")
+
+def _pipeline_params(
+    engine: str | None,
+    preview: bool,
+    preview_format: str,
+    fields: tuple[str, ...] | None = None,
+    num_colors: int | str = 3,
+    regions: str | None = None,
+    approximate: bool = False,
+    error_margin: float | None = None,
+    time_budget_ms: int | None = None,
+) -> dict:
+    """
+    リクエストのパラメータから、画像解析パイプラインに渡す引数（キャッシュキーの一部にもなる）を作る。
+    fieldsを指定した場合は、その項目に必要な処理だけを行う（プレビューは preview_url を選んだときだけ作る）。
+    近似モードの引数は、近似モードのときだけ含める（通常の結果のキャッシュキーを変えないため）。
+    """
+    if fields is not None and "preview_url" not in fields:
+        preview = False # サムネイルのエンコードごと省く
+    approximate_params = {}
+    if approximate:
+        approximate_params = {
+            "approximate": True,
+            "error_margin": error_margin or config.APPROX_ERROR_MARGIN,
+            "time_budget": (time_budget_ms or config.APPROX_TIME_BUDGET_MS) / 1000,
+        }
+    return {
+        "num_colors": num_colors, # "auto" の場合は画像ごとに選ぶ
+        "engine": engine or config.COLOR_ENGINE,
+        "segmentation": config.SEGMENTATION,
+        "preview_format": preview_format if preview else None,
+        "preview_max_side": config.PREVIEW_MAX_SIDE,
+        "outputs": PIPELINE_OUTPUTS if fields is None else tuple(name for name in PIPELINE_OUTPUTS if name in fields),
+        "memory_mode": config.PIPELINE_MEMORY_MODE,
+        "regions": regions or config.REGIONS,
+        "region_grid": REGION_GRID,
+        **approximate_params,
+    }
+
+def _select_fields(body: dict, fields: tuple[str, ...] | None) -> dict:
+    """レスポンスを指定された項目だけに絞る（エラーの場合はそのまま返す）。"""
+    if fields is None or "error" in body:
+        return body
+    return {name: body[name] for name in fields}
+
+def _deadline_seconds(deadline_ms: int | None) -> float:
+    """クライアントが指定した期限（ミリ秒）を秒に直す。指定がない場合は設定値を使う。"""
+    return (deadline_ms if deadline_ms and deadline_ms > 0 else config.DEFAULT_DEADLINE_MS) / 1000
+
+async def _analyze_upload(
+    contents: bytes,
+    filename: str | None,
+    content_type: str | None,
+    params: dict,
+    deadline_seconds: float,
+) -> tuple[dict, str]:
+    """
+    1枚の画像を解析し、/uploadfile/ のレスポンスと同じ形の辞書を返す。
+    混み合っている場合や期限が短い場合は、品質を下げて（プレビューなし、作業用画像を小さくなど）処理する。
+
+    Returns:
+        tuple[dict, str]: (レスポンスの辞書, Server-Timingヘッダーの値)
+
+    Raises:
+        ExecutorSaturatedError: ワーカーもキューも埋まっている場合（AdmissionRejectedErrorを含む）。
+        ImageTooLargeError: ヘッダーの画素数が上限を超えている場合（デコードもキューへの投入もしない）。
+    """
+    metrics.UPLOAD_BYTES.inc(len(contents))
+    try:
+        check_image_size(contents, config.MAX_IMAGE_MEGAPIXELS)
+    except ImageTooLargeError:
+        metrics.ERRORS.inc(kind="image_too_large")
+        raise
+
+    # デコードから色の抽出・分類・提案・エンコードまでをワーカーで実行（イベントループをブロックしない）
+    # 同じ画像・同じパラメータの結果がキャッシュにあれば再利用する
+    started = time.perf_counter()
+    # ルールファイルやパレットが更新されたら古い結果をキャッシュから返さないよう、それぞれの版もキーに含める
+    key_params = {**params, "rules_version": rules_version(), "palette_version": palette_version()}
+    cache_key = await asyncio.to_thread(result_cache.make_key, contents, key_params) # 大きな画像のハッシュ計算もループの外で
+    hash_seconds = time.perf_counter() - started
+    computed = False
+
+    async def compute() -> dict:
+        nonlocal computed
+        computed = True
+        # ヘッダーの画像サイズとバイト数から処理コストを見積もり、混み具合と期限から品質の引き下げレベルを決める
+        with admission.admit(estimate_cost(contents), deadline_seconds) as ticket:
+            result = await executor.run(analyze_image, contents, **{**params, **ticket.overrides})
+            ticket.compute_seconds = sum(result["timings"].values())
+        return {**result, "degradation_level": ticket.level}
+
+    try:
+        result = await result_cache.get_or_compute(cache_key, compute)
+    except ExecutorSaturatedError:
+        metrics.ERRORS.inc(kind="saturated")
+        raise
+
+    # このリクエストで実際に計算した場合だけ、段階ごとの処理時間を記録する
+    timings = {"hash": hash_seconds}
+    if computed:
+        timings.update(result["timings"])
+        for stage_name, seconds in result["timings"].items():
+            metrics.STAGE_SECONDS.observe(seconds, stage=stage_name)
+    degradation_level = result.get("degradation_level", 0)
+    server_timing = metrics.server_timing_header(timings, {"cache": "miss" if computed else "hit", "degradation": degradation_level})
+
+    if "error" in result:
+        metrics.ERRORS.inc(kind="decode")
+        return {"error": result["error"]}, server_timing
+
+    dimensions = result["image_dimensions"]
+    metrics.IMAGE_MEGAPIXELS.observe(dimensions["width"] * dimensions["height"] / 1_000_000)
+
+    # サムネイルはキャッシュキー（画像とパラメータのハッシュ）をIDにして保存する
+    preview_url = None
+    if result["preview"] is not None:
+        preview_id = cache_key[:32]
+        preview_store.put(preview_id, result["preview"])
+        preview_url = f"/preview/{preview_id}"
+
+    return {
+        "filename": filename, #Webアプリケーションでファイルをアップロードする
+        "content_type": content_type, #ファイルのMIMEタイプ（Media Type / Content Type）を取得し、それを辞書（またはJSONオブジェクト）のキーと値のペアとして設定している
+        "image_dimensions": result["image_dimensions"], #画像の高さと幅を辞書の形式で構造化
+        "extracted_colors": result["extracted_colors"], #画像から抽出されたメインの色をキーのもとに格納
+        "classified_colors": result["classified_colors"],  #分類された色の情報をclassified_colorsに格納
+        "color_distribution": result["color_distribution"], # 全ピクセルを色名に分類したときの割合
+        "color_suggestions": result["color_suggestions"],
+        "regions": result["regions"], # 領域（トップス・ボトムスなど）ごとの色（?regions= を指定した場合のみ）
+        "region_suggestions": result["region_suggestions"], # 領域どうしの色の組み合わせの提案
+        "preview_url": preview_url, # プレビュー画像のURL（?preview=trueの場合のみ）
+        "message": "画像が正常にアップロードされ、主要な色が抽出・分類され、色の組み合わせが提案されました！",
+        "degradation_level": degradation_level, # 混雑のため品質を下げた度合い（0: 通常, 1: プレビューなし, 2: 作業用画像を縮小, 3: 最小限の処理）
+        "diagnostics": result["diagnostics"], # デコード方式などの処理の詳細
+    }, server_timing
+
+def _saturated_error(e: ExecutorSaturatedError) -> HTTPException:
+    """混雑で受け付けられなかった場合の503。最も軽い処理でも間に合わない場合の最後の手段。"""
+    # 実行中の処理がはけるまでの目安の秒数をRetry-Afterで返す
+    retry_after = getattr(e, "retry_after", 1)
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(retry_after)})
+
 # 画像アップロードのエンドポイント
 @app.post("/uploadfile/") #ここで定義
-async def create_upload_file(file: UploadFile = File(...)):
+async def create_upload_file(
+    file: UploadFile = File(...),
+    engine: Literal["kmeans", "histogram"] | None = None, # 色抽出エンジン（省略時は設定値）
+    preview: bool = False, # trueの場合はプレビュー画像（サムネイル）を作り、preview_urlを返す
+    preview_format: Literal["jpeg", "webp"] = "jpeg", # プレビュー画像の形式
+    deadline_ms: int | None = None, # この時間（ミリ秒）以内に結果がほしい。X-Deadline-Msヘッダーでも指定できる
+    fields: str | None = None, # 返す項目をカンマ区切りで指定（例: classified_colors,color_suggestions）。指定しない項目は計算もしない
+    num_colors: str | None = None, # 抽出する色の数（1〜8、または画像ごとに選ぶ auto）。省略時は設定値
+    regions: Literal["none", "grid", "components"] | None = None, # 領域（トップス・ボトムスなど）ごとの色の分け方。省略時は設定値
+    approximate: bool = False, # trueの場合はピクセルの一部だけで色を求め、割合の誤差（percentage_error）も返す
+    error_margin: float | None = Query(default=None, gt=0, le=50), # 近似モードで目標にする割合の誤差（±パーセントポイント）
+    time_budget_ms: int | None = Query(default=None, ge=1, le=10000), # 近似モードで色の抽出にかけてよい時間
+    x_deadline_ms: int | None = Header(default=None),
+    accept: str | None = Header(default=None), # application/msgpack を指定するとMessagePackで返す
+):
+    selected_fields = _parse_fields(fields)
+    selected_num_colors = _parse_num_colors(num_colors)
     # アップロードされたファイルをメモリに読み込む
+    started = time.perf_counter()
     contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    # OpenCVで画像としてデコード
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-    if img is None:
-        return {"error": "画像の読み込みに失敗しました。有効な画像ファイルをアップロードしてください。"}
-
-   
-    clothing_area_img = identify_clothing_area(img) # 服の領域を識別
-
-   
-    # 少なめに設定(改良予定)
-    dominant_colors_data = extract_dominant_colors(clothing_area_img, num_colors=3) # 識別された領域からメインの色を抽出
-    classified_colors_data = classify_extracted_colors(dominant_colors_data) #抽出された色を色名に分類
-    color_suggestions = suggest_color_combinations(classified_colors_data) #分類された色に合わせて提案
-   
-
-    #　抽出された色を辞書のリスト変換、APIレスポンスに含める
-    # classified_colors_data は既に辞書のリストなので変換不要
-    extracted_colors_for_response = [
-        {"rgb": color.rgb, "percentage": color.percentage}
-        for color in dominant_colors_data
-    ]   
-
-    # --- アップロード画像をBase64エンコードして返す (UI側でプレビューするため) ---
-    # 画像をPNG形式でエンコード
-    is_success, buffer = cv2.imencode(".png", img)
-    if not is_success:
-        return {"error": "画像のエンコードに失敗しました。"}
-    # Base64文字列に変換
-    img_base64 = base64.b64encode(buffer).decode('utf-8')
-
-    height, width, _ = img.shape #画像の高さ、幅、そして（もしあれば）チャンネル数を取得
+    read_seconds = time.perf_counter() - started
+    metrics.STAGE_SECONDS.observe(read_seconds, stage="read")
+
+    params = _pipeline_params(
+        engine, preview, preview_format, selected_fields, selected_num_colors, regions, approximate, error_margin, time_budget_ms,
+    )
+    try:
+        deadline_seconds = _deadline_seconds(deadline_ms or x_deadline_ms)
+        body, server_timing = await _analyze_upload(contents, file.filename, file.content_type, params, deadline_seconds)
+    except ExecutorSaturatedError as e:
+        raise _saturated_error(e)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    # 段階ごとの処理時間をServer-Timingヘッダーで返す（ブラウザの開発者ツールや負荷試験ツールで確認できる）
+    # FastAPIの汎用のエンコード（jsonable_encoder）を通さず、orjson（またはMessagePack）で直接バイト列にする
+    return serialization.render(
+        _select_fields(body, selected_fields),
+        accept,
+        headers={"Server-Timing": f"read;dur={read_seconds * 1000:.2f}, {server_timing}"},
+    )
+
+# 非同期ジョブ
+# 大きな画像や時間のかかる設定の解析は、POST /jobs でアップロードしてすぐにジョブIDを受け取り、
+# GET /jobs/{id} で状態と結果（/uploadfile/ と同じ形）を取りに来てもらう。
+async def _run_job(job: Job, contents: bytes) -> dict:
+    """
+    ジョブ1件を解析する（JobManagerのワーカーから呼ばれる）。
+    混雑で受け付けられない場合は失敗にせず、Retry-Afterの秒数だけ待ってからやり直す。
+    """
+    deadline_seconds = config.JOB_DEADLINE_MS / 1000
+    while True:
+        job.attempts += 1
+        try:
+            body, _ = await _analyze_upload(contents, job.filename, job.content_type, job.params, deadline_seconds)
+            break
+        except ExecutorSaturatedError as e:
+            if time.time() - job.created_at > deadline_seconds:
+                raise JobFailedError("サーバーが混み合っていたため、期限内に処理できませんでした。", status_code=503)
+            await asyncio.sleep(getattr(e, "retry_after", 1))
+        except ImageTooLargeError as e:
+            raise JobFailedError(str(e), status_code=413)
+    if "error" in body:
+        raise JobFailedError(body["error"], status_code=400)
+    return _select_fields(body, job.fields)
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    engine: Literal["kmeans", "histogram"] | None = None, # 以下のパラメータは /uploadfile/ と同じ
+    preview: bool = False,
+    preview_format: Literal["jpeg", "webp"] = "jpeg",
+    fields: str | None = None,
+    num_colors: str | None = None,
+    regions: Literal["none", "grid", "components"] | None = None,
+    approximate: bool = False,
+    error_margin: float | None = Query(default=None, gt=0, le=50),
+    time_budget_ms: int | None = Query(default=None, ge=1, le=10000),
+    accept: str | None = Header(default=None),
+):
+    selected_fields = _parse_fields(fields)
+    params = _pipeline_params(
+        engine, preview, preview_format, selected_fields, _parse_num_colors(num_colors), regions, approximate, error_margin, time_budget_ms,
+    )
+    try:
+        # 本体はメモリに読み込まず、一時ファイルのままジョブの保存先にコピーする
+        job = await job_manager.submit(file.file, file.filename, file.content_type, params, selected_fields)
+    except JobQueueFullError as e:
+        metrics.ERRORS.inc(kind="jobs_full")
+        # 待っているジョブがはけるまでの目安（1件あたりコスト1として見積もる）
+        retry_after = max(1, round(job_manager.pending / job_manager.workers * admission.seconds_per_cost))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(retry_after)})
+    status_url = f"/jobs/{job.id}"
+    return serialization.render(
+        {"id": job.id, "status": job.status, "status_url": status_url},
+        accept,
+        status_code=202,
+        headers={"Location": status_url},
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, accept: str | None = Header(default=None)):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません。保持期間を過ぎて削除された可能性があります。")
+    return serialization.render(job_manager.to_dict(job), accept)
+
+def _extract_zip(contents: bytes) -> list[tuple[str, str | None, bytes]]:
+    """
+    zipアーカイブ内のファイルを (ファイル名, MIMEタイプ, 中身) のリストとして取り出す。
+    アップロードの上限は圧縮後のバイト数しか数えないので、展開後の大きさもここで制限する（zip爆弾対策）。
+
+    Raises:
+        HTTPException: ファイル数・1ファイルの展開後の大きさ・展開後の合計が上限を超えている場合（413）。
+    """
+    items = []
+    total_bytes = 0
+    with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+        for info in archive.infolist():
+            # ディレクトリやmacOSが作る管理用ファイルは飛ばす
+            if info.is_dir() or info.filename.startswith("__MACOSX/") or os.path.basename(info.filename).startswith("."):
+                continue
+            if len(items) >= config.BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"一度に処理できる画像は{config.BATCH_MAX_FILES}枚までです。")
+            # file_size はヘッダーに書かれた展開後の大きさ。ZipFile.read はそれより多くは返さない
+            if config.MAX_UPLOAD_BYTES > 0 and info.file_size > config.MAX_UPLOAD_BYTES:
+                metrics.ERRORS.inc(kind="upload_too_large")
+                raise HTTPException(status_code=413, detail=f"zip内のファイルが大きすぎます: {info.filename}")
+            total_bytes += info.file_size
+            if config.BATCH_MAX_UPLOAD_BYTES > 0 and total_bytes > config.BATCH_MAX_UPLOAD_BYTES:
+                metrics.ERRORS.inc(kind="upload_too_large")
+                raise HTTPException(status_code=413, detail="zipアーカイブの展開後の合計が大きすぎます。")
+            items.append((info.filename, mimetypes.guess_type(info.filename)[0], archive.read(info)))
+    return items
+
+# 複数画像をまとめて処理するエンドポイント
+# 複数ファイル（multipart）またはzipアーカイブを受け取り、処理が終わった画像から順に
+# 1行1件のJSON（NDJSON）で返す。一番遅い画像を待たずに結果を受け取れる。
+@app.post("/uploadfiles/")
+async def create_upload_files(
+    files: list[UploadFile] = File(...),
+    engine: Literal["kmeans", "histogram"] | None = None,
+    preview: bool = False,
+    preview_format: Literal["jpeg", "webp"] = "jpeg",
+    deadline_ms: int | None = None, # 1枚ごとの期限（ミリ秒）
+    fields: str | None = None, # 1件ごとに返す項目（/uploadfile/ と同じ）
+    num_colors: str | None = None, # 抽出する色の数（/uploadfile/ と同じ）
+    regions: Literal["none", "grid", "components"] | None = None, # 領域ごとの色の分け方（/uploadfile/ と同じ）
+    approximate: bool = False, # 近似モード（/uploadfile/ と同じ）
+    error_margin: float | None = Query(default=None, gt=0, le=50),
+    time_budget_ms: int | None = Query(default=None, ge=1, le=10000),
+    x_deadline_ms: int | None = Header(default=None),
+):
+    selected_fields = _parse_fields(fields)
+    selected_num_colors = _parse_num_colors(num_colors)
+    items = [] # (ファイル名, MIMEタイプ, 中身)
+    for file in files:
+        contents = await file.read()
+        if file.content_type in ("application/zip", "application/x-zip-compressed") or zipfile.is_zipfile(io.BytesIO(contents)):
+            try:
+                items.extend(await asyncio.to_thread(_extract_zip, contents)) # 展開もループの外で
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"zipアーカイブを展開できませんでした: {file.filename}")
+        else:
+            items.append((file.filename, file.content_type, contents))
+        if len(items) > config.BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"一度に処理できる画像は{config.BATCH_MAX_FILES}枚までです。")
+
+    # パラメータはバッチ全体で共通。ワーカーの数だけ同時に処理し、他のリクエストの分の空きも残す
+    params = _pipeline_params(
+        engine, preview, preview_format, selected_fields, selected_num_colors, regions, approximate, error_margin, time_budget_ms,
+    )
+    deadline_seconds = _deadline_seconds(deadline_ms or x_deadline_ms)
+    semaphore = asyncio.Semaphore(executor.max_workers)
+
+    async def process(index: int, filename: str | None, content_type: str | None, contents: bytes) -> dict:
+        async with semaphore:
+            try:
+                result, _ = await _analyze_upload(contents, filename, content_type, params, deadline_seconds)
+                result = _select_fields(result, selected_fields)
+            except (ExecutorSaturatedError, ImageTooLargeError) as e:
+                result = {"error": str(e)}
+        if "error" in result:
+            result = {"filename": filename, **result}
+        return {"index": index, **result}
+
+    async def stream_results():
+        tasks = [asyncio.create_task(process(i, *item)) for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield serialization.dumps_json(await next_done) + b"\n"
+        finally:
+            # クライアントが途中で切断した場合は残りの処理を取り消す
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# カメラ映像のストリーミング解析
+# クライアントは縮小したフレーム（JPEG/PNG/WebP）をバイナリメッセージで送り続け、
+# サーバーは解析が終わるたびに最新の色をJSONで返す。
+# 解析が追いつかない場合は古いフレームを捨て、常に最新のフレームだけを解析する。
+@app.websocket("/ws/stream")
+async def stream_colors(websocket: WebSocket, num_colors: int = 3):
+    global active_streams
+    await websocket.accept()
+    if active_streams >= config.STREAM_MAX_CONNECTIONS or not 1 <= num_colors <= 8:
+        await websocket.close(code=1013 if active_streams >= config.STREAM_MAX_CONNECTIONS else 1008)
+        return
+    active_streams += 1
+
+    session = StreamSession(num_colors=num_colors)
+    latest = {"frame": None, "number": 0} # 最新のフレームを1枚だけ置いておく場所
+    frame_ready = asyncio.Event()
+    stats = {"dropped": 0}
+
+    async def receive_frames():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is None: # テキストメッセージは無視する
+                continue
+            if latest["frame"] is not None: # 前のフレームがまだ解析されていなければ捨てる
+                stats["dropped"] += 1
+                metrics.STREAM_FRAMES.inc(result="dropped")
+            latest["frame"] = message["bytes"]
+            latest["number"] += 1
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            # フレームが届くか、受信側が終了（切断）するまで待つ
+            waiter = asyncio.create_task(frame_ready.wait())
+            await asyncio.wait({waiter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                waiter.cancel()
+                break
+            frame_ready.clear()
+            contents, number = latest["frame"], latest["number"]
+            latest["frame"] = None
+
+            # 接続ごとの学習状態を使うのでワーカープロセスには送らず、スレッドで実行する（OpenCVとNumPyはGILを解放する）
+            # /uploadfile/ と同じく、デコードする前に画素数の上限を確認する
+            try:
+                check_image_size(contents, config.MAX_IMAGE_MEGAPIXELS)
+                result = await asyncio.to_thread(session.process_frame, contents)
+            except ValueError as e: # ImageTooLargeErrorを含む。1枚のフレームの失敗でストリームを終わらせない
+                metrics.STREAM_FRAMES.inc(result="error")
+                await websocket.send_json({"frame": number, "error": str(e)})
+                continue
+            if result is None:
+                metrics.STREAM_FRAMES.inc(result="skipped")
+                continue
+            metrics.STREAM_FRAMES.inc(result="processed")
+            for stage_name, seconds in result.pop("timings", {}).items():
+                metrics.STAGE_SECONDS.observe(seconds, stage=f"stream_{stage_name}")
+            await websocket.send_json({
+                "frame": number,
+                **result,
+                "frames_processed": session.frames_processed,
+                "frames_skipped": session.frames_skipped,
+                "frames_dropped": stats["dropped"],
+            })
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        active_streams -= 1
+
+async def _analyze_for_search(file: UploadFile) -> dict:
+    """検索用に画像を解析する（/uploadfile/ と同じ処理・同じキャッシュを使う）。"""
+    contents = await file.read()
+    params = _pipeline_params(None, False, "jpeg", fields=("extracted_colors",)) # 検索には抽出された色だけを使う
+    try:
+        body, _ = await _analyze_upload(contents, file.filename, file.content_type, params, _deadline_seconds(None))
+    except ExecutorSaturatedError as e:
+        raise _saturated_error(e)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if "error" in body:
+        raise HTTPException(status_code=400, detail=body["error"])
+    return body
+
+# 商品画像を色の検索インデックスに追加する
+@app.post("/search/items")
+async def add_search_item(
+    file: UploadFile = File(...),
+    item_id: str | None = Form(default=None), # 商品ID（省略時はファイル名）
+):
+    item_id = item_id or file.filename
+    if not item_id:
+        raise HTTPException(status_code=422, detail="item_id を指定してください（ファイル名もありません）。")
+    body = await _analyze_for_search(file)
+    try:
+        index_size = await asyncio.to_thread(palette_index.add, item_id, body["extracted_colors"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"item_id": item_id, "extracted_colors": body["extracted_colors"], "index_size": index_size}
+
+# アップロードした画像と色の組み合わせが近い商品を探す
+@app.post("/search/similar")
+async def search_similar(
+    response: Response,
+    file: UploadFile = File(...),
+    top_n: int = Query(default=10, ge=1, le=100), # 返す件数
+):
+    body = await _analyze_for_search(file)
+    started = time.perf_counter()
+    results = await asyncio.to_thread(palette_index.search, body["extracted_colors"], top_n)
+    search_seconds = time.perf_counter() - started
+    metrics.STAGE_SECONDS.observe(search_seconds, stage="palette_search")
+    response.headers["Server-Timing"] = f"palette_search;dur={search_seconds * 1000:.2f}"
     return {
-        "filename": file.filename, #Webアプリケーションでファイルをアップロードする
-        "content_type": file.content_type, #ファイルのMIMEタイプ（Media Type / Content Type）を取得し、それを辞書（またはJSONオブジェクト）のキーと値のペアとして設定している
-        "image_dimensions": {"width": width, "height": height}, #画像の高さと幅を辞書の形式で構造化
-        "extracted_colors": extracted_colors_for_response, #画像から抽出されたメインの色をキーのもとに格納
-        "classified_colors": classified_colors_data,  #分類された色の情報をclassified_colorsに格納
-        "color_suggestions": color_suggestions,
-        "image_base64": img_base64, # Base64エンコードされた画像データを追加
-        "message": "画像が正常にアップロードされ、主要な色が抽出・分類され、色の組み合わせが提案されました！"
-    }
\ No newline at end of file
+        "query_colors": body["extracted_colors"],
+        "results": results, # 近い順。distanceは色の分布を表すベクトルの距離（0〜約1.4、小さいほど似ている）
+    }
+
+# プレビュー画像（サムネイル）の配信
+# 内容が変わらないのでETagを付け、ブラウザが同じ画像を再取得するときは304を返す
+@app.get("/preview/{preview_id}")
+async def get_preview(preview_id: str, if_none_match: str | None = Header(default=None)):
+    preview = preview_store.get(preview_id)
+    if preview is None:
+        raise HTTPException(status_code=404, detail="プレビュー画像が見つかりません。もう一度アップロードしてください。")
+    headers = {"ETag": preview["etag"], "Cache-Control": "private, max-age=86400"}
+    if if_none_match is not None and preview["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=preview["data"], media_type=preview["media_type"], headers=headers)
+
+# 生存確認（プロセスが応答できるか）。ウォームアップ中も200を返す
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+# 準備完了の確認。ウォームアップが終わるまでと、受け付けの上限に達している間は503を返し、
+# オーケストレーター（Kubernetesのreadiness probeなど）がこのサーバーにトラフィックを送らないようにする
+@app.get("/readyz")
+async def readyz():
+    if not startup["ready"]:
+        return JSONResponse({"status": "warming_up"}, status_code=503)
+    if admission.stats()["inflight_requests"] >= admission.max_requests:
+        return JSONResponse({"status": "saturated"}, status_code=503)
+    return {"status": "ready", "warmup_seconds": round(startup["warmup_seconds"], 3)}
+
+# キャッシュのヒット・ミスの統計
+@app.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
+
+# Prometheus形式のメトリクス（段階ごとの処理時間、送受信バイト数、画像サイズ、エラー数など）
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
\ No newline at end of file
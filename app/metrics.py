@@ -0,0 +1,286 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# 処理時間の計測とPrometheus形式のメトリクス
+# - stage() で囲んだ処理の時間を、collect_timings() の中で段階ごとに記録する
+#   （ワーカープロセスでは記録した辞書を結果と一緒にメインプロセスへ返す）
+# - Histogram / Counter はメインプロセスで集計し、/metrics でPrometheusのテキスト形式で出力する
+
+_current_timings: contextvars.ContextVar[dict | None] = contextvars.ContextVar("current_timings", default=None)
+
+@contextmanager
+def collect_timings():
+    """
+    この中で実行された stage() の処理時間（秒）を段階名ごとに集める。
+
+    Yields:
+        dict: 段階名 -> 処理時間（秒）。同じ段階が複数回あれば合計する。
+    """
+    timings = {}
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+@contextmanager
+def stage(name: str):
+    """処理時間を計測する段階を囲む。collect_timings() の外では何もしない。"""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+def server_timing_header(timings: dict, extra: dict | None = None) -> str:
+    """
+    処理時間の辞書から Server-Timing ヘッダーの値を作る（ブラウザの開発者ツールで表示できる）。
+
+    Args:
+        timings (dict): 段階名 -> 処理時間（秒）。
+        extra (dict | None): 時間以外の情報（例: {"cache": "hit"}）。descとして出力する。
+    """
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    for name, description in (extra or {}).items():
+        entries.append(f'{name};desc="{description}"')
+    return ", ".join(entries)
+
+def process_uptime() -> float | None:
+    """プロセスが起動してからの秒数（Pythonの起動やimportの時間も含む）。Linuxの/procから読めない場合はNone。"""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split() # プロセス名に空白が入っていてもずれないよう ")" の後から数える
+        with open("/proc/uptime") as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK") # 22番目の項目が起動時刻（OS起動からのクロック数）
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _read_memory_status(key: str) -> int | None:
+    """/proc/self/status のメモリの項目（VmRSS, VmHWMなど）をバイト数で返す。読めない場合はNone。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) * 1024 # 単位はkB
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+@contextmanager
+def track_peak_memory():
+    """
+    この中の処理で、プロセスのメモリ使用量（RSS）の最大値がどこまで増えたかを測る。
+    Linuxの /proc/self/clear_refs で最大値（VmHWM）をリセットしてから始めるので、
+    OpenCVの内部で確保したメモリも含めて測れる（tracemallocより大幅に軽い）。
+    プロセスプールでは1つのワーカーが1件ずつ処理するのでリクエストごとの値になるが、
+    スレッドプールでは同時に実行中のほかのリクエストの分も含まれる。
+
+    Yields:
+        dict: 終了後に {"peak_rss_bytes": 最大のRSS, "peak_increase_bytes": 開始時からの増加分} が入る。
+              /procを使えない環境では空のまま。
+    """
+    memory = {}
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5") # VmHWMを現在のRSSにリセットする
+        start_rss = _read_memory_status("VmRSS")
+    except OSError:
+        start_rss = None
+    try:
+        yield memory
+    finally:
+        peak_rss = _read_memory_status("VmHWM") if start_rss is not None else None
+        if peak_rss is not None:
+            memory["peak_rss_bytes"] = peak_rss
+            memory["peak_increase_bytes"] = max(0, peak_rss - start_rss)
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """単調に増える値（リクエスト数、バイト数など）。"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """値の分布（処理時間、画像サイズなど）をバケットごとの件数で集計する。"""
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {} # ラベル -> [各バケットの件数..., 合計値, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """メトリクスをまとめて保持し、Prometheusのテキスト形式で出力する。"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = [] # 出力のたびに値を読み取る関数（キャッシュの統計など）
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector) -> None:
+        """
+        出力時に呼ばれる関数を登録する。関数は (名前, 説明, 種類, 値) のタプルのリストを返す。
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, documentation, kind, value in collector():
+                lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {_format_value(value)}"])
+        return "\n".join(lines) + "\n"
+
+
+# アプリケーション全体で使うメトリクス
+registry = Registry()
+STAGE_SECONDS = registry.histogram(
+    "fashion_pipeline_stage_seconds", "画像解析パイプラインの段階ごとの処理時間（秒）", ("stage",)
+)
+IMAGE_MEGAPIXELS = registry.histogram(
+    "fashion_image_megapixels", "アップロードされた画像の画素数（メガピクセル）",
+    buckets=(0.1, 0.3, 1, 2, 4, 8, 12, 16, 24, 32, 48, 64),
+)
+UPLOAD_BYTES = registry.counter("fashion_upload_bytes_total", "アップロードされた画像の合計バイト数")
+ERRORS = registry.counter("fashion_errors_total", "種類ごとのエラー数", ("kind",))
+STREAM_FRAMES = registry.counter(
+    "fashion_stream_frames_total", "WebSocketで受け取ったフレーム数（processed: 解析, skipped: 変化なし, dropped: 古くなって破棄, error: 処理できないフレーム）", ("result",)
+)
+HTTP_REQUESTS = registry.counter("fashion_http_requests_total", "HTTPリクエスト数", ("method", "path", "status"))
+HTTP_DURATION = registry.histogram(
+    "fashion_http_request_duration_seconds", "HTTPリクエストの処理時間（秒）", ("method", "path")
+)
+HTTP_BYTES_IN = registry.counter("fashion_http_request_bytes_total", "受信したリクエストボディの合計バイト数")
+HTTP_BYTES_OUT = registry.counter("fashion_http_response_bytes_total", "送信したレスポンスボディの合計バイト数")
+
+
+class MetricsMiddleware:
+    """
+    すべてのHTTPリクエストの件数・処理時間・送受信バイト数を記録するASGIミドルウェア。
+    パスのラベルにはルートのテンプレート（例: /preview/{preview_id}）を使い、種類が増えすぎないようにする。
+    """
+
+    def __init__(self, app, on_request=None):
+        """
+        Args:
+            app: 次に呼び出すASGIアプリ。
+            on_request: リクエストが終わるたびにパスのテンプレートを引数に呼ばれる関数（最初のリクエストの記録など）。
+        """
+        self.app = app
+        self.on_request = on_request
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                HTTP_BYTES_IN.inc(len(message.get("body", b"")))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                HTTP_BYTES_OUT.inc(len(message.get("body", b"")))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], path=path, status=str(status["code"]))
+            HTTP_DURATION.observe(time.perf_counter() - started, method=scope["method"], path=path)
+            if self.on_request is not None:
+                self.on_request(path)
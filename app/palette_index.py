@@ -0,0 +1,219 @@
+import fcntl
+import os
+import threading
+import cv2
+import numpy as np
+
+
+# 色の組み合わせが似ている商品を探すための検索インデックス
+# 画像から抽出した色（RGBの中心と割合）を、人の見た目の差に近いCIELAB空間のベクトルに変換して保存する。
+# ベクトルはLab空間に格子状に置いた基準色ごとに「近くにある色の割合」を足し合わせたもの（ぼかしたヒストグラム）で、
+# 色の並び順によらず、割合や色が少し変わればベクトルも少しだけ変わる。
+# - embedding.f32: ベクトルを1行ずつ追記したfloat32の配列（メモリマップで開くので、複数のワーカーでコピーせずに共有できる）
+# - items.bin  : 同じ行番号の商品ID・色・割合（固定長のレコード）
+# 検索は全件との距離を行列とベクトルの積でまとめて計算する（KD木と違って追記のたびに作り直す必要がない）。
+# 48次元ではKD木の枝刈りがほとんど効かないため、全件との比較でも大きくは遅くならない。
+# 100万件で1回あたり数十ミリ秒（`python -m benchmarks --profile full --only search` で計測できる）。
+
+INDEX_SLOTS = 3 # 1件あたりに保存する色の数（割合が高い順）
+# 基準色のLab値（L*は3段階、a*, b*は4段階の格子）。ベクトルの次元数は基準色の数
+ANCHOR_LAB = np.array(
+    [(l, a, b) for l in (20, 50, 80) for a in (-60, -20, 20, 60) for b in (-60, -20, 20, 60)],
+    np.float32,
+)
+ANCHOR_SIGMA = 25.0 # 基準色からどのくらい離れた色まで数えるか（Lab空間の距離。格子の間隔と同じ程度）
+VECTOR_DIM = len(ANCHOR_LAB)
+ITEM_ID_BYTES = 128 # 商品IDの最大バイト数（UTF-8）
+ITEM_DTYPE = np.dtype([
+    ("item_id", f"S{ITEM_ID_BYTES}"),
+    ("rgb", np.uint8, (INDEX_SLOTS, 3)),
+    ("percentage", np.float32, (INDEX_SLOTS,)),
+])
+SEARCH_CHUNK_ROWS = 1 << 18 # 一度に距離を計算する行数（一時配列のメモリを抑えるため）
+
+def palette_vector(colors: list[dict]) -> np.ndarray:
+    """
+    抽出された色のリストを検索用のベクトルに変換する。
+    割合が高い順に INDEX_SLOTS 色を取り、基準色ごとに「各色の割合 × 基準色との近さ（ガウス関数）」を足し合わせる。
+    色の順番には依存しないので、割合がほぼ同じ2色の順位が入れ替わってもベクトルはほとんど変わらない。
+
+    Args:
+        colors (list[dict]): {"rgb": (R, G, B), "percentage": 割合} のリスト。
+
+    Returns:
+        np.ndarray | None: 長さ VECTOR_DIM のfloat32配列。割合が0より大きい色がない場合はNone。
+    """
+    top = [c for c in sorted(colors, key=lambda c: c["percentage"], reverse=True)[:INDEX_SLOTS] if c["percentage"] > 0]
+    if not top:
+        return None
+    rgb = np.array([[c["rgb"] for c in top]], np.float32) / 255 # (1, 色の数, 3)
+    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2Lab)[0] # float32の入力ならL*は0-100, a*, b*は約-128〜127
+    weights = np.array([c["percentage"] for c in top], np.float32)
+    weights /= weights.sum()
+    squared = ((lab[:, None, :] - ANCHOR_LAB[None, :, :]) ** 2).sum(axis=2) # (色の数, 基準色の数)
+    return (weights @ np.exp(-squared / (2 * ANCHOR_SIGMA ** 2))).astype(np.float32)
+
+
+class PaletteIndex:
+    """
+    色の検索インデックス。追記はファイルロックで排他するので、複数のプロセスから同時に追加できる。
+    検索のたびにファイルの大きさを確認し、ほかのプロセスが追加した分も読み込む。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "embedding.f32")
+        self.items_path = os.path.join(directory, "items.bin")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self._vectors = np.zeros((0, VECTOR_DIM), np.float32)
+        self._items = np.zeros(0, ITEM_DTYPE)
+        self._norms = np.zeros(0, np.float32) # 各ベクトルの長さの2乗（読み込んだ行の分だけ計算して持っておく）
+        self._lock = threading.Lock() # 同じプロセス内のスレッド間の排他
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._vectors)
+
+    def _refresh(self) -> None:
+        """ファイルが伸びていたらメモリマップを開き直す。"""
+        try:
+            vector_rows = os.path.getsize(self.vectors_path) // (VECTOR_DIM * 4)
+            item_rows = os.path.getsize(self.items_path) // ITEM_DTYPE.itemsize
+        except FileNotFoundError:
+            return
+        # ベクトルは商品情報の後に書くので、両方そろった行だけを検索対象にする
+        rows = min(vector_rows, item_rows)
+        if rows == len(self._vectors) or rows == 0:
+            return
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, VECTOR_DIM))
+        self._items = np.memmap(self.items_path, dtype=ITEM_DTYPE, mode="r", shape=(rows,))
+        known = len(self._norms) if rows >= len(self._norms) else 0 # ファイルが作り直された場合は最初から計算する
+        self._norms = self._norms[:known]
+        new_vectors = np.asarray(self._vectors[known:])
+        self._norms = np.concatenate([self._norms, np.einsum("ij,ij->i", new_vectors, new_vectors)])
+
+    def add(self, item_id: str, colors: list[dict]) -> int:
+        """
+        商品の色をインデックスに追加する。
+
+        Args:
+            item_id (str): 商品ID（UTF-8で ITEM_ID_BYTES バイトまで）。
+            colors (list[dict]): extract_dominant_colorsの結果（{"rgb", "percentage"} のリスト）。
+
+        Returns:
+            int: 追加後の件数。
+
+        Raises:
+            ValueError: 商品IDが長すぎる、空、または文字列でない場合や、色が1つもない場合。
+        """
+        return self.add_many([(item_id, colors)])
+
+    def add_many(self, entries: list[tuple[str, list[dict]]]) -> int:
+        """
+        複数の商品の色をまとめて追加する（ファイルへの書き込みは1回ずつ）。
+
+        Args:
+            entries (list[tuple[str, list[dict]]]): (商品ID, 抽出された色) のリスト。
+
+        Returns:
+            int: 追加後の件数。
+
+        Raises:
+            ValueError: 商品IDが長すぎる、空、または文字列でない場合や、色が1つもない場合（1件も追加しない）。
+        """
+        items = np.zeros(len(entries), ITEM_DTYPE)
+        vectors = np.zeros((len(entries), VECTOR_DIM), np.float32)
+        for row, (item_id, colors) in enumerate(entries):
+            if not isinstance(item_id, str):
+                raise ValueError("商品IDを指定してください。")
+            encoded_id = item_id.encode("utf-8")
+            if not encoded_id or len(encoded_id) > ITEM_ID_BYTES:
+                raise ValueError(f"商品IDは1〜{ITEM_ID_BYTES}バイトで指定してください: {item_id[:40]}")
+            vector = palette_vector(colors)
+            if vector is None:
+                # 色のない商品は、どの検索にも同じように近く見えてしまうので追加しない
+                raise ValueError(f"色が抽出されなかったため追加できません: {item_id[:40]}")
+            top = sorted(colors, key=lambda c: c["percentage"], reverse=True)[:INDEX_SLOTS]
+            items[row]["item_id"] = encoded_id
+            for slot, color in enumerate(top):
+                items[row]["rgb"][slot] = color["rgb"]
+                items[row]["percentage"][slot] = color["percentage"]
+            vectors[row] = vector
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # ほかのプロセスの追記と混ざらないように
+            try:
+                # 途中で中断されて行の長さが半端になっていたら、そろった行数まで切り詰めてから追記する
+                rows = self._complete_rows()
+                with open(self.items_path, "ab") as f:
+                    f.truncate(rows * ITEM_DTYPE.itemsize)
+                    f.write(items.tobytes())
+                with open(self.vectors_path, "ab") as f:
+                    f.truncate(rows * VECTOR_DIM * 4)
+                    f.write(vectors.tobytes())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return rows + len(entries)
+
+    def _complete_rows(self) -> int:
+        sizes = []
+        for path, row_bytes in ((self.items_path, ITEM_DTYPE.itemsize), (self.vectors_path, VECTOR_DIM * 4)):
+            sizes.append(os.path.getsize(path) // row_bytes if os.path.exists(path) else 0)
+        return min(sizes)
+
+    def search(self, colors: list[dict], top_n: int = 10) -> list[dict]:
+        """
+        色の組み合わせが近い商品を探す。
+
+        Args:
+            colors (list[dict]): 検索する画像の抽出された色。
+            top_n (int): 返す件数。
+
+        Returns:
+            list[dict]: {"item_id", "distance", "extracted_colors"} のリスト（近い順）。
+                        同じ商品IDが複数回追加されている場合は、最も近いものだけを返す。
+        """
+        query = palette_vector(colors)
+        with self._lock:
+            self._refresh()
+            vectors, items, norms = self._vectors, self._items, self._norms
+        if query is None or len(vectors) == 0 or top_n <= 0:
+            return []
+
+        # 同じIDの重複を除いても top_n 件残るよう、多めに候補を取る
+        candidates = min(len(vectors), top_n * 2)
+        best_rows = np.empty(0, np.int64)
+        best_distances = np.empty(0, np.float32)
+        for start in range(0, len(vectors), SEARCH_CHUNK_ROWS):
+            # |x - q|^2 = |x|^2 - 2 x・q + |q|^2。|q|^2 は順位に影響しないので最後に足す
+            chunk = vectors[start:start + SEARCH_CHUNK_ROWS]
+            distances = norms[start:start + len(chunk)] - 2 * (chunk @ query)
+            k = min(candidates, len(distances))
+            part = np.argpartition(distances, k - 1)[:k]
+            best_rows = np.concatenate([best_rows, part + start])
+            best_distances = np.concatenate([best_distances, distances[part]])
+            if len(best_rows) > candidates: # チャンクごとの候補と合わせて上位だけを残す
+                keep = np.argpartition(best_distances, candidates - 1)[:candidates]
+                best_rows, best_distances = best_rows[keep], best_distances[keep]
+
+        results = []
+        seen = set()
+        for i in np.argsort(best_distances, kind="stable"):
+            item = items[best_rows[i]]
+            item_id = item["item_id"].decode("utf-8", errors="replace")
+            if item_id in seen:
+                continue
+            seen.add(item_id)
+            results.append({
+                "item_id": item_id,
+                "distance": round(float(np.sqrt(max(0.0, best_distances[i] + query @ query))), 4),
+                "extracted_colors": [
+                    {"rgb": tuple(int(v) for v in rgb), "percentage": round(float(percentage), 2)}
+                    for rgb, percentage in zip(item["rgb"], item["percentage"])
+                    if percentage > 0
+                ],
+            })
+            if len(results) >= top_n:
+                break
+        return results
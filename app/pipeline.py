@@ -0,0 +1,208 @@
+import cv2
+import numpy as np
+from .decoding import decode_image
+from .image_processing import (
+    COLOR_ENGINES, DEFAULT_ERROR_MARGIN, DEFAULT_REGION_GRID, DEFAULT_TIME_BUDGET, WORKING_WIDTH,
+    identify_clothing_area, resize_to_working, prepare_pixels, cluster_pixels, cluster_pixels_approx, cluster_regions, region_labels,
+)
+from .color_classifier import classify_extracted_colors
+from .color_lut import color_name_distribution, get_color_lut
+from .color_combinations import suggest_color_combinations, suggest_region_pairs
+from .preview import encode_thumbnail
+from .metrics import collect_timings, stage, track_peak_memory
+from . import config
+
+
+# 画像解析パイプライン本体
+# ワーカープロセスで実行されるため、引数と返り値はpickle可能な素朴な型（bytes, dict, list）だけにする
+
+# 省略できる出力（outputsで指定しなかったものは計算しない）
+PIPELINE_OUTPUTS = ("classified_colors", "color_distribution", "color_suggestions", "regions", "region_suggestions")
+
+# メモリの使い方
+# "normal": 各段階で新しい配列を作る
+# "low": デコードした画像を縮小後すぐに手放し、作業用画像は使い回しの配列に書き込み、RGBへの変換も上書きで行う
+MEMORY_MODES = ("normal", "low")
+
+def init_worker() -> None:
+    """ワーカーの起動時に呼ばれ、ネイティブライブラリのスレッド数を制限し、最初のリクエストを待たずにRGB→色名の変換表を読み込んでおく。"""
+    limit_native_threads(config.BLAS_THREADS, config.OPENCV_THREADS)
+    get_color_lut()
+
+def limit_native_threads(blas_threads: int, opencv_threads: int) -> None:
+    """
+    BLAS/OpenMP（numpy, scikit-learnのk-means）とOpenCVが使うスレッド数を制限する（0の場合は変えない）。
+    ワーカーが複数あると、ライブラリがそれぞれCPUコア数のスレッドを作り、コア数を大きく超えて奪い合うため。
+
+    Args:
+        blas_threads (int): BLAS/OpenMPのスレッド数。
+        opencv_threads (int): OpenCVのスレッド数。
+    """
+    if blas_threads > 0:
+        from sklearn.cluster import KMeans # noqa: F401 OpenMPのライブラリは読み込まれてからでないと制限できないので、先に読み込む
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=blas_threads)
+    if opencv_threads > 0:
+        cv2.setNumThreads(opencv_threads)
+
+def make_warm_up_image() -> bytes:
+    """ウォームアップ用の合成画像（灰色の背景に服のような色の矩形を描いたJPEG）を作る。"""
+    image = np.full((480, 360, 3), 200, np.uint8)
+    cv2.rectangle(image, (90, 60), (270, 420), (40, 40, 160), thickness=-1) # BGRで赤っぽい服
+    cv2.rectangle(image, (140, 200), (220, 300), (230, 230, 230), thickness=-1) # 白いロゴ
+    is_success, buffer = cv2.imencode(".jpg", image)
+    return buffer.tobytes()
+
+def warm_up() -> dict:
+    """
+    合成画像でパイプライン全体（デコード、服の領域の識別、色抽出の全エンジン、分類、提案、プレビュー）を実行する。
+    scikit-learnの読み込みやスレッドプールの初期化を、最初のリクエストより前に済ませておくため。
+
+    Returns:
+        dict: 最後に実行したときの段階ごとの処理時間（秒）。
+    """
+    init_worker()
+    contents = make_warm_up_image()
+    result = {}
+    for engine in COLOR_ENGINES:
+        result = analyze_image(contents, engine=engine, preview_format="jpeg")
+    return result["timings"]
+
+def analyze_image(
+    contents: bytes,
+    num_colors: int | str = 3,
+    engine: str = "kmeans",
+    segmentation: str = "grabcut",
+    preview_format: str | None = None,
+    preview_max_side: int = 320,
+    working_width: int = WORKING_WIDTH,
+    max_iter: int | None = None,
+    outputs: tuple[str, ...] | None = None,
+    memory_mode: str = "normal",
+    regions: str = "none",
+    region_grid: tuple[tuple[str, float], ...] = DEFAULT_REGION_GRID,
+    approximate: bool = False,
+    error_margin: float = DEFAULT_ERROR_MARGIN,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+) -> dict:
+    """
+    アップロードされた画像のバイト列を解析し、結果を辞書で返す。
+
+    Args:
+        contents (bytes): アップロードされた画像ファイルの中身。
+        num_colors (int | str): 抽出する色の数。"auto" の場合は画像ごとに選ぶ。
+        engine (str): 色抽出エンジン（"kmeans" または "histogram"）。
+        segmentation (str): 服の領域の識別方法（"grabcut" または "none"）。
+        preview_format (str | None): プレビュー画像の形式（"jpeg" または "webp"）。Noneの場合は作らない。
+        preview_max_side (int): プレビュー画像の長辺の最大ピクセル数。
+        working_width (int): 色の抽出に使う作業用画像の幅（混み合っているときは小さくする）。
+        max_iter (int | None): K-meansの最大反復回数（Noneの場合はデフォルト）。
+        outputs (tuple[str, ...] | None): 計算する出力（PIPELINE_OUTPUTSのうち必要なもの）。Noneの場合はすべて。
+                                          抽出された色、画像サイズ、診断情報は常に返す。
+        memory_mode (str): メモリの使い方（"normal" または "low"）。結果は同じ。
+        regions (str): 領域（トップス・ボトムスなど）ごとの色の分け方（"none", "grid", "components"）。
+                       "none"以外の場合は、領域ごとの色と領域どうしの組み合わせの提案も返す。
+        region_grid (tuple[tuple[str, float], ...]): "grid" で使う (領域名, 帯の下端の位置) のリスト。
+        approximate (bool): Trueの場合は、ピクセルの一部（サンプル）だけで色を求める近似モードにする。
+                            抽出・分類された色に割合の誤差（percentage_error）が付く。
+        error_margin (float): 近似モードの割合の誤差（95%信頼区間の半幅、パーセントポイント）の目標。
+        time_budget (float): 近似モードで色の抽出にかけてよい秒数の目安。
+
+    Returns:
+        dict: 画像サイズ、抽出・分類された色、ピクセル単位の色名の分布、組み合わせ提案、プレビュー画像、
+              領域ごとの色と組み合わせの提案（regionsを指定した場合）、
+              診断情報（デコード方式、服の領域の割合、メモリ使用量の最大値、近似モードのサンプル数など）、段階ごとの処理時間を含む辞書。
+              outputsで指定しなかった出力はNone。
+              失敗した場合は {"error": メッセージ, "timings": 処理時間} を返す。
+    """
+    if memory_mode not in MEMORY_MODES:
+        raise ValueError(f"不明なメモリの使い方です: {memory_mode}")
+    outputs = PIPELINE_OUTPUTS if outputs is None else outputs
+    low_memory = memory_mode == "low"
+    with collect_timings() as timings, track_peak_memory() as memory:
+        # OpenCVで画像としてデコード（JPEGはヘッダーのサイズを見て、処理に使う解像度に近いサイズで直接デコード）
+        with stage("decode"):
+            img, diagnostics = decode_image(contents, target_width=working_width)
+
+        if img is None:
+            return {"error": "画像の読み込みに失敗しました。有効な画像ファイルをアップロードしてください。", "timings": timings}
+
+        working_img = resize_to_working(img, width=working_width, reuse_buffer=low_memory) # 以降の処理はすべて縮小した作業用画像で行う
+        if low_memory:
+            del img # フル解像度に近いデコード結果は、縮小したらすぐに手放す
+        with stage("identify_clothing_area"):
+            clothing_mask = identify_clothing_area(working_img, method=segmentation) # 服の領域を識別
+        # 服の領域を見つけられなかった場合は画像全体を使う（"fallback"）
+        diagnostics["segmentation"] = segmentation if clothing_mask is not None or segmentation == "none" else "fallback"
+        diagnostics["clothing_area_ratio"] = round(float(clothing_mask.mean()), 4) if clothing_mask is not None else 1.0
+
+        # --- プレビュー用のサムネイル（作業用画像から作るので、元画像を再エンコードするより軽い） ---
+        # 低メモリモードでは次のRGBへの変換で作業用画像が上書きされるので、その前に作る
+        preview = None
+        if preview_format is not None:
+            with stage("preview_encode"):
+                preview = encode_thumbnail(working_img, max_side=preview_max_side, image_format=preview_format)
+
+        pixels = prepare_pixels(working_img, mask=clothing_mask, in_place=low_memory) # 服の領域のRGBピクセルだけを詰めた配列に
+        # 識別された領域からメインの色を抽出（近似モードでは、割合の誤差が目標に収まるまでサンプルを増やしながら）
+        sampling = None
+        if approximate:
+            dominant_colors_data, sampling = cluster_pixels_approx(
+                pixels, num_colors=num_colors, engine=engine, max_iter=max_iter, error_margin=error_margin, time_budget=time_budget,
+            )
+        else:
+            dominant_colors_data = cluster_pixels(pixels, num_colors=num_colors, engine=engine, max_iter=max_iter)
+        # 必要な出力だけを計算する（提案には分類された色が必要）
+        classified_colors_data = color_distribution = color_suggestions = None
+        if "classified_colors" in outputs or "color_suggestions" in outputs:
+            with stage("classify"):
+                classified_colors_data = classify_extracted_colors(dominant_colors_data) #抽出された色を色名に分類
+        if "color_distribution" in outputs:
+            with stage("color_distribution"):
+                color_distribution = color_name_distribution(pixels) # 全ピクセルを色名に分類した割合（クラスター中心に依存しない）
+        if "color_suggestions" in outputs:
+            with stage("suggest"):
+                color_suggestions = suggest_color_combinations(classified_colors_data) #分類された色に合わせて提案
+
+        # 領域（トップス・ボトムスなど）ごとの色。全領域のヒストグラムを1回のbincountでまとめて作る
+        region_colors = region_suggestions = None
+        if regions != "none" and ("regions" in outputs or "region_suggestions" in outputs):
+            with stage("regions"):
+                labels, names = region_labels(clothing_mask, working_img.shape[:2], method=regions, grid=region_grid)
+                region_index = labels[clothing_mask] if clothing_mask is not None else labels.reshape(-1) # pixelsと同じ順に並べる
+                region_colors = []
+                for name, (colors, count) in zip(names, cluster_regions(pixels, region_index, len(names))):
+                    if count == 0:
+                        continue
+                    region_colors.append({
+                        "name": name,
+                        "percentage": round(count / len(pixels) * 100, 2), # 解析したピクセルのうち、この領域の割合
+                        "extracted_colors": [{"rgb": color.rgb, "percentage": color.percentage} for color in colors],
+                        "classified_colors": classify_extracted_colors(colors),
+                    })
+            if "region_suggestions" in outputs:
+                with stage("region_suggest"):
+                    region_suggestions = suggest_region_pairs(region_colors)
+
+        #　抽出された色を辞書のリスト変換、APIレスポンスに含める
+        extracted_colors_for_response = [
+            {"rgb": color.rgb, "percentage": color.percentage}
+            | ({"percentage_error": color.percentage_error} if color.percentage_error is not None else {})
+            for color in dominant_colors_data
+        ]
+
+    diagnostics["memory_mode"] = memory_mode
+    diagnostics["sampling"] = sampling # 近似モードのサンプル数と割合の誤差の最大値（近似モードでなければNone）
+    diagnostics["memory"] = memory # このリクエストの処理中のメモリ使用量（RSS）の最大値と増加分
+    return {
+        "image_dimensions": diagnostics["source_size"], # 縮小デコードした場合も元画像のサイズ
+        "extracted_colors": extracted_colors_for_response,
+        "classified_colors": classified_colors_data,
+        "color_distribution": color_distribution,
+        "color_suggestions": color_suggestions,
+        "regions": region_colors,
+        "region_suggestions": region_suggestions,
+        "preview": preview,
+        "diagnostics": diagnostics,
+        "timings": timings, # 段階ごとの処理時間（秒）
+    }
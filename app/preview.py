@@ -0,0 +1,73 @@
+import hashlib
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+# プレビュー画像（サムネイル）
+# 元画像をPNGで再エンコードしてJSONに埋め込むのではなく、縮小済みの作業用画像から
+# 小さなJPEG/WebPを作り、GET /preview/{id} で別に配信する。
+
+PREVIEW_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+def encode_thumbnail(image_np: np.ndarray, max_side: int = 320, image_format: str = "jpeg", quality: int = 80) -> dict | None:
+    """
+    画像を長辺max_sideピクセル以下に縮小し、JPEGまたはWebPにエンコードする。
+
+    Args:
+        image_np (np.ndarray): OpenCV形式の画像（BGR）。
+        max_side (int): サムネイルの長辺の最大ピクセル数。
+        image_format (str): "jpeg" または "webp"。
+        quality (int): 画質（0-100）。
+
+    Returns:
+        dict | None: {"data": バイト列, "media_type": MIMEタイプ, "etag": ETag}。エンコードに失敗した場合はNone。
+    """
+    extension, media_type, quality_flag = PREVIEW_FORMATS[image_format]
+    h, w = image_np.shape[:2]
+    scale = max_side / max(h, w)
+    if scale < 1:
+        image_np = cv2.resize(image_np, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    is_success, buffer = cv2.imencode(extension, image_np, [quality_flag, quality])
+    if not is_success:
+        return None
+    data = buffer.tobytes()
+    return {
+        "data": data,
+        "media_type": media_type,
+        "etag": '"' + hashlib.sha256(data).hexdigest()[:32] + '"',
+    }
+
+
+class PreviewStore:
+    """
+    サムネイルをIDごとに保持するLRUストア。合計バイト数が上限を超えたら古いものから削除する。
+    このプロセスのメモリに保持するので、uvicornのワーカーが複数あると、GET /preview/{id} が
+    サムネイルを作ったのとは別のプロセスに届いて404になる（プレビューを使う場合はワーカーを1つにする）。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._previews: OrderedDict[str, dict] = OrderedDict()
+        self._total_bytes = 0
+
+    def put(self, preview_id: str, preview: dict) -> None:
+        """サムネイルを保存する。"""
+        old = self._previews.pop(preview_id, None)
+        if old is not None:
+            self._total_bytes -= len(old["data"])
+        self._previews[preview_id] = preview
+        self._total_bytes += len(preview["data"])
+        while self._total_bytes > self.max_bytes and len(self._previews) > 1:
+            _, evicted = self._previews.popitem(last=False)
+            self._total_bytes -= len(evicted["data"])
+
+    def get(self, preview_id: str) -> dict | None:
+        """サムネイルを取り出す。見つからない場合はNone。"""
+        preview = self._previews.get(preview_id)
+        if preview is not None:
+            self._previews.move_to_end(preview_id)
+        return preview
@@ -0,0 +1,53 @@
+import json
+from fastapi.responses import Response
+
+# 高速なJSONエンコーダー（orjson）とMessagePackは、インストールされていなければ標準のjsonで代用する
+try:
+    import orjson
+except ImportError: # pragma: no cover - requirements.txtに含まれているので通常は入っている
+    orjson = None
+try:
+    import msgpack
+except ImportError: # pragma: no cover
+    msgpack = None
+
+
+# レスポンスのシリアライズ
+# FastAPIが辞書を返すときの処理（jsonable_encoderで全体をたどってから標準のjsonで文字列にする）を通さず、
+# orjsonで直接バイト列にする。Acceptヘッダーで MessagePack を指定したクライアントにはMessagePackで返す。
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+def dumps_json(obj) -> bytes:
+    """JSONのバイト列にする（日本語はエスケープせずUTF-8のまま）。"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def wants_msgpack(accept: str | None) -> bool:
+    """AcceptヘッダーでMessagePackが指定されているか（q=0は除く）。"""
+    if not accept or msgpack is None:
+        return False
+    for part in accept.split(","):
+        media_type, *parameters = [item.strip() for item in part.split(";")]
+        if media_type.lower() in MSGPACK_MEDIA_TYPES:
+            return not any(p.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for p in parameters)
+    return False
+
+def render(body: dict, accept: str | None = None, status_code: int = 200, headers: dict | None = None) -> Response:
+    """
+    Acceptヘッダーに応じて、レスポンスをMessagePackまたはJSONにする。
+
+    Args:
+        body (dict): レスポンスの内容（辞書、リスト、文字列、数値、タプルのみ）。
+        accept (str | None): リクエストのAcceptヘッダー。
+        status_code (int): HTTPステータスコード。
+        headers (dict | None): 追加するレスポンスヘッダー。
+
+    Returns:
+        Response: シリアライズ済みのレスポンス。
+    """
+    headers = {**(headers or {}), "Vary": "Accept"} # Acceptによって中身が変わることをキャッシュに伝える
+    if wants_msgpack(accept):
+        return Response(msgpack.packb(body, use_bin_type=True), status_code=status_code, media_type="application/msgpack", headers=headers)
+    return Response(dumps_json(body), status_code=status_code, media_type="application/json", headers=headers)
@@ -0,0 +1,116 @@
+from typing import TYPE_CHECKING
+import cv2
+import numpy as np
+from .decoding import decode_image
+from .image_processing import ExtractedColor, prepare_pixels
+from .color_classifier import classify_extracted_colors
+from .color_combinations import suggest_color_combinations
+from .metrics import collect_timings, stage
+
+if TYPE_CHECKING:
+    from sklearn.cluster import MiniBatchKMeans
+
+
+# カメラ映像のストリーミング解析（WebSocket /ws/stream 用）
+# 1フレームごとにK-meansを最初から学習し直すと間に合わないので、接続ごとにMiniBatchKMeansを保持し、
+# 前のフレームで求めた色の中心から partial_fit で少しずつ更新する。
+# - ほとんど変化のないフレームは解析せずに飛ばす
+# - 場面が大きく変わったら（別の服を映したなど）、学習をやり直す
+
+STREAM_FRAME_WIDTH = 160 # フレームはこの幅まで縮小して解析する（カメラ映像は数フレームで十分に色が集まる）
+STREAM_SAMPLE_PIXELS = 4096 # 1フレームから partial_fit に使うピクセル数
+FINGERPRINT_SIZE = 16 # 変化の判定に使う縮小画像の一辺のピクセル数
+DUPLICATE_THRESHOLD = 4.0 # 縮小画像の平均差（0-255）がこれ未満なら前のフレームと同じとみなす
+SCENE_CHANGE_THRESHOLD = 40.0 # 縮小画像の平均差がこれ以上なら別の場面とみなして学習をやり直す
+MIN_CLUSTER_RATIO = 0.01 # 割り当てられたピクセルがこの割合未満の色の中心は、映像から消えた色とみなす
+
+class StreamSession:
+    """
+    1つのWebSocket接続の色抽出の状態（学習途中のMiniBatchKMeansと直前のフレーム）を保持する。
+    スレッドから呼ばれるが、同じ接続のフレームは1枚ずつ順番に処理される前提。
+    """
+
+    def __init__(self, num_colors: int = 3):
+        self.num_colors = num_colors
+        self._kmeans: "MiniBatchKMeans | None" = None
+        self._fingerprint: np.ndarray | None = None
+        self._rng = np.random.default_rng(0)
+        self.frames_processed = 0
+        self.frames_skipped = 0
+
+    def process_frame(self, contents: bytes) -> dict | None:
+        """
+        1フレームを解析し、更新した色を返す。
+
+        Args:
+            contents (bytes): フレームの画像ファイル（JPEG/PNG/WebP）の中身。
+
+        Returns:
+            dict | None: 抽出・分類された色、組み合わせ提案、段階ごとの処理時間。
+                         前のフレームとほぼ同じで飛ばした場合はNone。
+                         デコードに失敗した場合や、ピクセル数が色の数より少ない場合は {"error": メッセージ}。
+        """
+        with collect_timings() as timings:
+            with stage("decode"):
+                img, _ = decode_image(contents, target_width=STREAM_FRAME_WIDTH)
+            if img is None:
+                return {"error": "フレームの読み込みに失敗しました。"}
+
+            h, w = img.shape[:2]
+            if h * w < self.num_colors:
+                # K-meansは色の数より少ないピクセルでは学習できない
+                return {"error": f"フレームが小さすぎます（{w}x{h}）。{self.num_colors}ピクセル以上の画像を送ってください。"}
+            if w > STREAM_FRAME_WIDTH:
+                img = cv2.resize(img, (STREAM_FRAME_WIDTH, max(1, round(STREAM_FRAME_WIDTH * h / w))), interpolation=cv2.INTER_AREA)
+
+            # 小さく縮小した画像どうしの差で、フレームの変化の大きさを測る
+            fingerprint = cv2.resize(img, (FINGERPRINT_SIZE, FINGERPRINT_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+            difference = None
+            if self._fingerprint is not None:
+                difference = float(np.abs(fingerprint - self._fingerprint).mean())
+                if difference < DUPLICATE_THRESHOLD:
+                    self.frames_skipped += 1
+                    return None
+            self._fingerprint = fingerprint
+
+            pixels = prepare_pixels(img)
+            if len(pixels) > STREAM_SAMPLE_PIXELS:
+                pixels = pixels[self._rng.choice(len(pixels), STREAM_SAMPLE_PIXELS, replace=False)]
+            pixels = pixels.astype(np.float64)
+
+            restarted = self._kmeans is None or (difference is not None and difference >= SCENE_CHANGE_THRESHOLD)
+            with stage("cluster_stream"):
+                if not restarted:
+                    self._kmeans.partial_fit(pixels) # 前のフレームの中心から少しだけ動かす
+                    counts = np.bincount(self._kmeans.predict(pixels), minlength=self.num_colors)
+                    # 映っていない色の中心が残った（どのピクセルも割り当てられない）場合は学習をやり直す
+                    restarted = bool((counts < len(pixels) * MIN_CLUSTER_RATIO).any())
+                if restarted:
+                    from sklearn.cluster import MiniBatchKMeans # 起動を速くするため、最初に使うときに読み込む
+                    self._kmeans = MiniBatchKMeans(n_clusters=self.num_colors, random_state=0, n_init=1, batch_size=len(pixels))
+                    self._kmeans.partial_fit(pixels)
+                    counts = np.bincount(self._kmeans.predict(pixels), minlength=self.num_colors)
+
+            dominant_colors = [
+                ExtractedColor(
+                    rgb=tuple(int(c) for c in center.astype(int)),
+                    percentage=round(float(count / len(pixels) * 100), 2),
+                )
+                for center, count in zip(self._kmeans.cluster_centers_, counts)
+                if count > 0
+            ]
+            dominant_colors.sort(key=lambda x: x.percentage, reverse=True)
+
+            with stage("classify"):
+                classified_colors = classify_extracted_colors(dominant_colors)
+            with stage("suggest"):
+                color_suggestions = suggest_color_combinations(classified_colors)
+
+        self.frames_processed += 1
+        return {
+            "extracted_colors": [{"rgb": color.rgb, "percentage": color.percentage} for color in dominant_colors],
+            "classified_colors": classified_colors,
+            "color_suggestions": color_suggestions,
+            "restarted": restarted, # 場面が変わって学習をやり直した場合はTrue
+            "timings": timings,
+        }
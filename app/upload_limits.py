@@ -0,0 +1,58 @@
+from fastapi.responses import JSONResponse
+from starlette.exceptions import HTTPException
+from . import metrics
+
+
+# アップロードの大きさの制限
+# file.read() の前に本体をすべて受け取ってしまうと、巨大なアップロードでメモリやディスクが埋まる。
+# ASGIミドルウェアで受信中のバイト数を数え、上限を超えた時点で読み込みを打ち切って413を返す。
+
+class UploadSizeLimitMiddleware:
+    """
+    リクエスト本体のバイト数を制限するASGIミドルウェア。
+    Content-Lengthが上限を超えていれば本体を読まずにすぐ413を返し、
+    Content-Lengthがない（chunked）場合や偽っている場合も、受信した量が上限を超えた時点で打ち切る。
+    """
+
+    def __init__(self, app, max_bytes: int, path_limits: dict[str, int] | None = None):
+        """
+        Args:
+            app: 次に呼び出すASGIアプリ。
+            max_bytes (int): リクエスト本体の最大バイト数（0以下で無制限）。
+            path_limits (dict[str, int] | None): パスごとに上限を変える場合の {パス: 最大バイト数}。
+        """
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.path_limits.get(scope["path"], self.max_bytes)
+        if limit <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        message = f"アップロードが大きすぎます。{round(limit / (1024 * 1024), 1):g}MB以下にしてください。"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            metrics.ERRORS.inc(kind="upload_too_large")
+            response = JSONResponse({"detail": message}, status_code=413, headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message_received = await receive()
+            if message_received["type"] == "http.request":
+                received += len(message_received.get("body", b""))
+                if received > limit:
+                    # 本体の解析中に送出されるので、FastAPIがそのまま413のレスポンスにする
+                    metrics.ERRORS.inc(kind="upload_too_large")
+                    raise HTTPException(status_code=413, detail=message)
+            return message_received
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+
+
+# 色解析パイプラインとHTTPエンドポイントのベンチマーク
+#
+# 使い方:
+#   pip install -r benchmarks/requirements.txt
+#   python -m benchmarks --profile quick --save baseline.json
+#   python -m benchmarks --profile quick --compare baseline.json   # 前回より遅くなっていれば終了コード1
+
+def summarize(samples: list[float], wall_seconds: float, memory: dict | None = None, worker_peak_bytes: int | None = None) -> dict:
+    """
+    処理時間のサンプル（秒）から p50/p95/p99（ミリ秒）とスループットを求める。
+
+    Args:
+        samples (list[float]): 1回ごとの処理時間（秒）。
+        wall_seconds (float): 計測全体の経過時間（秒）。
+        memory (dict | None): このベンチマークの間に track_peak_memory で測ったこのプロセスのメモリ。
+        worker_peak_bytes (int | None): ワーカープロセスが報告したメモリ使用量（RSS）の最大値。
+
+    Returns:
+        dict: 集計結果。メモリを測れなかった項目は含めない。
+    """
+    values = np.array(samples) * 1000
+    stats = {
+        "runs": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "throughput_per_s": round(len(samples) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+    }
+    if memory and "peak_rss_bytes" in memory:
+        stats["peak_rss_mb"] = round(memory["peak_rss_bytes"] / 1024 / 1024, 1)
+    if worker_peak_bytes is not None:
+        stats["worker_peak_rss_mb"] = round(worker_peak_bytes / 1024 / 1024, 1)
+    return stats
+
+def time_calls(func, repeat: int, warmup: int = 1) -> dict:
+    """関数を繰り返し呼び出して処理時間と、その間のメモリ使用量（RSS）の最大値を計測する。"""
+    from app.metrics import track_peak_memory
+
+    for _ in range(warmup):
+        func()
+    samples = []
+    wall_started = time.perf_counter()
+    # ベンチマークごとに最大値（VmHWM）をリセットするので、前のベンチマークの値を引き継がない
+    with track_peak_memory() as memory:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+    return summarize(samples, time.perf_counter() - wall_started, memory)
+
+def bench_functions(corpus, repeat: int) -> dict:
+    """パイプラインの各関数を画像ごとに計測する。"""
+    from app.decoding import decode_image
+    from app.image_processing import WORKING_WIDTH, extract_dominant_colors
+    from app.color_classifier import classify_extracted_colors
+    from app.color_combinations import suggest_color_combinations
+
+    results = {}
+    for spec, contents in corpus:
+        img, _ = decode_image(contents, target_width=WORKING_WIDTH)
+        for engine in ("kmeans", "histogram"):
+            results[f"extract_dominant_colors[{engine}]/{spec.name}"] = time_calls(
+                lambda: extract_dominant_colors(img, num_colors=3, engine=engine), repeat
+            )
+        colors = extract_dominant_colors(img, num_colors=3)
+        classified = classify_extracted_colors(colors)
+        results[f"classify_extracted_colors/{spec.name}"] = time_calls(lambda: classify_extracted_colors(colors), repeat)
+        results[f"suggest_color_combinations/{spec.name}"] = time_calls(lambda: suggest_color_combinations(classified), repeat)
+        print(f"  {spec.name} 完了", file=sys.stderr)
+    return results
+
+async def bench_endpoint(corpus, repeat: int) -> dict:
+    """/uploadfile/ をプロセス内のASGIクライアントで呼び出して、エンドツーエンドの処理時間を計測する。"""
+    import httpx
+    from app.main import app, executor
+    from app.metrics import track_peak_memory
+
+    content_types = {"jpeg": "image/jpeg", "png": "image/png"}
+    results = {}
+    executor.start()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None) as client:
+            for spec, contents in corpus:
+                files = {"file": (f"{spec.name}.{spec.format}", contents, content_types[spec.format])}
+
+                async def upload() -> int | None:
+                    """画像を送り、ワーカーが報告したこのリクエストの処理中のメモリ使用量の最大値を返す。"""
+                    response = await client.post("/uploadfile/", files=files)
+                    response.raise_for_status()
+                    return response.json().get("diagnostics", {}).get("memory", {}).get("peak_rss_bytes")
+
+                await upload() # ウォームアップ（ワーカーの起動など）
+                samples = []
+                worker_peaks = []
+                wall_started = time.perf_counter()
+                # デコードと色の抽出はワーカー（プロセスプールでは別プロセス）で行われるので、
+                # このプロセスの値とは別に、パイプラインがリクエストごとに測ったワーカーの値も記録する
+                with track_peak_memory() as memory:
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        worker_peaks.append(await upload())
+                        samples.append(time.perf_counter() - started)
+                worker_peaks = [peak for peak in worker_peaks if peak is not None]
+                results[f"uploadfile/{spec.name}"] = summarize(
+                    samples, time.perf_counter() - wall_started, memory, max(worker_peaks) if worker_peaks else None,
+                )
+                print(f"  /uploadfile/ {spec.name} 完了", file=sys.stderr)
+    finally:
+        executor.shutdown()
+    return results
+
+def bench_search(rows: int, repeat: int) -> dict:
+    """合成した rows 件の検索インデックスに対して、PaletteIndex.search（全件との距離の計算）を計測する。"""
+    from app.palette_index import PaletteIndex
+    from benchmarks.corpus import build_search_index
+
+    query = [{"rgb": (200, 30, 40), "percentage": 60.0}, {"rgb": (30, 30, 30), "percentage": 30.0}, {"rgb": (240, 240, 230), "percentage": 10.0}]
+    with tempfile.TemporaryDirectory() as directory:
+        build_search_index(directory, rows)
+        index = PaletteIndex(directory)
+        results = {f"search/{rows}": time_calls(lambda: index.search(query, top_n=10), repeat)}
+    print(f"  検索 {rows}件 完了", file=sys.stderr)
+    return results
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """前回の結果と比べて、p50が許容範囲を超えて遅くなったベンチマークを返す。"""
+    regressions = []
+    for name, stats in current["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or previous["p50_ms"] <= 0:
+            continue
+        ratio = stats["p50_ms"] / previous["p50_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: p50 {previous['p50_ms']}ms -> {stats['p50_ms']}ms ({ratio:.2f}倍)")
+    return regressions
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="色解析パイプラインのベンチマーク")
+    parser.add_argument("--profile", choices=("quick", "full"), default="quick", help="画像コーパスの規模")
+    parser.add_argument("--repeat", type=int, default=10, help="1つのベンチマークを繰り返す回数")
+    parser.add_argument("--only", choices=("functions", "endpoint", "search"), help="どれか1つだけを計測する")
+    parser.add_argument("--search-rows", type=int, help="検索のベンチマークの商品数（省略時はquickで10万件、fullで100万件）")
+    parser.add_argument("--save", help="結果をJSONで保存するパス（次回の比較用のベースライン）")
+    parser.add_argument("--compare", help="比較するベースラインのJSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="遅くなったと判定するp50の増加率（0.15 = 15%%）")
+    args = parser.parse_args(argv)
+
+    # 同じ画像を繰り返し送るので、キャッシュを無効にして毎回パイプラインを実行させる
+    os.environ["CACHE_MAX_ENTRIES"] = "0"
+    # fullプロファイルの48MPの画像が413で弾かれないよう、アップロードと画素数の上限を外す
+    os.environ["MAX_UPLOAD_BYTES"] = "0"
+    os.environ["MAX_IMAGE_MEGAPIXELS"] = "0"
+    from benchmarks.corpus import SEARCH_INDEX_ROWS, build_corpus
+
+    corpus = []
+    if args.only != "search": # 検索のベンチマークは画像を使わない
+        print(f"コーパスを生成中（{args.profile}）...", file=sys.stderr)
+        corpus = build_corpus(args.profile)
+
+    results = {}
+    if args.only in (None, "functions"):
+        results.update(bench_functions(corpus, args.repeat))
+    if args.only in (None, "endpoint"):
+        results.update(asyncio.run(bench_endpoint(corpus, args.repeat)))
+    if args.only in (None, "search"):
+        results.update(bench_search(args.search_rows or SEARCH_INDEX_ROWS[args.profile], args.repeat))
+
+    report = {
+        "profile": args.profile,
+        "repeat": args.repeat,
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "cpu_count": os.cpu_count()},
+        "results": results,
+    }
+
+    print(f"{'ベンチマーク':<60} {'p50':>9} {'p95':>9} {'p99':>9} {'件/秒':>9} {'RSS(MB)':>9} {'ワーカー':>9}")
+    for name, stats in results.items():
+        rss = f"{stats['peak_rss_mb']:.1f}" if "peak_rss_mb" in stats else "-"
+        worker_rss = f"{stats['worker_peak_rss_mb']:.1f}" if "worker_peak_rss_mb" in stats else "-"
+        print(f"{name:<60} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['throughput_per_s']:>9.2f} {rss:>9} {worker_rss:>9}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\n性能の低下が見つかりました:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nベースラインと比べて性能の低下はありません。")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+import zlib
+import cv2
+import numpy as np
+from dataclasses import dataclass
+
+
+# ベンチマーク用の合成画像コーパス
+# 乱数のシードを固定しているので、何度生成しても同じ画像（同じバイト列）になる。
+
+@dataclass(frozen=True)
+class ImageSpec:
+    name: str
+    width: int
+    height: int
+    kind: str   # "solid"（単色）, "stripes"（ストライプ）, "photo"（ノイズとグラデーションのある写真風）
+    format: str # "jpeg" または "png"
+
+# 0.3MP〜48MPの解像度
+RESOLUTIONS = {
+    "0.3mp": (640, 480),
+    "2mp": (1600, 1200),
+    "12mp": (4000, 3000),
+    "48mp": (8000, 6000),
+}
+KINDS = ("solid", "stripes", "photo")
+FORMATS = ("jpeg", "png")
+
+# プロファイルごとの画像の組み合わせ（quickは手元で数十秒、fullはすべての組み合わせ）
+PROFILES = {
+    "quick": [
+        ImageSpec(f"{kind}_{resolution}_{image_format}", *RESOLUTIONS[resolution], kind, image_format)
+        for resolution in ("0.3mp", "2mp")
+        for kind in KINDS
+        for image_format in ("jpeg",)
+    ] + [ImageSpec("photo_12mp_jpeg", *RESOLUTIONS["12mp"], "photo", "jpeg")],
+    "full": [
+        ImageSpec(f"{kind}_{resolution}_{image_format}", *RESOLUTIONS[resolution], kind, image_format)
+        for resolution in RESOLUTIONS
+        for kind in KINDS
+        for image_format in FORMATS
+    ],
+}
+
+def render_image(spec: ImageSpec) -> np.ndarray:
+    """仕様に従って合成画像（BGR）を作る。シードは画像名から決まるので、プロファイルが違っても同じ画像になる。"""
+    rng = np.random.default_rng(zlib.crc32(spec.name.encode("utf-8")))
+    h, w = spec.height, spec.width
+    if spec.kind == "solid":
+        color = rng.integers(0, 256, 3, dtype=np.uint8)
+        return np.full((h, w, 3), color, dtype=np.uint8)
+    if spec.kind == "stripes":
+        palette = rng.integers(0, 256, (4, 3), dtype=np.uint8)
+        stripe = (np.arange(h) // max(1, h // 12)) % len(palette)
+        return np.ascontiguousarray(np.broadcast_to(palette[stripe][:, None, :], (h, w, 3)))
+    # 写真風: 縦方向のグラデーションの上に色の付いた楕円（服）を置き、ノイズを加える
+    top, bottom = rng.integers(60, 230, (2, 3))
+    ramp = np.linspace(0, 1, h, dtype=np.float32)[:, None, None]
+    img = (top * (1 - ramp) + bottom * ramp).astype(np.uint8)
+    img = np.ascontiguousarray(np.broadcast_to(img, (h, w, 3)))
+    for _ in range(3):
+        center = (int(rng.integers(w // 4, 3 * w // 4)), int(rng.integers(h // 4, 3 * h // 4)))
+        axes = (int(rng.integers(w // 10, w // 4)), int(rng.integers(h // 8, h // 3)))
+        cv2.ellipse(img, center, axes, 0, 0, 360, [int(c) for c in rng.integers(0, 256, 3)], -1)
+    noise = rng.normal(0, 12, (h, w, 3)).astype(np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def encode_image(spec: ImageSpec, img: np.ndarray) -> bytes:
+    """画像を仕様の形式でエンコードする。"""
+    if spec.format == "jpeg":
+        is_success, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    else:
+        is_success, buffer = cv2.imencode(".png", img)
+    if not is_success:
+        raise RuntimeError(f"画像のエンコードに失敗しました: {spec.name}")
+    return buffer.tobytes()
+
+def build_corpus(profile: str = "quick") -> list[tuple[ImageSpec, bytes]]:
+    """プロファイルのすべての画像を (仕様, エンコード済みバイト列) のリストとして作る。"""
+    return [(spec, encode_image(spec, render_image(spec))) for spec in PROFILES[profile]]
+
+# 検索インデックスのベンチマークで使う商品数
+SEARCH_INDEX_ROWS = {"quick": 100_000, "full": 1_000_000}
+SEARCH_BUILD_CHUNK_ROWS = 100_000 # 一度にベクトルを計算する件数（一時配列のメモリを抑えるため）
+
+def build_search_index(directory: str, rows: int, seed: int = 0) -> None:
+    """
+    乱数の色を持つ商品を rows 件入れた検索インデックスを作る。
+    PaletteIndex.add_many を1件ずつ呼ぶと100万件で数十秒かかるので、palette_vector と同じ計算を
+    まとめて行い、PaletteIndex と同じ形式のファイルを直接書き出す。
+    """
+    from app.palette_index import ANCHOR_LAB, ANCHOR_SIGMA, INDEX_SLOTS, ITEM_DTYPE, PaletteIndex
+
+    rng = np.random.default_rng(seed)
+    index = PaletteIndex(directory)
+    os.makedirs(directory, exist_ok=True)
+    with open(index.items_path, "wb") as items_file, open(index.vectors_path, "wb") as vectors_file:
+        for start in range(0, rows, SEARCH_BUILD_CHUNK_ROWS):
+            count = min(SEARCH_BUILD_CHUNK_ROWS, rows - start)
+            rgb = rng.integers(0, 256, (count, INDEX_SLOTS, 3), dtype=np.uint8)
+            percentage = rng.dirichlet(np.ones(INDEX_SLOTS), count).astype(np.float32) * 100
+            lab = cv2.cvtColor(rgb.astype(np.float32) / 255, cv2.COLOR_RGB2Lab) # (件数, 色の数, 3)
+            weights = percentage / percentage.sum(axis=1, keepdims=True)
+            squared = ((lab[:, :, None, :] - ANCHOR_LAB[None, None, :, :]) ** 2).sum(axis=3) # (件数, 色の数, 基準色の数)
+            vectors = np.einsum("ij,ijk->ik", weights, np.exp(-squared / (2 * ANCHOR_SIGMA ** 2))).astype(np.float32)
+            items = np.zeros(count, ITEM_DTYPE)
+            items["item_id"] = [f"item-{start + i}".encode("utf-8") for i in range(count)]
+            items["rgb"] = rgb
+            items["percentage"] = percentage
+            items_file.write(items.tobytes())
+            vectors_file.write(vectors.tobytes())
@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+import numpy as np
+from urllib.parse import parse_qs, urlsplit
+from benchmarks.__main__ import summarize
+
+
+# 複数ワーカーのサーバーに同時にリクエストを送る負荷試験
+#
+# uvicornのワーカー数、ワーカー1つあたりの画像処理ワーカー数（EXECUTOR_WORKERS）、
+# BLAS/OpenMPとOpenCVのスレッド数（BLAS_THREADS, OPENCV_THREADS）の組み合わせごとにサーバーを起動し、
+# 同時接続数を変えながら一定時間 /uploadfile/ を送り続けて、スループット・p50/p95/p99・エラー率・CPU使用率を測る。
+# 同じコア数で「プロセス数×スレッド数」をどう分けるのが一番速いかを選ぶために使う。
+#
+# 使い方:
+#   pip install -r benchmarks/requirements.txt
+#   python -m benchmarks.load --workers 1,2,4 --threads 0,1 --concurrency 1,4,16 --duration 20 --save load.json
+#
+# CPU使用率はLinuxの /proc から読むので、それ以外のOSでは表示されない。
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTENT_TYPE = "image/jpeg"
+
+def parse_int_list(value: str) -> list[int]:
+    """"1,2,4" のようなカンマ区切りの整数のリスト。"""
+    try:
+        return [int(item) for item in value.split(",") if item.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"カンマ区切りの整数で指定してください: {value}")
+
+def parse_mix(value: str) -> dict[str, float]:
+    """"0.3mp:6,2mp:3,12mp:1" のような {解像度: 重み}。"""
+    from benchmarks.corpus import RESOLUTIONS
+
+    mix = {}
+    for item in value.split(","):
+        resolution, _, weight = item.strip().partition(":")
+        if resolution not in RESOLUTIONS:
+            raise argparse.ArgumentTypeError(f"解像度は {', '.join(RESOLUTIONS)} のいずれかにしてください: {resolution}")
+        try:
+            mix[resolution] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"重みは数値で指定してください: {item}")
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("画像の組み合わせを1つ以上指定してください。")
+    return mix
+
+def single_worker_reason(path: str) -> str | None:
+    """
+    uvicornのワーカーが1つでないと正しく動かないパスなら、その理由を返す。
+    ジョブの状態とプレビュー画像はワーカーごとのメモリにあるので、ワーカーが複数だと結果の取得が別のプロセスに届いて404になる。
+    """
+    parts = urlsplit(path)
+    endpoint = parts.path.rstrip("/")
+    if endpoint == "/jobs" or endpoint.startswith("/jobs/"):
+        return "ジョブの状態はuvicornのワーカーごとのメモリにあります"
+    if endpoint.startswith("/preview/") or parse_qs(parts.query).get("preview", ["false"])[-1].lower() in ("true", "1", "yes", "on"):
+        return "プレビュー画像はuvicornのワーカーごとのメモリにあります"
+    return None
+
+def build_images(mix: dict[str, float]) -> tuple[list[tuple[str, bytes]], np.ndarray]:
+    """組み合わせの各解像度の写真風のJPEGを作り、(名前, バイト列) のリストと選ぶ確率を返す。"""
+    from benchmarks.corpus import RESOLUTIONS, ImageSpec, encode_image, render_image
+
+    images = []
+    for resolution in mix:
+        spec = ImageSpec(f"photo_{resolution}_jpeg", *RESOLUTIONS[resolution], "photo", "jpeg")
+        images.append((spec.name, encode_image(spec, render_image(spec))))
+    weights = np.array(list(mix.values()), dtype=np.float64)
+    return images, weights / weights.sum()
+
+
+# --- CPU使用率（/proc） ---
+
+def process_tree_cpu_seconds(root_pid: int) -> float | None:
+    """root_pidとその子孫のプロセス（uvicornのワーカー、画像処理のワーカー）が使ったCPU時間の合計（秒）。"""
+    if not os.path.isdir("/proc"):
+        return None
+    children, ticks = {}, {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue # 読んでいる間に終了したプロセス
+        # プロセス名に空白や括弧が入ることがあるので、最後の ")" より後ろを項目に分ける
+        fields = stat[stat.rfind(")") + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        # utime, stime, cutime, cstime（終了して回収された子プロセスの分も含める）
+        ticks[int(entry)] = sum(int(value) for value in fields[11:15])
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += ticks.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total / os.sysconf("SC_CLK_TCK")
+
+def system_cpu_ticks() -> tuple[int, int] | None:
+    """マシン全体の (使用中のティック数, 全ティック数)。"""
+    try:
+        with open("/proc/stat") as f:
+            values = [int(value) for value in f.readline().split()[1:]]
+    except OSError:
+        return None
+    idle = values[3] + (values[4] if len(values) > 4 else 0) # idle + iowait
+    return sum(values) - idle, sum(values)
+
+class CpuMeter:
+    """計測区間のサーバー・負荷をかける側（このプロセス）・マシン全体のCPU使用量を測る。"""
+
+    def __init__(self, server_pid: int):
+        self.server_pid = server_pid
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.server = process_tree_cpu_seconds(self.server_pid)
+        self.client = sum(os.times()[:2])
+        self.system = system_cpu_ticks()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.started
+        server = process_tree_cpu_seconds(self.server_pid)
+        system = system_cpu_ticks()
+        self.result = {
+            # 平均で何コア分使ったか
+            "server_cpu_cores": round((server - self.server) / wall, 2) if server is not None and self.server is not None else None,
+            "client_cpu_cores": round((sum(os.times()[:2]) - self.client) / wall, 2),
+            "system_cpu_percent": (
+                round((system[0] - self.system[0]) / max(1, system[1] - self.system[1]) * 100, 1)
+                if system is not None and self.system is not None else None
+            ),
+        }
+        return False
+
+
+# --- サーバーの起動と停止 ---
+
+def start_server(profile: dict, port: int) -> subprocess.Popen:
+    """プロファイルの設定でuvicornを起動する（準備ができるのは wait_until_ready の後）。"""
+    env = {
+        **os.environ,
+        "EXECUTOR_WORKERS": str(profile["executor_workers"]),
+        "BLAS_THREADS": str(profile["blas_threads"]),
+        "OPENCV_THREADS": str(profile["opencv_threads"]),
+        # 同じ画像を繰り返し送るので、キャッシュを無効にして毎回パイプラインを実行させる
+        "CACHE_MAX_ENTRIES": "0",
+    }
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(profile["workers"]), "--log-level", "warning",
+    ]
+    # 止めるときにワーカーごとまとめてシグナルを送れるよう、新しいプロセスグループで起動する
+    return subprocess.Popen(command, env=env, cwd=REPO_ROOT, start_new_session=True)
+
+async def wait_until_ready(base_url: str, workers: int, timeout: float) -> float:
+    """
+    /readyz が続けて200を返すまで待つ（ワーカーごとにウォームアップが終わる時刻が違うので、何回か続けて確認する）。
+
+    Returns:
+        float: 準備ができるまでの秒数。
+    """
+    import httpx
+
+    started = time.perf_counter()
+    streak = 0
+    # 接続を使い回すと同じワーカーにしか届かないので、毎回新しく接続する
+    async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_keepalive_connections=0), timeout=5) as client:
+        while streak < workers * 5:
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"サーバーが{timeout:.0f}秒以内に準備できませんでした。")
+            try:
+                response = await client.get("/readyz")
+                streak = streak + 1 if response.status_code == 200 else 0
+            except httpx.TransportError:
+                streak = 0
+            if streak == 0:
+                await asyncio.sleep(0.2)
+    return time.perf_counter() - started
+
+def stop_server(process: subprocess.Popen) -> None:
+    """サーバーとそのワーカーを止める（応答しなければ強制終了する）。"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+# --- 負荷をかける ---
+
+async def run_level(base_url: str, images, probabilities, concurrency: int, duration: float, warmup: float, path: str, seed: int) -> dict:
+    """
+    concurrency個のクライアントが、応答を受け取ったらすぐ次を送る（クローズドループ）形で一定時間リクエストを送り続ける。
+    最初のwarmup秒の結果は集計しない。
+    """
+    import httpx
+
+    samples, statuses = [], {}
+    rng = np.random.default_rng(seed)
+    choices = rng.choice(len(images), size=100_000, p=probabilities) # 画像の順番をシードで固定する
+    counter = itertools.count()
+    started = time.perf_counter()
+    measure_from, measure_until = started + warmup, started + warmup + duration
+
+    async def client_loop(client):
+        while time.perf_counter() < measure_until:
+            name, contents = images[choices[next(counter) % len(choices)]]
+            sent = time.perf_counter()
+            try:
+                response = await client.post(path, files={"file": (f"{name}.jpg", contents, CONTENT_TYPE)})
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            received = time.perf_counter()
+            if sent >= measure_from and received <= measure_until:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == "200":
+                    samples.append(received - sent)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+
+    total = sum(statuses.values())
+    stats = summarize(samples, duration) if samples else {"runs": 0, "throughput_per_s": 0.0}
+    return {
+        **stats,
+        "requests": total,
+        "error_rate": round(1 - len(samples) / total, 4) if total else None,
+        "statuses": statuses, # 503は受け付け制御による拒否
+    }
+
+def sweep_profiles(args) -> list[dict]:
+    """掃引するサーバーの設定の組み合わせ。"""
+    cpu_count = os.cpu_count() or 1
+    profiles = []
+    for workers, executor_workers, blas_threads, opencv_threads in itertools.product(
+        args.workers, args.executor_workers or [0], args.blas_threads or args.threads, args.opencv_threads or args.threads,
+    ):
+        profiles.append({
+            "workers": workers,
+            # 0の場合は、uvicornのワーカー全体でCPUコア数になるように分ける
+            "executor_workers": executor_workers or max(1, cpu_count // workers),
+            "blas_threads": blas_threads,
+            "opencv_threads": opencv_threads,
+        })
+    return profiles
+
+def profile_label(profile: dict) -> str:
+    """表に表示する設定の名前（例: "w2×e4 blas=1 cv=既定"）。"""
+    blas, opencv = (str(n) if n > 0 else "既定" for n in (profile["blas_threads"], profile["opencv_threads"]))
+    return f"w{profile['workers']}×e{profile['executor_workers']} blas={blas} cv={opencv}"
+
+def recommend(results: list[dict], slo_ms: float | None, max_error_rate: float) -> dict[int, dict]:
+    """同時接続数ごとに、p99とエラー率の条件を満たす中で最もスループットが高い設定を選ぶ。"""
+    best = {}
+    for result in results:
+        stats = result["stats"]
+        if stats["runs"] == 0 or stats["error_rate"] > max_error_rate:
+            continue
+        if slo_ms is not None and stats["p99_ms"] > slo_ms:
+            continue
+        current = best.get(result["concurrency"])
+        if current is None or stats["throughput_per_s"] > current["stats"]["throughput_per_s"]:
+            best[result["concurrency"]] = result
+    return best
+
+async def run(args) -> list[dict]:
+    images, probabilities = build_images(args.mix)
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    for profile in sweep_profiles(args):
+        print(f"サーバーを起動中: {profile_label(profile)}", file=sys.stderr)
+        process = start_server(profile, args.port)
+        try:
+            ready_seconds = await wait_until_ready(base_url, profile["workers"], args.startup_timeout)
+            for concurrency in args.concurrency:
+                with CpuMeter(process.pid) as cpu:
+                    stats = await run_level(base_url, images, probabilities, concurrency, args.duration, args.warmup, args.path, args.seed)
+                results.append({"profile": profile, "concurrency": concurrency, "ready_seconds": round(ready_seconds, 2), "stats": stats, "cpu": cpu.result})
+                print(f"  同時接続{concurrency}: {stats['throughput_per_s']}件/秒", file=sys.stderr)
+        finally:
+            stop_server(process)
+    return results
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description="複数ワーカーのサーバーの負荷試験")
+    parser.add_argument("--workers", type=parse_int_list, default=[1, 2], help="uvicornのワーカー数（カンマ区切りで複数）")
+    parser.add_argument("--executor-workers", type=parse_int_list, help="uvicornのワーカー1つあたりの画像処理ワーカー数（0でCPUコア数÷ワーカー数）")
+    parser.add_argument("--threads", type=parse_int_list, default=[0, 1], help="BLAS/OpenMPとOpenCVのスレッド数（0でライブラリの既定値）")
+    parser.add_argument("--blas-threads", type=parse_int_list, help="BLAS/OpenMPのスレッド数だけを別に掃引する場合")
+    parser.add_argument("--opencv-threads", type=parse_int_list, help="OpenCVのスレッド数だけを別に掃引する場合")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 4, 16], help="同時接続数（カンマ区切りで複数）")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("0.3mp:6,2mp:3,12mp:1"), help="画像の解像度と送る割合（解像度:重み）")
+    parser.add_argument("--duration", type=float, default=20, help="同時接続数ごとに計測する秒数")
+    parser.add_argument("--warmup", type=float, default=3, help="計測の前に集計せずに送る秒数")
+    parser.add_argument("--path", default="/uploadfile/", help="送り先のパス（クエリ文字列を含めてもよい）")
+    parser.add_argument("--port", type=int, default=8765, help="起動するサーバーのポート")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="サーバーの準備ができるまで待つ最大秒数")
+    parser.add_argument("--slo-ms", type=float, help="おすすめの設定を選ぶときのp99の上限（ミリ秒）")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="おすすめの設定を選ぶときのエラー率の上限")
+    parser.add_argument("--seed", type=int, default=0, help="送る画像の順番を決める乱数のシード")
+    parser.add_argument("--save", help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+    reason = single_worker_reason(args.path)
+    if reason is not None and any(workers != 1 for workers in args.workers):
+        parser.error(f"{args.path} は --workers 1 でのみ計測できます（{reason}）。")
+
+    results = asyncio.run(run(args))
+
+    print(f"{'設定':<34} {'同時':>5} {'件/秒':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'エラー':>7} {'CPU(コア)':>9} {'CPU%':>6}")
+    for result in results:
+        stats, cpu = result["stats"], result["cpu"]
+        latency = " ".join(f"{stats[key]:>9.1f}" if key in stats else f"{'-':>9}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        server_cores = f"{cpu['server_cpu_cores']:>9.2f}" if cpu["server_cpu_cores"] is not None else f"{'-':>9}"
+        system_percent = f"{cpu['system_cpu_percent']:>6.1f}" if cpu["system_cpu_percent"] is not None else f"{'-':>6}"
+        error_rate = f"{stats['error_rate'] * 100:>6.1f}%" if stats["error_rate"] is not None else f"{'-':>7}"
+        print(f"{profile_label(result['profile']):<34} {result['concurrency']:>5} {stats['throughput_per_s']:>8.2f} {latency} {error_rate} {server_cores} {system_percent}")
+
+    best = recommend(results, args.slo_ms, args.max_error_rate)
+    print(f"\nおすすめの設定（CPUコア数 {os.cpu_count()}）:")
+    for concurrency in args.concurrency:
+        result = best.get(concurrency)
+        if result is None:
+            print(f"  同時接続{concurrency}: 条件を満たす設定がありません")
+        else:
+            print(f"  同時接続{concurrency}: {profile_label(result['profile'])}（{result['stats']['throughput_per_s']}件/秒, p99 {result['stats']['p99_ms']}ms）")
+
+    if args.save:
+        report = {
+            "mix": args.mix,
+            "duration": args.duration,
+            "path": args.path,
+            "environment": {"python": platform.python_version(), "machine": platform.machine(), "cpu_count": os.cpu_count()},
+            "results": results,
+            "recommended": {str(concurrency): result["profile"] for concurrency, result in best.items()},
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import pytest
+from app.admission import AdmissionController, AdmissionRejectedError
+
+
+def _controller(**kwargs) -> AdmissionController:
+    return AdmissionController(**{"max_workers": 2, "max_requests": 10, "max_cost": 10.0, "initial_seconds_per_cost": 0.1, **kwargs})
+
+def test_levels_rise_with_load():
+    controller = _controller()
+    first = controller.admit(4.0, deadline_seconds=10)
+    assert first.level == 0 and first.overrides == {}
+    second = controller.admit(1.0, deadline_seconds=10) # 負荷40%
+    assert second.level == 0
+    third = controller.admit(1.0, deadline_seconds=10) # 負荷50%
+    assert third.level == 1 and third.overrides["preview_format"] is None
+    assert controller.inflight_cost == pytest.approx(4.0 + 1.0 + 0.9)
+
+def test_short_deadline_degrades_instead_of_rejecting():
+    controller = _controller()
+    # レベル0では0.1秒、レベル2では0.05秒かかる見積もり
+    assert controller.admit(1.0, deadline_seconds=0.06).level == 2
+
+def test_rejects_with_retry_after_and_releases_cost():
+    controller = _controller(max_requests=1)
+    with controller.admit(30.0, deadline_seconds=100): # 何も実行していなければ上限を超える画像も受け付ける
+        with pytest.raises(AdmissionRejectedError) as excinfo:
+            controller.admit(1.0, deadline_seconds=100)
+        assert excinfo.value.retry_after == 2 # 実行中のコスト30 / 2ワーカー × 0.1秒 = 1.5秒を切り上げ
+    assert controller.inflight_cost == 0
+    assert controller.stats()["rejected"] == 1
+
+def test_release_updates_seconds_per_cost():
+    controller = _controller()
+    with controller.admit(2.0, deadline_seconds=10) as ticket:
+        ticket.compute_seconds = 1.0 # コスト1あたり0.5秒
+    assert controller.seconds_per_cost == pytest.approx(0.8 * 0.1 + 0.2 * 0.5)
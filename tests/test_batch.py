@@ -0,0 +1,29 @@
+import io
+import zipfile
+import pytest
+from fastapi import HTTPException
+from app import config
+from app.main import _extract_zip
+
+
+def _zip(members: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def test_extract_zip_skips_directories_and_hidden_files():
+    contents = _zip({"a.jpg": b"1", "dir/b.png": b"2", "__MACOSX/._a.jpg": b"", "dir/.DS_Store": b""})
+    assert _extract_zip(contents) == [("a.jpg", "image/jpeg", b"1"), ("dir/b.png", "image/png", b"2")]
+
+@pytest.mark.parametrize("setting, value, members", [
+    ("BATCH_MAX_FILES", 2, {f"{i}.jpg": b"x" for i in range(3)}),
+    ("MAX_UPLOAD_BYTES", 1000, {"bomb.jpg": b"\x00" * 1001}), # 圧縮後は小さくても展開後の大きさで判定する
+    ("BATCH_MAX_UPLOAD_BYTES", 1500, {"a.jpg": b"\x00" * 1000, "b.jpg": b"\x00" * 1000}),
+])
+def test_extract_zip_limits(monkeypatch, setting, value, members):
+    monkeypatch.setattr(config, setting, value)
+    with pytest.raises(HTTPException) as excinfo:
+        _extract_zip(_zip(members))
+    assert excinfo.value.status_code == 413
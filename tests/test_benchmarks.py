@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from app.palette_index import PaletteIndex
+from benchmarks.corpus import PROFILES, SEARCH_INDEX_ROWS, build_search_index
+from benchmarks.load import main as load_main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ベンチマークがすべてのプロファイルで最後まで動くかの確認（性能は見ない）
+# 設定値は import 時に環境変数から読まれるので、別プロセスで実行する
+# fullプロファイルは48MPの画像を含み数十秒かかるうえメモリも使うので、RUN_SLOW_TESTS=1 のときだけ実行する
+RUN_SLOW_TESTS = os.environ.get("RUN_SLOW_TESTS") == "1"
+
+@pytest.mark.parametrize("profile", [
+    pytest.param(profile, marks=pytest.mark.skipif(profile != "quick" and not RUN_SLOW_TESTS, reason="RUN_SLOW_TESTS=1 で実行"))
+    for profile in sorted(PROFILES)
+])
+def test_benchmark_profile_runs(profile, tmp_path):
+    report_path = tmp_path / "report.json"
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks", "--profile", profile, "--repeat", "1", "--save", str(report_path)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=600,
+    )
+    assert completed.returncode == 0, completed.stderr[-2000:]
+    with open(report_path, encoding="utf-8") as f:
+        results = json.load(f)["results"]
+    # エンドポイントのベンチマークには、ワーカーのメモリ使用量も入る（/procが使える環境のみ）
+    if os.path.exists("/proc/self/clear_refs"):
+        assert all("worker_peak_rss_mb" in stats for name, stats in results.items() if name.startswith("uploadfile/"))
+    assert f"search/{SEARCH_INDEX_ROWS[profile]}" in results
+
+def test_synthetic_search_index_matches_palette_index(tmp_path):
+    # まとめて計算したベクトルが、PaletteIndex.add と同じ値になっていること
+    build_search_index(str(tmp_path), 50)
+    index = PaletteIndex(str(tmp_path))
+    assert len(index) == 50
+    for row in (0, 17, 49):
+        item = index._items[row]
+        colors = [{"rgb": tuple(int(v) for v in rgb), "percentage": float(p)} for rgb, p in zip(item["rgb"], item["percentage"])]
+        best = index.search(colors, top_n=1)[0]
+        assert best["item_id"] == f"item-{row}"
+        assert best["distance"] < 1e-3
+
+@pytest.mark.parametrize("path", ["/jobs?num_colors=auto", "/uploadfile/?preview=true"])
+def test_load_refuses_multiple_workers_for_per_process_state(path, capsys):
+    # ジョブの状態とプレビュー画像はワーカーごとのメモリにあるので、ワーカーが複数だと計測できない
+    with pytest.raises(SystemExit):
+        load_main(["--path", path, "--workers", "1,2"])
+    assert "--workers 1" in capsys.readouterr().err
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from app.cache import ResultCache
+
+
+async def _value(value: dict) -> dict:
+    return value
+
+def test_make_key_depends_on_contents_and_params():
+    key = ResultCache.make_key(b"image", {"engine": "kmeans", "num_colors": 3})
+    assert key == ResultCache.make_key(b"image", {"num_colors": 3, "engine": "kmeans"}) # 辞書の順番によらない
+    assert key != ResultCache.make_key(b"image", {"engine": "histogram", "num_colors": 3})
+    assert key != ResultCache.make_key(b"other", {"engine": "kmeans", "num_colors": 3})
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = ResultCache(max_entries=2, ttl_seconds=10)
+    cache.put("a", {"v": 1}, stored_at=1000.0)
+    cache.put("b", {"v": 2}, stored_at=1000.0)
+    monkeypatch.setattr("app.cache.time.time", lambda: 1005.0)
+    assert cache.get("a") == {"v": 1} # aを最近使ったのでbが先に追い出される
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None and cache.stats()["evictions"] == 1
+    monkeypatch.setattr("app.cache.time.time", lambda: 1011.0)
+    assert cache.get("a") is None # 期限切れ
+
+def test_concurrent_requests_are_coalesced():
+    async def run():
+        cache = ResultCache()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"v": calls}
+
+        results = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+        return results, calls, cache.stats()
+
+    results, calls, stats = asyncio.run(run())
+    assert results == [{"v": 1}] * 5
+    assert calls == 1 and stats["coalesced"] == 4
+
+def test_cancelled_request_does_not_fail_coalesced_waiters():
+    async def run():
+        cache = ResultCache()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"v": calls}
+
+        first = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        first.cancel() # 最初のクライアントが切断した
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second, calls
+
+    result, calls = asyncio.run(run())
+    assert result == {"v": 2} # 待っていた側が計算し直す
+    assert calls == 2
+
+def test_errors_and_degraded_results_are_not_cached(tmp_path):
+    async def run():
+        cache = ResultCache(disk_dir=str(tmp_path))
+        await cache.get_or_compute("error", lambda: _value({"error": "x"}))
+        await cache.get_or_compute("degraded", lambda: _value({"degradation_level": 2}))
+        await cache.get_or_compute("ok", lambda: _value({"v": 1}))
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.get("error") is None and cache.get("degraded") is None
+    # ディスクに保存した結果は、メモリのキャッシュがない別のインスタンスからも読める
+    assert asyncio.run(ResultCache(disk_dir=str(tmp_path)).get_or_compute("ok", lambda: _value({"v": 2}))) == {"v": 1}
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from app.color_classifier import COLOR_NAMES, get_palette, load_palette
+from app.color_lut import LUT_LEVELS, build_color_lut, classify_pixels, color_name_distribution, load_color_lut
+
+
+@pytest.fixture(scope="module")
+def lut():
+    return build_color_lut()
+
+def test_lut_matches_palette_at_level_centres(lut):
+    # 変換表の各段階の中央の値は、パレットの最近傍探索と同じ系統になる
+    rng = np.random.default_rng(0)
+    step = 256 // LUT_LEVELS
+    rgb = (rng.integers(0, LUT_LEVELS, (500, 3)) * step + step // 2).astype(np.uint8)
+    palette = get_palette()
+    assert np.array_equal(classify_pixels(rgb), palette.families[palette.match(rgb)])
+
+@pytest.mark.parametrize("rgb, name", [((0, 0, 0), "黒"), ((255, 255, 255), "白"), ((220, 20, 30), "赤"), ((20, 40, 200), "青")])
+def test_classify_pixels_basic_colors(rgb, name):
+    assert COLOR_NAMES[classify_pixels(np.array([rgb], np.uint8))[0]] == name
+
+def test_color_name_distribution():
+    pixels = np.array([(0, 0, 0)] * 3 + [(255, 255, 255)], np.uint8)
+    assert color_name_distribution(pixels) == [{"name": "黒", "percentage": 75.0}, {"name": "白", "percentage": 25.0}]
+    assert color_name_distribution(np.zeros((0, 3), np.uint8)) == []
+
+def test_load_color_lut_saves_and_rebuilds_on_version_change(tmp_path, lut):
+    path = str(tmp_path / "lut.npy")
+    assert np.array_equal(load_color_lut(path), lut)
+    assert isinstance(load_color_lut(path), np.memmap) # 2回目は保存したファイルをメモリマップで開く
+    (tmp_path / "lut.npy.version").write_text("old")
+    np.save(path, np.zeros_like(lut))
+    assert np.array_equal(load_color_lut(path), lut) # パレットの版が違えば作り直す
+
+def test_load_palette_rejects_invalid_entries(tmp_path):
+    path = tmp_path / "palette.yaml"
+    path.write_text("colors:\n  紺碧: [{name: x, lab: [0, 0, 0]}]\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="系統"):
+        load_palette(str(path))
+    path.write_text("colors:\n  黒: [{name: x, lab: [0, 0]}]\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="lab"):
+        load_palette(str(path))
+    path.write_text("colors:\n  黒: [{name: x, lab: [0, 0, 0]}]\n  白: [{name: x, lab: [100, 0, 0]}]\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="同じ色名"):
+        load_palette(str(path))
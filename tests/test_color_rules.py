@@ -0,0 +1,64 @@
+import logging
+import os
+import pytest
+from app import color_combinations, config
+from app.color_combinations import DEFAULT_RULES_PATH, load_rules
+
+
+def _write(path, text: str) -> str:
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+RULES = """
+categories:
+  ニュートラル: [黒, 白]
+  暖色: [赤]
+complementary:
+  赤: 緑
+rules:
+  - when: {main: [赤], secondary_category: [ニュートラル]}
+    say: "{main}と{secondary}は定番の組み合わせです。"
+  - when: {main: [赤]}
+    say: "{main}の補色は{complementary}です。"
+  - when: {main: [緑]}
+    say: "{main}の補色は{complementary}です。" # 緑の補色は書いていないので使われない
+fallback: 提案なし
+"""
+
+def test_load_rules_builds_table_in_rule_order(tmp_path):
+    rules = load_rules(_write(tmp_path / "rules.yaml", RULES))
+    assert rules.table[("赤", "白")] == ("赤と白は定番の組み合わせです。", "赤の補色は緑です。")
+    assert rules.table[("赤", None)] == ("赤の補色は緑です。",) # 2番目の色の条件は2番目の色がなければ満たさない
+    assert rules.table[("緑", "赤")] == ("提案なし",)
+    assert rules.categories["黒"] == "ニュートラル"
+
+@pytest.mark.parametrize("text, message", [
+    ("rules:\n  - when: {main: [赤]}\n", "say"),
+    ("rules:\n  - when: {colour: [赤]}\n    say: x\n", "不明な条件"),
+    ("rules:\n  - say: '{third}'\n", "使えない変数"),
+    ("pair_rules:\n  - when: {same_colour: true}\n    say: x\n", "不明な条件"),
+])
+def test_load_rules_rejects_invalid_rules(tmp_path, text, message):
+    with pytest.raises(ValueError, match=message):
+        load_rules(_write(tmp_path / "rules.yaml", text))
+
+def test_default_rules_compile():
+    rules = load_rules(DEFAULT_RULES_PATH)
+    assert rules.table and rules.pair_table
+
+def test_get_rules_reloads_and_keeps_previous_rules_on_error(tmp_path, monkeypatch, caplog):
+    path = _write(tmp_path / "rules.yaml", RULES)
+    monkeypatch.setattr(config, "COLOR_RULES_PATH", path)
+    monkeypatch.setattr(color_combinations, "RULES_RELOAD_INTERVAL", 0)
+    monkeypatch.setattr(color_combinations, "_rules", None)
+    assert color_combinations.get_rules().fallback == "提案なし"
+
+    _write(tmp_path / "rules.yaml", RULES.replace("提案なし", "なし"))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000)) # 同じ時刻に書き換えた場合でも更新日時が変わるように
+    assert color_combinations.get_rules().fallback == "なし"
+
+    _write(tmp_path / "rules.yaml", "rules: [")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    with caplog.at_level(logging.WARNING, logger="app.color_combinations"):
+        assert color_combinations.get_rules().fallback == "なし"
+    assert "前回のルールを使います" in caplog.text
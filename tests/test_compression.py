@@ -0,0 +1,88 @@
+import gzip
+import brotli
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+from app.compression import CompressionMiddleware, asset_response, choose_encoding, compress_bytes, precompress
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, br", "br"), # 同じq値ならサーバーの優先順
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=0, gzip;q=0", None),
+    ("*", "br"),
+    ("*;q=0.1, gzip;q=0", "br"),
+    ("gzip;q=abc, br;q=0.2", "br"), # 読めないq値は0とみなす
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding) == expected
+
+def test_choose_encoding_respects_available_encodings():
+    assert choose_encoding("br, gzip;q=0.5", ("gzip",)) == "gzip"
+    assert choose_encoding("br", ()) is None
+
+def test_compress_bytes_round_trip():
+    data = b'{"name": "red"}' * 100
+    assert gzip.decompress(compress_bytes(data, "gzip")) == data
+    assert brotli.decompress(compress_bytes(data, "br")) == data
+
+def test_asset_response_etag_and_not_modified():
+    asset = precompress(b"<html>" + b"x" * 4000 + b"</html>", "text/html")
+    response = asset_response(asset, "gzip, br", None)
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.body == asset.variants["br"]
+    etag = response.headers["etag"]
+
+    assert asset_response(asset, "gzip, br", f'"other", W/{etag}').status_code == 304 # 弱いETagに書き換えられても一致する
+    assert asset_response(asset, "gzip", etag).status_code == 200 # 圧縮方式が違えばETagも違う
+    identity = asset_response(asset, None, None)
+    assert "content-encoding" not in identity.headers
+    assert identity.body == asset.variants["identity"]
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/large")
+    def large():
+        return Response(b"a" * 1000, media_type="application/json", headers={"Vary": "Accept"})
+
+    @app.get("/small")
+    def small():
+        return Response(b"{}", media_type="application/json")
+
+    @app.get("/image")
+    def image():
+        return Response(b"\xff" * 1000, media_type="image/jpeg")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse((b'{"index": %d}\n' % i for i in range(3)), media_type="application/x-ndjson")
+
+    return TestClient(app)
+
+def test_middleware_compresses_large_responses(client):
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept, Accept-Encoding"
+    assert "compress;dur=" in response.headers["server-timing"]
+    assert response.content == b"a" * 1000
+
+def test_middleware_skips_small_and_incompressible_responses(client):
+    for path in ("/small", "/image"):
+        response = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+        assert "content-encoding" not in response.headers
+    assert "content-encoding" not in client.get("/large", headers={"Accept-Encoding": "identity"}).headers
+
+def test_middleware_compresses_streaming_responses(client):
+    response = client.get("/stream", headers={"Accept-Encoding": "br"})
+    assert response.headers["content-encoding"] == "br"
+    assert "content-length" not in response.headers
+    assert response.text.splitlines() == ['{"index": 0}', '{"index": 1}', '{"index": 2}']
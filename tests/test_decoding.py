@@ -0,0 +1,52 @@
+import struct
+import cv2
+import numpy as np
+import pytest
+from app.decoding import ImageHeader, ImageTooLargeError, check_image_size, choose_decode_flag, read_image_header
+
+
+def _encode(ext: str, width: int, height: int) -> bytes:
+    is_success, buffer = cv2.imencode(ext, np.zeros((height, width, 3), np.uint8))
+    assert is_success
+    return buffer.tobytes()
+
+@pytest.mark.parametrize("ext, image_format", [(".png", "png"), (".jpg", "jpeg")])
+def test_read_image_header(ext, image_format):
+    assert read_image_header(_encode(ext, 320, 200)) == ImageHeader(image_format, 320, 200)
+
+def test_read_image_header_skips_jpeg_segments_and_fill_bytes():
+    # APP0セグメントと埋め草の0xFFの後にSOF2（プログレッシブ）がある
+    app0 = b"\xff\xe0" + struct.pack(">H", 6) + b"JFIF"
+    sof2 = b"\xff\xc2" + struct.pack(">HBHH", 11, 8, 480, 640) + b"\x03"
+    assert read_image_header(b"\xff\xd8" + app0 + b"\xff" + sof2) == ImageHeader("jpeg", 640, 480)
+
+@pytest.mark.parametrize("contents", [
+    b"",
+    b"GIF89a" + b"\x00" * 32,
+    b"\x89PNG\r\n\x1a\n\x00\x00", # IHDRまで届いていない
+    b"\xff\xd8\xff\xe0\x00\x10", # SOFの前で途切れている
+    b"\xff\xd8\xff\xda\x00\x08" + b"\x00" * 8, # SOFより先に画像データが始まる
+    b"\xff\xd8\x00\x00\x00\x00", # マーカーの位置が0xFFでない
+])
+def test_read_image_header_rejects_unknown_or_broken(contents):
+    assert read_image_header(contents) is None
+
+def test_check_image_size():
+    contents = _encode(".png", 2000, 1000) # 2メガピクセル
+    check_image_size(contents, 2)
+    check_image_size(contents, 0) # 0以下は確認しない
+    check_image_size(b"not an image", 1) # ヘッダーを読めない形式はデコード時の上限に任せる
+    with pytest.raises(ImageTooLargeError):
+        check_image_size(contents, 1.5)
+
+@pytest.mark.parametrize("header, target_width, expected", [
+    (ImageHeader("jpeg", 4000, 3000), 300, "jpeg_reduced_8"),
+    (ImageHeader("jpeg", 4000, 3000), 500, "jpeg_reduced_4"),
+    (ImageHeader("jpeg", 3000, 4000), 1500, "jpeg_reduced_2"), # 縦長でも短い辺で判定する
+    (ImageHeader("jpeg", 640, 480), 400, "full"),
+    (ImageHeader("png", 8000, 6000), 300, "full"), # PNGは縮小デコードできない
+    (None, 300, "full"),
+])
+def test_choose_decode_flag(header, target_width, expected):
+    _, strategy = choose_decode_flag(header, target_width)
+    assert strategy == expected
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+import pytest
+from app.executor import ExecutorSaturatedError, PipelineExecutor
+
+
+def test_rejects_when_workers_and_queue_are_full():
+    async def run():
+        executor = PipelineExecutor(backend="thread", max_workers=1, max_queue=1)
+        release = threading.Event()
+        try:
+            running = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            assert executor.pending == 2
+            with pytest.raises(ExecutorSaturatedError):
+                await executor.run(sum, [1, 2])
+            release.set()
+            await asyncio.gather(*running)
+            assert executor.pending == 0
+            return await executor.run(sum, [1, 2], start=3) # 空いたら再び受け付ける
+        finally:
+            release.set()
+            executor.shutdown()
+
+    assert asyncio.run(run()) == 6
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        PipelineExecutor(backend="gpu")
+
+def test_cancelled_caller_keeps_slot_until_worker_finishes():
+    async def run():
+        executor = PipelineExecutor(backend="thread", max_workers=1, max_queue=0)
+        release = threading.Event()
+        try:
+            task = asyncio.create_task(executor.run(release.wait))
+            await asyncio.sleep(0.01)
+            task.cancel() # クライアントが切断しても、ワーカーでは処理が続いている
+            await asyncio.gather(task, return_exceptions=True)
+            assert executor.pending == 1
+            with pytest.raises(ExecutorSaturatedError):
+                await executor.run(sum, [1, 2])
+            release.set()
+            for _ in range(100):
+                if executor.pending == 0:
+                    break
+                await asyncio.sleep(0.01)
+            return executor.pending
+        finally:
+            release.set()
+            executor.shutdown()
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from app.image_processing import (
+    AUTO_MAX_COLORS, AUTO_NUM_COLORS, _percentage_errors, _refine_positions, _stratified_positions,
+    cluster_pixels, cluster_pixels_approx,
+)
+
+
+def _pixels(shares: dict[tuple[int, int, int], int], noise: float = 0.0) -> np.ndarray:
+    """色ごとのピクセル数から (ピクセル数, 3) の配列を作る（少しノイズを加えられる）。"""
+    rng = np.random.default_rng(0)
+    pixels = np.concatenate([np.tile(np.array(rgb, np.float64), (count, 1)) for rgb, count in shares.items()])
+    pixels += rng.normal(0, noise, pixels.shape)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+@pytest.mark.parametrize("engine", ["kmeans", "histogram"])
+def test_cluster_pixels_finds_colors_and_shares(engine):
+    pixels = _pixels({(200, 20, 20): 6000, (20, 20, 200): 3000, (240, 240, 240): 1000}, noise=3)
+    colors = cluster_pixels(pixels, num_colors=3, engine=engine)
+    assert [c.percentage for c in colors] == pytest.approx([60, 30, 10], abs=0.5)
+    assert np.abs(np.array(colors[0].rgb) - (200, 20, 20)).max() < 12
+
+def test_cluster_pixels_rejects_unknown_engine():
+    with pytest.raises(ValueError):
+        cluster_pixels(_pixels({(0, 0, 0): 10}), engine="median_cut")
+
+@pytest.mark.parametrize("engine", ["kmeans", "histogram"])
+def test_auto_num_colors(engine):
+    # 濃淡だけの違いは1色にまとめ、はっきり違う色は分ける
+    shades = _pixels({(30, 60, 160): 5000, (34, 64, 168): 5000}, noise=2)
+    assert len(cluster_pixels(shades, num_colors=AUTO_NUM_COLORS, engine=engine)) == 1
+    four = _pixels({(200, 20, 20): 3000, (20, 160, 20): 3000, (20, 20, 200): 2000, (240, 240, 240): 2000}, noise=3)
+    colors = cluster_pixels(four, num_colors=AUTO_NUM_COLORS, engine=engine)
+    assert len(colors) == 4 <= AUTO_MAX_COLORS
+
+def test_stratified_positions_cover_every_interval():
+    rng = np.random.default_rng(1)
+    positions = _stratified_positions(rng, 64)
+    assert np.array_equal(np.floor(positions * 64), np.arange(64)) # 各区間に1つずつ
+    refined = _refine_positions(rng, positions)
+    assert np.array_equal(refined[:64], positions) # 前のサンプルはそのまま使う
+    assert np.array_equal(np.sort(np.floor(refined * 128)), np.arange(128)) # 増やした後も区間ごとに1つずつ
+
+def test_percentage_errors():
+    errors = _percentage_errors(np.array([500, 500]), sample_size=1000, population=1_000_000)
+    assert errors == pytest.approx([1.96 * np.sqrt(0.25 / 1000) * 100] * 2, rel=1e-3)
+    assert np.allclose(_percentage_errors(np.array([500, 500]), 1000, 1000), 0) # 全数なら誤差は0
+
+def test_cluster_pixels_approx_error_bounds():
+    pixels = _pixels({(200, 20, 20): 140_000, (20, 20, 200): 60_000}, noise=3)
+    colors, sampling = cluster_pixels_approx(pixels, num_colors=2, engine="histogram", error_margin=2.0, time_budget=10)
+    assert sampling["stopped"] == "converged"
+    assert sampling["sample_size"] < sampling["population"]
+    assert sampling["max_percentage_error"] <= 2.0
+    for color, expected in zip(colors, (70, 30)):
+        assert abs(color.percentage - expected) <= color.percentage_error * 2 # 95%信頼区間の2倍には必ず収まる
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from app.palette_index import VECTOR_DIM, PaletteIndex, palette_vector
+
+
+RED_BLUE = [{"rgb": (200, 0, 0), "percentage": 50.1}, {"rgb": (0, 0, 200), "percentage": 49.9}]
+BLUE_RED = [{"rgb": (0, 0, 200), "percentage": 50.1}, {"rgb": (200, 0, 0), "percentage": 49.9}]
+GREEN = [{"rgb": (0, 160, 0), "percentage": 100.0}]
+
+def _distance(a: list[dict], b: list[dict]) -> float:
+    return float(np.linalg.norm(palette_vector(a) - palette_vector(b)))
+
+def test_palette_vector_is_order_invariant():
+    assert palette_vector(RED_BLUE).shape == (VECTOR_DIM,)
+    assert np.allclose(palette_vector(RED_BLUE), palette_vector(list(reversed(RED_BLUE))))
+    # 割合がほぼ同じ2色の順位が入れ替わっても、違う色の画像よりずっと近い
+    assert _distance(RED_BLUE, BLUE_RED) < _distance(RED_BLUE, GREEN) / 100
+
+def test_palette_vector_of_empty_palette_is_none():
+    assert palette_vector([]) is None
+    assert palette_vector([{"rgb": (0, 0, 0), "percentage": 0.0}]) is None
+
+def test_add_and_search(tmp_path):
+    index = PaletteIndex(str(tmp_path))
+    index.add("red-blue", RED_BLUE)
+    assert index.add_many([("green", GREEN), ("red-blue", RED_BLUE)]) == 3
+    results = index.search(BLUE_RED, top_n=5)
+    assert [r["item_id"] for r in results] == ["red-blue", "green"] # 同じ商品IDは1回だけ
+    assert results[0]["distance"] < results[1]["distance"]
+    assert index.search([], top_n=5) == []
+    assert len(PaletteIndex(str(tmp_path))) == 3 # ほかのプロセスから開いても同じ内容
+
+@pytest.mark.parametrize("item_id, colors", [(None, GREEN), ("", GREEN), ("x" * 200, GREEN), ("empty", [])])
+def test_add_rejects_invalid_items(tmp_path, item_id, colors):
+    index = PaletteIndex(str(tmp_path))
+    with pytest.raises(ValueError):
+        index.add(item_id, colors)
+    assert len(index) == 0
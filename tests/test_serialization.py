@@ -0,0 +1,49 @@
+import json
+import msgpack
+import pytest
+from fastapi import HTTPException
+from app import serialization
+from app.main import RESPONSE_FIELDS, _parse_fields, _pipeline_params, _select_fields
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, False),
+    ("application/json", False),
+    ("application/msgpack", True),
+    ("application/json;q=0.9, application/x-msgpack", True),
+    ("application/msgpack;q=0", False),
+    ("application/vnd.msgpack; q=0.0", False),
+])
+def test_wants_msgpack(accept, expected):
+    assert serialization.wants_msgpack(accept) is expected
+
+def test_render_json_and_msgpack():
+    body = {"name": "赤", "rgb": (1, 2, 3)}
+    response = serialization.render(body)
+    assert response.media_type == "application/json"
+    assert response.headers["vary"] == "Accept"
+    assert json.loads(response.body) == {"name": "赤", "rgb": [1, 2, 3]}
+    response = serialization.render(body, "application/msgpack", status_code=202, headers={"Location": "/jobs/1"})
+    assert (response.status_code, response.headers["location"]) == (202, "/jobs/1")
+    assert msgpack.unpackb(response.body) == {"name": "赤", "rgb": [1, 2, 3]}
+
+def test_parse_fields():
+    assert _parse_fields(None) is None
+    assert _parse_fields(" classified_colors,filename,classified_colors ") == ("classified_colors", "filename")
+    for fields in ("", ",", "classified_colors,unknown"):
+        with pytest.raises(HTTPException) as excinfo:
+            _parse_fields(fields)
+        assert excinfo.value.status_code == 400
+
+def test_select_fields():
+    body = {name: name for name in RESPONSE_FIELDS}
+    assert _select_fields(body, ("filename", "classified_colors")) == {"filename": "filename", "classified_colors": "classified_colors"}
+    assert _select_fields(body, None) is body
+    error = {"filename": "a.jpg", "error": "画像の読み込みに失敗しました。"}
+    assert _select_fields(error, ("classified_colors",)) is error # エラーの場合は絞らない
+
+def test_pipeline_params_only_computes_selected_outputs():
+    params = _pipeline_params(None, True, "jpeg", fields=("classified_colors",))
+    assert params["outputs"] == ("classified_colors",)
+    assert params["preview_format"] is None # preview_url を選ばなければサムネイルを作らない
+    assert _pipeline_params(None, True, "webp", fields=("preview_url",))["preview_format"] == "webp"
@@ -0,0 +1,52 @@
+import struct
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app import config
+from app.main import app
+from app.streaming import StreamSession
+
+
+def encode_png(width, height):
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    img[:, : width // 2] = (0, 0, 255)
+    img[:, width // 2 :] = (255, 0, 0)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+def png_header(width, height):
+    # ヘッダーだけのPNG（画素数の確認はデコードする前に行われる）
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = b"IHDR" + ihdr
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + chunk + struct.pack(">I", zlib.crc32(chunk))
+
+def test_tiny_frame_returns_error():
+    session = StreamSession(num_colors=3)
+    result = session.process_frame(encode_png(1, 2)) # 色の数より少ないピクセル
+    assert "error" in result
+    assert session.frames_processed == 0
+    assert "extracted_colors" in session.process_frame(encode_png(64, 48)) # 後のフレームは処理できる
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+def test_stream_continues_after_bad_frames(client, monkeypatch):
+    monkeypatch.setattr(config, "MAX_IMAGE_MEGAPIXELS", 1)
+    with client.websocket_connect("/ws/stream?num_colors=3") as websocket:
+        websocket.send_bytes(png_header(2000, 1000))
+        oversized = websocket.receive_json()
+        assert oversized["frame"] == 1
+        assert "大きすぎます" in oversized["error"]
+
+        websocket.send_bytes(encode_png(1, 2))
+        tiny = websocket.receive_json()
+        assert tiny["frame"] == 2
+        assert "小さすぎます" in tiny["error"]
+
+        websocket.send_bytes(encode_png(64, 48))
+        result = websocket.receive_json()
+        assert result["frame"] == 3
+        assert result["extracted_colors"]
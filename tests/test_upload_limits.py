@@ -0,0 +1,27 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from app.upload_limits import UploadSizeLimitMiddleware
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_bytes=100, path_limits={"/batch": 1000})
+
+    @app.post("/upload")
+    @app.post("/batch")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    return TestClient(app)
+
+def test_limit_by_content_length(client):
+    assert client.post("/upload", content=b"x" * 100).json() == {"size": 100}
+    response = client.post("/upload", content=b"x" * 101)
+    assert response.status_code == 413
+    assert client.post("/batch", content=b"x" * 500).status_code == 200 # パスごとの上限
+
+def test_limit_while_streaming_without_content_length(client):
+    chunks = (b"x" * 40 for _ in range(3)) # chunked転送（Content-Lengthなし）
+    assert client.post("/upload", content=chunks).status_code == 413